@@ -0,0 +1,242 @@
+# admission.py
+# Admission control, backpressure and token-bucket rate limiting for the Flask API.
+# Each endpoint gets a bounded number of in-flight requests and a bounded wait
+# queue; anything beyond that is rejected straight away so the server can answer
+# 429 + Retry-After instead of letting requests pile up on the model or the LLM.
+# Waiters are admitted in weighted fair order by role (see scheduler.py), and
+# when the queue is full a request may take the place of the waiter that would
+# be admitted last, so a student spike cannot lock doctors out.
+import heapq
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import scheduler
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+
+class AdmissionController:
+    """Bounded in-flight limit plus a bounded, time-limited wait queue served by role weight."""
+
+    def __init__(self, name, max_inflight, max_queue, queue_timeout, weights=None):
+        self.name = name
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._tags = scheduler.FairTags(scheduler.PRIORITY_WEIGHTS if weights is None else weights)
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._waiting = []   # heap of [tag, cls, enqueued, shed]
+        self._peak_waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._shed = 0
+        self._timed_out = 0
+        self._service_ewma = 0.0  # seconds, used to estimate Retry-After
+
+    def acquire(self, cls=None):
+        """Return True once a slot is held, False if the request must be shed.
+        cls is the requester's role; waiters are admitted in weighted fair order."""
+        with self._cond:
+            cls = self._tags.cls(cls)
+            if self._inflight < self.max_inflight and not self._waiting:
+                self._tags.classes[cls].queued += 1
+                self._admit([self._tags.tag(cls), cls, time.perf_counter(), False])
+                return True
+            if len(self._waiting) >= self.max_queue and not self._make_room(cls):
+                self._rejected += 1
+                return False
+            entry = [self._tags.tag(cls), cls, time.perf_counter(), False]
+            heapq.heappush(self._waiting, entry)
+            self._tags.classes[cls].queued += 1
+            self._peak_waiting = max(self._peak_waiting, len(self._waiting))
+            deadline = time.monotonic() + self.queue_timeout
+            while not entry[3] and (self._inflight >= self.max_inflight or self._waiting[0] is not entry):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(entry)
+                    self._timed_out += 1
+                    return False
+                self._cond.wait(remaining)
+            if entry[3]:
+                return False   # a request with an earlier tag took this place in the queue
+            heapq.heappop(self._waiting)
+            self._admit(entry)
+            return True
+
+    def _admit(self, entry):
+        self._tags.served(entry[0], entry[1], entry[2])
+        self._inflight += 1
+        self._admitted += 1
+        self._cond.notify_all()   # the next waiter may fit too
+
+    def _make_room(self, cls):
+        """Queue full: shed the waiter that would be admitted last, if cls would go before it."""
+        if not self._waiting:
+            return False
+        last = max(self._waiting)
+        if last[0][0] <= self._tags.peek(cls):
+            return False
+        last[3] = True
+        self._remove(last)
+        self._shed += 1
+        return True
+
+    def _remove(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        self._tags.classes[entry[1]].queued -= 1
+        self._cond.notify_all()
+
+    def release(self, service_time=None):
+        with self._cond:
+            self._inflight -= 1
+            if service_time is not None:
+                a = 0.2
+                self._service_ewma = service_time if not self._service_ewma else (1 - a) * self._service_ewma + a * service_time
+            self._cond.notify_all()   # waiters check whether they are next in fair order
+
+    def resize(self, max_inflight):
+        """Change the in-flight limit, e.g. to the concurrency chosen by autotune.py."""
+        with self._cond:
+            self.max_inflight = max(1, int(max_inflight))
+            self._cond.notify_all()
+
+    def retry_after(self):
+        """Seconds a shed client should wait: time to drain the current queue."""
+        with self._cond:
+            backlog = len(self._waiting) + self._inflight
+            per_slot = self._service_ewma or 1.0
+        return max(1, int(math.ceil(per_slot * backlog / self.max_inflight)))
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                inflight=self._inflight,
+                max_inflight=self.max_inflight,
+                queued=len(self._waiting),
+                max_queue=self.max_queue,
+                queue_occupancy=round(len(self._waiting) / self.max_queue, 3) if self.max_queue else 0.0,
+                peak_queued=self._peak_waiting,
+                admitted=self._admitted,
+                rejected=self._rejected,
+                shed=self._shed,
+                timed_out=self._timed_out,
+                mean_service_ms=round(self._service_ewma * 1000.0, 2),
+                classes=self._tags.stats(),
+            )
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take one token. Returns seconds to wait until one is available (0 = allowed)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets keyed per client (LRU-bounded) and per role. A rate of 0 disables a limit."""
+
+    def __init__(self, client_rate, client_burst, role_limits=None, max_clients=10000):
+        self.client_rate = float(client_rate)
+        self.client_burst = float(client_burst)
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._roles = {
+            role: TokenBucket(rate, burst)
+            for role, (rate, burst) in (role_limits or {}).items() if rate > 0
+        }
+        self._lock = threading.Lock()
+        self._limited = {"client": 0, "role": 0}
+
+    def check_client(self, client):
+        """Take a token from the client's bucket. Returns (allowed, retry_after_seconds, scope)."""
+        if self.client_rate <= 0 or not client:
+            return True, 0.0, None
+        with self._lock:
+            bucket = self._clients.get(client)
+            if bucket is None:
+                bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst)
+                if len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(client)
+            wait = bucket.take(time.monotonic())   # read after a new bucket is stamped
+            if wait:
+                self._limited["client"] += 1
+                return False, wait, "client"
+        return True, 0.0, None
+
+    def limits_roles(self):
+        """Whether any role has a bucket, i.e. whether the role is worth resolving."""
+        return bool(self._roles)
+
+    def check_role(self, role):
+        """Take a token from the role's bucket, if it has one."""
+        bucket = self._roles.get(role)
+        if bucket is None:
+            return True, 0.0, None
+        with self._lock:
+            wait = bucket.take(time.monotonic())
+            if wait:
+                self._limited["role"] += 1
+                return False, wait, "role"
+        return True, 0.0, None
+
+    def check(self, client, role):
+        """Return (allowed, retry_after_seconds, scope)."""
+        allowed, wait, scope = self.check_client(client)
+        if not allowed:
+            return allowed, wait, scope
+        return self.check_role(role)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                client_rate=self.client_rate,
+                client_burst=self.client_burst,
+                tracked_clients=len(self._clients),
+                role_rates={r: b.rate for r, b in self._roles.items()},
+                limited_by_client=self._limited["client"],
+                limited_by_role=self._limited["role"],
+            )
+
+
+def controller_from_env(name, default_inflight, default_queue):
+    prefix = f"XPERT_{name.upper()}_"
+    return AdmissionController(
+        name,
+        max_inflight=_env_float(prefix + "MAX_INFLIGHT", default_inflight),
+        max_queue=_env_float(prefix + "MAX_QUEUE", default_queue),
+        queue_timeout=_env_float("XPERT_QUEUE_TIMEOUT_S", 10),
+    )
+
+
+def rate_limiter_from_env(roles=("doctor", "student")):
+    role_limits = {
+        role: (_env_float(f"XPERT_ROLE_RATE_{role.upper()}", 0), _env_float(f"XPERT_ROLE_BURST_{role.upper()}", 20))
+        for role in roles
+    }
+    return RateLimiter(
+        client_rate=_env_float("XPERT_CLIENT_RATE", 10),
+        client_burst=_env_float("XPERT_CLIENT_BURST", 20),
+        role_limits=role_limits,
+    )
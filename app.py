@@ -1,15 +1,46 @@
 # app.py
-from flask import Flask, request, jsonify
-from keras.models import load_model
-from keras.preprocessing import image
-from keras.applications.vgg16 import preprocess_input
+# Keras/TensorFlow and google.genai are imported lazily (see load_primary_model()
+# and get_llm_client()) so that importing this module, /health and chat-only
+# deployments start in well under a second.
+from flask import Flask, Response, g, request, jsonify
+from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import numpy as np
-from google.genai import Client as LLMClient
-from google.genai import types
 import os
 import re
+import json
+import time
+import functools
+import queue
+import tempfile
+from contextlib import contextmanager
+import threading
+import admission
+import chat_context
+import ensemble
+import inference
+import llm_guard
+import phash_index
+import preprocess
+import readiness
+import scheduler
+import shadow
+import simulator
+import traffic
+import uploads
 
 app = Flask(__name__)
+# Request size limits, spooled uploads and the decoded-pixel budget (see uploads.py)
+uploads.install(app)
+# ------------------- Startup Mode -------------------
+# XPERT_CHAT_ONLY=1 serves only the chat endpoint and never imports TensorFlow.
+# XPERT_MODEL_LOAD controls when the classifier is loaded:
+#   background (default) - start loading in a background thread at import
+#   lazy                 - load on the first request that needs the model
+#   eager                - load while importing (the old behaviour)
+CHAT_ONLY = os.environ.get("XPERT_CHAT_ONLY", "0") == "1"
+MODEL_LOAD = os.environ.get("XPERT_MODEL_LOAD", "background").strip().lower()
+
 # ------------------- LLM Client Initialization -------------------
 LLM_CLIENT = None
 # Retrieve the secret API key from the terminal environment variable
@@ -17,29 +48,260 @@ LLM_CLIENT = None
 LLM_API_KEY = os.environ.get("GEMINI_API_KEY") 
 # CHANGE SERVICE NAME:
 LLM_MODEL = "gemini-2.5-flash" # <-- Use a fast, stable model for the demo
+# XPERT_FAKE_LLM=1 swaps in a deterministic local stand-in (see fake_llm.py)
+FAKE_LLM = os.environ.get("XPERT_FAKE_LLM", "0") == "1"
+_llm_lock = threading.Lock()
+_llm_init_done = False
+
+
+def get_llm_client():
+    """Create the Gemini client on first use (google.genai is slow to import)."""
+    global LLM_CLIENT, _llm_init_done
+    if _llm_init_done:
+        return LLM_CLIENT
+    with _llm_lock:
+        if not _llm_init_done:
+            if FAKE_LLM:
+                import fake_llm
+                LLM_CLIENT = fake_llm.FakeLLMClient()
+                print("Using the fake LLM client (XPERT_FAKE_LLM=1).")
+            elif LLM_API_KEY:
+                try:
+                    from google.genai import Client as LLMClient
+                    # Initialize the client object
+                    LLM_CLIENT = LLMClient(api_key=LLM_API_KEY)
+                    print("LLM Client initialized successfully.")
+                except Exception as e:
+                    print(f"WARNING: LLM Client failed to initialize: {e}")
+            _llm_init_done = True
+    return LLM_CLIENT
+# -----------------------------------------------------------------
+
+# ------------------- Admission Control & Rate Limits -------------------
+# Each endpoint gets a bounded number of in-flight requests and a bounded wait
+# queue (XPERT_<ENDPOINT>_MAX_INFLIGHT / XPERT_<ENDPOINT>_MAX_QUEUE). Requests
+# beyond that, or over their client / role token bucket, get a fast 429.
+ANALYZE_GATE = admission.controller_from_env("analyze", default_inflight=2, default_queue=8)
+CHAT_GATE = admission.controller_from_env("chat", default_inflight=8, default_queue=16)
+RATE_LIMITER = admission.rate_limiter_from_env()
+
+
+def client_id():
+    return request.headers.get("X-Client-Id") or request.remote_addr or "unknown"
+
+
+def analyze_request_role():
+    forced_role = request.args.get("role", "").strip().lower()
+    if forced_role in {"student", "doctor"}:
+        return forced_role
+    return detect_role(request.form.get("message", ""))
+
+
+def chat_request_role():
+    try:
+        # same text (plain or text parts) that chat_completions reads the role from
+        messages = chat_context.validate_messages(request.get_json(force=True, silent=True).get('messages'))
+        role_message = messages[0]['content'] or ''
+        return "doctor" if "doctor" in role_message.lower() else "student"
+    except Exception:
+        return "student"
+
+
+def too_many_requests(reason, retry_after):
+    retry_after = max(1, int(retry_after + 0.999))
+    resp = jsonify(error=f"Too many requests: {reason}. Retry later.", retry_after=retry_after)
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def admit(gate, role_fn):
+    """Rate-limit per client and role, then hold one of the gate's slots while the view runs.
+    The client bucket comes first and needs only headers, so a rejected client's
+    body is never read; role_fn() (which may parse the form) runs only after it
+    passes. The role picks the role bucket and the request's place in the gate's
+    weighted fair wait queue."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            allowed, wait, scope = RATE_LIMITER.check_client(client_id())
+            role = None
+            if allowed:
+                role = role_fn()
+                if RATE_LIMITER.limits_roles():
+                    allowed, wait, scope = RATE_LIMITER.check_role(role)
+            if not allowed:
+                return too_many_requests(f"{scope} rate limit exceeded", wait)
+            if not gate.acquire(role):
+                return too_many_requests(f"{gate.name} queue is full", gate.retry_after())
+            t0 = time.monotonic()
+            released = threading.Event()
+
+            def release():
+                # once: when the response ends, or earlier if the view hands the slot back
+                if not released.is_set():
+                    released.set()
+                    gate.release(time.monotonic() - t0)
+
+            g.release_admission = release
+            try:
+                resp = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            if resp.is_streamed:
+                # streamed bodies keep working after the view returns
+                resp.call_on_close(release)
+            else:
+                release()
+            return resp
+        return wrapped
+    return decorator
+
+# Opt-in traffic capture for replay.py (XPERT_RECORD_DIR, see traffic.py)
+RECORDER = None
+if traffic.RECORD_DIR:
+    RECORDER = traffic.TrafficRecorder()
+    RECORDER.install(app, client_id)
+    print(f"Recording {traffic.RECORD_FRACTION:.0%} of requests to {traffic.RECORD_DIR}")
+# -----------------------------------------------------------------------
+
+# Multi-turn history is kept within XPERT_CHAT_TOKEN_BUDGET (see chat_context.py)
+CHAT_CONTEXT = chat_context.ContextManager()
+
+
+def role_system_prompt(role):
+    if role == "student":
+        return "You are Xpert, a friendly medical tutor AI. Explain findings simply and break down the diagnostic process."
+    return "You are Xpert, an expert radiologist AI assistant. Respond concisely using technical terminology."
 
-if LLM_API_KEY:
+
+# Every LLM call runs under a deadline (XPERT_LLM_DEADLINE_S), is hedged after the
+# recent p95 latency and goes through a circuit breaker (see llm_guard.py). While
+# the upstream is unhealthy callers get a cached or templated answer at once.
+LLM_GUARD = llm_guard.GuardedLLM()
+# At most XPERT_LLM_MAX_INFLIGHT calls go upstream at once; waiting calls are let
+# through in weighted fair order by role (XPERT_PRIORITY_WEIGHTS, see scheduler.py)
+LLM_GATE = scheduler.PriorityGate(int(os.environ.get("XPERT_LLM_MAX_INFLIGHT", "8")))
+
+
+@contextmanager
+def llm_slot(role):
+    """Hold one upstream slot for role; yields the seconds left of the deadline.
+    Raises llm_guard.LLMUnavailable if no slot frees up within the deadline."""
+    t0 = time.monotonic()
+    if not LLM_GATE.acquire(role, timeout=LLM_GUARD.deadline):
+        raise llm_guard.LLMUnavailable("queue_timeout", f"No LLM slot free within {LLM_GUARD.deadline:.1f}s")
+    try:
+        yield max(0.1, LLM_GUARD.deadline - (time.monotonic() - t0))
+    finally:
+        LLM_GATE.release()
+
+
+def _llm_request(system_text, turns, timeout=None):
+    from google.genai import types
+    contents = [
+        types.Content(role=role, parts=[types.Part.from_text(text=text)])
+        for role, text in turns
+    ]
+    config = types.GenerateContentConfig(system_instruction=system_text)
+    if timeout is not None:
+        # the client's own default timeout is far longer than our budget
+        config.http_options = types.HttpOptions(timeout=max(1, int(timeout * 1000)))
+    return dict(model=LLM_MODEL, contents=contents, config=config)
+
+
+def llm_generate(system_text, turns, user_role=None):
+    """One Gemini call. turns: [(role, text)] with role "user" / "model"; user_role
+    ("doctor" / "student") sets the call's priority class.
+    Returns (text, usage) where usage holds the provider's token counts when reported.
+    Raises llm_guard.LLMUnavailable on timeout, error or an open breaker."""
+    def once(timeout):
+        return get_llm_client().models.generate_content(**_llm_request(system_text, turns, timeout))
+
+    with llm_slot(user_role) as budget:
+        response = LLM_GUARD.call(once, budget)
+    usage = {}
+    meta = getattr(response, "usage_metadata", None)
+    if meta is not None:
+        usage = dict(
+            prompt_tokens=getattr(meta, "prompt_token_count", None),
+            completion_tokens=getattr(meta, "candidates_token_count", None),
+        )
+    LLM_GUARD.remember(LLM_GUARD.cache_key(system_text, turns), response.text)
+    return response.text, usage
+
+
+def llm_stream(system_text, turns, user_role=None):
+    """Streaming variant of llm_generate: yields text chunks as they arrive.
+    Not hedged (the chunks are forwarded as they come), but bounded by the same
+    deadline, counted by the same circuit breaker and queued by the same gate."""
+    with llm_slot(user_role) as budget:
+        yield from _llm_stream(system_text, turns, budget)
+
+
+def _llm_stream(system_text, turns, budget):
+    LLM_GUARD.check()
+    t0 = time.monotonic()
+    end = t0 + budget   # the whole stream, not just each read, must finish in the budget
+    answered = False
+    upstream = None
     try:
-        # Initialize the client object
-        LLM_CLIENT = LLMClient(api_key=LLM_API_KEY)
-        print("LLM Client initialized successfully.")
+        request_ = _llm_request(system_text, turns, budget)
+        upstream = get_llm_client().models.generate_content_stream(**request_)
+        for chunk in upstream:
+            if not answered:
+                # the upstream is answering: that is enough to close the breaker
+                answered = True
+                LLM_GUARD.latency.add(time.monotonic() - t0)
+                LLM_GUARD.breaker.record_success()
+            if time.monotonic() > end:
+                LLM_GUARD.note_timeout()
+                raise llm_guard.LLMUnavailable("timeout", f"LLM stream did not finish within {budget:.1f}s")
+            if chunk.text:
+                yield chunk.text
+    except llm_guard.LLMUnavailable:
+        raise
     except Exception as e:
-        print(f"WARNING: LLM Client failed to initialize: {e}")
-# -----------------------------------------------------------------
+        LLM_GUARD.breaker.record_failure()
+        raise llm_guard.LLMUnavailable("error", str(e))
+    finally:
+        if not answered:
+            # cancelled before the first chunk: neither a success nor a failure
+            LLM_GUARD.breaker.abandon()
+        if upstream is not None and hasattr(upstream, "close"):
+            upstream.close()   # a cancelled reader must not keep the HTTP stream open
+
+
+def llm_fallback(system_text, turns, role, prediction, reason):
+    """Answer to use when the LLM is unavailable: the last answer to the same
+    conversation if we have one, else the role message for the latest prediction."""
+    LLM_GUARD.note_fallback()
+    cached = LLM_GUARD.cached(LLM_GUARD.cache_key(system_text, turns))
+    if cached is not None:
+        return cached
+    if prediction and prediction.get("prediction") in LABELS:
+        prob = prediction.get("pneumonia_probability")
+        prob = float(prob) if isinstance(prob, (int, float)) else (0.5 if prediction["prediction"] == "Normal" else 0.9)
+        return role_message(role, prediction["prediction"], prob)
+    return f"LLM Integration Error: External AI failed to respond. Details: {reason}"
+
+
 @app.route("/v1/chat/completions", methods=['POST'])
+@admit(CHAT_GATE, chat_request_role)
 def chat_completions():
     # --- 1. Get Input and Context ---
     try:
         data = request.get_json(force=True)
         
-        # NOTE: This assumes Chatbox sends the prompt as the last message in 'messages' list
-        # This will fail if your Streamlit app sends a different format, adjust if needed!
-        user_message = data.get('messages')[-1]['content']
+        # NOTE: This assumes Chatbox sends the prompt as the last message in 'messages' list;
+        # anything else (non-object entries, non-text content, an assistant turn last) is a 400
+        messages = chat_context.validate_messages(data.get('messages'))
         
         # --- IMPORTANT: Determine the Role ---
         # The true way to get the role is from session state or the initial /diagnose request.
         # For this test, we rely on the system message being the first in the list
-        role_message = data.get('messages')[0]['content']
+        role_message = str(messages[0].get('content') or '')
         user_role = "doctor" if "doctor" in role_message.lower() else "student"
         
     except Exception as e:
@@ -47,55 +309,41 @@ def chat_completions():
         return jsonify({"choices": [{"message": {"role": "assistant", "content": f"ERROR: Invalid Request Format. {e}"}}]}), 400
 
     # --- 2. Construct the Adaptive Prompt ---
-    if user_role == "student":
-        system_prompt = "You are Xpert, a friendly medical tutor AI. Explain findings simply and break down the diagnostic process."
-        
-    else:
-        system_prompt = "You are Xpert, an expert radiologist AI assistant. Respond concisely using technical terminology."
-        
+    system_prompt = role_system_prompt(user_role)
     
-    # Send the full system instruction with the user's latest message
-    full_prompt_messages = [
-    {
-        "role": "user", # Using 'user' for system/instruction content in the first turn
-        "parts": [{"text": system_prompt + user_message}] # Concatenate system instruction and user input into one Part
-    }
-]
+    # Keep the conversation within the token budget: the system prompt and the latest
+    # prediction result stay pinned, older turns are replaced by a cached summary
+    system_text, turns, context_report = CHAT_CONTEXT.build(
+        messages, system_prompt, chat_context.find_prediction(data)
+    )
+    usage = dict(prompt_tokens=context_report["prompt_tokens_estimate"], completion_tokens=0)
     
-    # --- 3. Call the LLM (Assuming LLM_CLIENT is globally initialized) ---
-    if LLM_CLIENT is None:
+    # --- 3. Call the LLM (the client is created on first use) ---
+    client = get_llm_client()
+    if client is None:
     # If client is not initialized (e.g., key missing), raise error now.
         return jsonify({
         "choices": [{"message": {"role": "assistant", "content": "ERROR: LLM Client not initialized. Check API Key."}}]
     }), 500
+    fallback = None
     try:
-        image_bytes = None
-        full_prompt_text = system_prompt + " " + user_message
-        parts = [
-        types.Part.from_text(full_prompt_text)
-    ]
+        ai_response_text, reported = llm_generate(system_text, turns, user_role)
+        # prefer the provider's token counts over our estimate when it reports them
+        usage["prompt_tokens"] = reported.get("prompt_tokens") or usage["prompt_tokens"]
+        usage["completion_tokens"] = reported.get("completion_tokens") or 0
         
-        contents_list = [
-        types.Content(role="user", parts=parts)
-    ]
+    except llm_guard.LLMUnavailable as e:
+        print(f"LLM API Call Failed ({e.reason}): {e}")
+        fallback = e.reason
+        ai_response_text = llm_fallback(system_text, turns, user_role, chat_context.find_prediction(data), e)
 
-        if LLM_CLIENT is None:
-            raise RuntimeError("LLM Client not initialized. Check API Key.")
-            
-        # Call the Gemini API with the messages
-        response = LLM_CLIENT.models.generate_content(
-            model=LLM_MODEL,
-            contents=contents_list
-        )
-        # Extract the response text
-        ai_response_text = response.text # Gemini's response object structure
-        
-    except Exception as e:
-        print(f"LLM API Call Failed: {e}")
-        ai_response_text = f"LLM Integration Error: External AI failed to respond. Details: {e}"
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    usage["context"] = context_report
+    print(f"[chat] role={user_role} prompt_tokens={usage['prompt_tokens']} "
+          f"(full history ~{context_report['history_tokens_estimate']}, {context_report['turns_summarised']} turns summarised)")
 
     # --- 4. Format the Output for Chatbox (OpenAI Format) ---
-    return jsonify({
+    body = {
         "id": "chatcmpl-final",
         "object": "chat.completion",
         "model": 'gemini-2.5-flash',
@@ -109,20 +357,187 @@ def chat_completions():
                 "finish_reason": "stop",
             }
         ],
-    })
+        "usage": usage,
+    }
+    if fallback:
+        # the answer did not come from the LLM: circuit_open | timeout | error
+        body["fallback"] = fallback
+    return jsonify(body)
 
 
 # ---------------------------
 # Load pretrained classifier (Keras + VGG16)
 # This matches the design of the uploaded Keras Flask app: it loads a .h5 with 2-class softmax:contentReference[oaicite:10]{index=10}.
 # ---------------------------
-MODEL_PATH = "model/vgg_tuned.h5"   # put your .h5 file here with this exact name
-try:
-    model = load_model(MODEL_PATH)
-    print("Loaded model:", MODEL_PATH)
-except Exception as e:
-    model = None
-    print(f"Warning: could not load model at {MODEL_PATH}: {e}")
+MODEL_PATH = os.environ.get("XPERT_MODEL_PATH", "model/vgg_tuned.h5")   # put your .h5 file here with this exact name (or a .tflite from convert_model.py)
+model = None
+MODEL_STATE = "disabled" if CHAT_ONLY else "not_loaded"   # not_loaded | loading | loaded | failed | disabled
+MODEL_LOAD_SECONDS = None
+_model_lock = threading.Lock()
+
+# Optional shadow / canary model, loaded together with the primary one.
+# Set XPERT_SHADOW_MODEL_PATH to a candidate .h5 and XPERT_SHADOW_FRACTION to the
+# share of /analyze requests it should also see (default 0.1).
+SHADOW = None
+
+# Near-duplicate index over analysed uploads (see phash_index.py); XPERT_DEDUP=0 disables it.
+DEDUP = None
+
+# All predictions run on a dedicated executor that owns the model (see inference.py).
+# XPERT_TF_INTRA_OP_THREADS / XPERT_TF_INTER_OP_THREADS / XPERT_CPU_AFFINITY tune it.
+EXECUTOR = None
+
+# Optional ensemble: XPERT_ENSEMBLE_MODELS adds member models next to the primary
+# one, each on its own executor, and their probabilities are averaged (see ensemble.py).
+ENSEMBLE = None
+
+
+def load_primary_model():
+    """Import Keras and load the classifier (and shadow model) once. Safe to call from any thread."""
+    global model, MODEL_STATE, MODEL_LOAD_SECONDS, SHADOW, EXECUTOR, DEDUP, ENSEMBLE
+    with _model_lock:
+        if MODEL_STATE != "not_loaded":
+            return model
+        MODEL_STATE = "loading"
+        t0 = time.perf_counter()
+        try:
+            # thread counts can only be set before TensorFlow's runtime starts
+            inference.configure_runtime()
+            if MODEL_PATH.endswith(".tflite"):
+                # memory-mapped weights shared by every worker process (see convert_model.py)
+                model = inference.TFLitePredictor(MODEL_PATH)
+            else:
+                from keras.models import load_model
+                model = load_model(MODEL_PATH)
+            predictor = model
+            if inference.XLA_ENABLED and not MODEL_PATH.endswith(".tflite"):
+                # optional fast path: XLA-compiled forward pass over padded batch buckets
+                try:
+                    predictor = inference.CompiledPredictor(model)
+                    if inference.XLA_WARMUP:
+                        predictor.warmup()
+                    print("Using XLA-compiled predictor, batch buckets:", predictor.buckets)
+                except Exception as e:
+                    predictor = model
+                    print(f"Warning: XLA fast path unavailable, using model.predict: {e}")
+            settings = executor_settings(predictor)
+            EXECUTOR = inference.InferenceExecutor(predictor, **settings)
+            MODEL_STATE = "loaded"
+            print("Loaded model:", MODEL_PATH)
+            if AUTOTUNE and not settings:
+                # serve on the defaults straight away; tuning must not hold up the load
+                threading.Thread(target=autotune_in_background, args=(predictor,), name="xpert-autotune", daemon=True).start()
+        except Exception as e:
+            model = None
+            MODEL_STATE = "failed"
+            print(f"Warning: could not load model at {MODEL_PATH}: {e}")
+        if ensemble.ENSEMBLE_MODELS and MODEL_STATE == "loaded":
+            try:
+                members = [ensemble.Member(MODEL_PATH, EXECUTOR, ensemble.ENSEMBLE_PRIMARY_WEIGHT, get_model_input_size())]
+                for path, weight in ensemble.parse_members(ensemble.ENSEMBLE_MODELS):
+                    member = ensemble.load_predictor(path)
+                    executor = inference.InferenceExecutor(member, name=f"ensemble-{len(members)}")
+                    members.append(ensemble.Member(path, executor, weight, get_model_input_size(member)))
+                # votes and agreement use the served decision: calibrated probability vs threshold
+                ENSEMBLE = ensemble.Ensemble(members, decide=lambda p: classify(p)[0] == "Pneumonia", calibrate=calibrate)
+                if CALIBRATION_MODEL:
+                    print(f"Warning: the calibration in {CALIBRATION_PATH} was fitted on {CALIBRATION_MODEL} alone "
+                          "and is applied to the ensemble average; re-check the threshold on ensemble output")
+                for m in members[1:]:
+                    # a wedged member would hold up every request, so each one is probed
+                    READINESS.add(f"ensemble:{m.name}", functools.partial(probe_executor, m.executor, m.input_size))
+                print("Loaded ensemble:", ", ".join(f"{m.name} (weight {m.weight})" for m in members))
+            except Exception as e:
+                print(f"Warning: ensemble disabled, serving {MODEL_PATH} alone: {e}")
+        MODEL_LOAD_SECONDS = round(time.perf_counter() - t0, 3)
+
+        if phash_index.DEDUP_ENABLED and MODEL_STATE == "loaded":
+            try:
+                # stored predictions are only valid for the same model (or set of models)
+                served_by = MODEL_PATH if ENSEMBLE is None else ",".join(m.name for m in ENSEMBLE.members)
+                DEDUP = phash_index.PHashIndex(path=phash_index.DEDUP_INDEX_PATH, model_path=served_by)
+            except Exception as e:
+                print(f"Warning: near-duplicate index disabled: {e}")
+
+        if shadow.SHADOW_MODEL_PATH and MODEL_STATE == "loaded":
+            try:
+                # agreement uses the served decision: calibrated probability vs threshold
+                candidate = shadow.load_candidate(shadow.SHADOW_MODEL_PATH)
+                SHADOW = shadow.ShadowRunner(candidate, model_path=shadow.SHADOW_MODEL_PATH,
+                                             decide=lambda p: classify(p)[0] == "Pneumonia",
+                                             input_size=get_model_input_size(candidate), primary=EXECUTOR)
+                print("Loaded shadow model:", shadow.SHADOW_MODEL_PATH)
+            except Exception as e:
+                print(f"Warning: could not load shadow model at {shadow.SHADOW_MODEL_PATH}: {e}")
+    return model
+
+
+AUTOTUNE = os.environ.get("XPERT_AUTOTUNE", "0") == "1"
+# the analyze gate also admits /v1/analyze_explain, so a tuned concurrency never raises it past this
+ANALYZE_MAX_TUNED_INFLIGHT = int(os.environ.get("XPERT_ANALYZE_MAX_TUNED_INFLIGHT", "8"))
+
+
+def apply_tuned_concurrency(concurrency):
+    """Let enough requests through to fill the batches the profile was measured
+    with, up to XPERT_ANALYZE_MAX_TUNED_INFLIGHT."""
+    if concurrency:
+        ANALYZE_GATE.resize(min(int(concurrency), max(ANALYZE_MAX_TUNED_INFLIGHT, ANALYZE_GATE.max_inflight)))
+    return ANALYZE_GATE.max_inflight
+
+
+def executor_settings(predictor):
+    """Executor settings saved by autotune.py for this model and machine (explicit
+    XPERT_INFER_* variables win), or {} when there is no profile yet."""
+    settings = inference.load_tuning(MODEL_PATH)
+    if not settings:
+        return {}
+    concurrency = apply_tuned_concurrency(settings.pop("concurrency", None))
+    print(f"Using tuned executor settings {settings}, analyze concurrency {concurrency}")
+    return settings
+
+
+def autotune_in_background(predictor):
+    """XPERT_AUTOTUNE=1 without a profile: tune with a short run while the model
+    already serves on default settings, then apply the result to the running
+    executor. Numbers measured next to live traffic are rougher than those of an
+    offline `python autotune.py` run."""
+    import autotune
+    print("Auto-tuning the inference executor in the background (XPERT_AUTOTUNE=1)...")
+    try:
+        h, w = get_model_input_size()
+        best, rows = autotune.tune(predictor, (h, w, 3), workers=(1,), max_batches=(1, 4, 8),
+                                   wait_ms=(0, 5), concurrency=(1, 4, 8, 16), duration=1.0, log=lambda _: None)
+        if best is None:
+            print("Auto-tuning found no setting within the p99 target; keeping the defaults")
+            return
+        autotune.save_profile(inference.TUNE_PROFILE_PATH, MODEL_PATH, best, rows, autotune.TUNE_TARGET_P99_MS, (h, w, 3))
+        settings = inference.load_tuning(MODEL_PATH)
+        for executor in (EXECUTOR, MOCK_EXECUTOR):
+            if executor is not None:
+                executor.configure(settings.get("max_batch"), settings.get("batch_wait_ms"))
+        concurrency = apply_tuned_concurrency(settings.get("concurrency"))
+        print(f"Applied auto-tuned executor settings {settings}, analyze concurrency {concurrency}")
+    except Exception as e:
+        print(f"Warning: auto-tuning failed, keeping the current settings: {e}")
+
+
+def get_model():
+    """Return the classifier, loading it now (or waiting for the background load) if needed."""
+    if MODEL_STATE in ("not_loaded", "loading"):
+        return load_primary_model()
+    return model
+
+
+def get_executor():
+    get_model()
+    return EXECUTOR
+
+
+def _background_init():
+    get_llm_client()
+    if not CHAT_ONLY:
+        load_primary_model()
+    READINESS.start()
 
 # ---------------------------
 # Role detection (very simple NLP)
@@ -141,68 +556,143 @@ def detect_role(text):
 # ---------------------------
 # Image preprocessing + prediction
 # ---------------------------
-def prepare(img_path):
+def prepare(img_path, progress=None, target_size=None):
     # determine target size from model input shape when available
-    target_h, target_w = 224, 224
+    target_h, target_w = target_size or (224, 224)
     try:
-        mh, mw = get_model_input_size()
+        mh, mw = target_size or get_model_input_size()
         if mh and mw:
             target_h, target_w = mh, mw
     except Exception:
         pass
 
     # force RGB mode when loading to avoid single-channel images
-    try:
-        img = image.load_img(img_path, target_size=(target_h, target_w), color_mode="rgb")
-    except Exception:
-        raise ValueError("Uploaded file is not a valid image or could not be opened")
-    x = image.img_to_array(img)
+    # (Pillow/NumPy equivalent of keras load_img + img_to_array, see preprocess.py)
+    x = preprocess.load_image_array(img_path, (target_h, target_w))
+    if progress:
+        progress("decoded", height=target_h, width=target_w)
     x = np.expand_dims(x, axis=0)
-    x = preprocess_input(x)  # same family API used in the reference app:contentReference[oaicite:11]{index=11}
+    x = preprocess.vgg_preprocess(x)  # same as keras.applications.vgg16.preprocess_input
+    if progress:
+        progress("preprocessed")
     return x
 
+def pneumonia_probabilities(preds):
+    """Pneumonia probability for every row of a batch of model outputs.
+    Index 1 of a 2-class softmax, or the single output of a sigmoid model."""
+    preds = np.asarray(preds)
+    if preds.ndim == 2 and preds.shape[-1] >= 2:
+        return preds[:, 1].astype("float64")
+    if preds.shape[-1] == 1:
+        return preds.reshape(len(preds)).astype("float64")
+    return np.zeros(len(preds))
+
+
+# ---------------------------
+# Decision threshold + optional temperature scaling
+# evaluate.py writes model/calibration.json ({"threshold": ..., "temperature": ...});
+# XPERT_THRESHOLD / XPERT_TEMPERATURE override the file. Defaults: 0.5 and 1.0.
+# ---------------------------
+CALIBRATION_PATH = os.environ.get("XPERT_CALIBRATION", "model/calibration.json")
+DECISION_THRESHOLD = 0.5
+TEMPERATURE = 1.0
+CALIBRATION_MODEL = None   # model_path the loaded calibration file was fitted on
+
+
+def load_calibration(path=CALIBRATION_PATH, model_path=MODEL_PATH):
+    """Read evaluate.py's calibration file. A file fitted on another model is
+    ignored (with a warning): its threshold means nothing for this one."""
+    global DECISION_THRESHOLD, TEMPERATURE, CALIBRATION_MODEL
+    if path and os.path.exists(path):
+        try:
+            with open(path) as fh:
+                cfg = json.load(fh)
+            fitted_on = cfg.get("model_path")
+            if fitted_on and os.path.normpath(fitted_on) != os.path.normpath(model_path):
+                raise ValueError(f"it was fitted on {fitted_on}, not {model_path}; run evaluate.py again")
+            CALIBRATION_MODEL = fitted_on
+            DECISION_THRESHOLD = float(cfg.get("threshold", DECISION_THRESHOLD))
+            TEMPERATURE = float(cfg.get("temperature", TEMPERATURE))
+            print(f"Loaded calibration from {path}: threshold={DECISION_THRESHOLD} temperature={TEMPERATURE}")
+        except Exception as e:
+            print(f"Warning: not using calibration {path}: {e}")
+    DECISION_THRESHOLD = float(os.environ.get("XPERT_THRESHOLD", DECISION_THRESHOLD))
+    TEMPERATURE = float(os.environ.get("XPERT_TEMPERATURE", TEMPERATURE))
+
+
+def calibrate(prob, temperature=None):
+    """Temperature-scale a probability (or array of them): sigmoid(logit(p) / T)."""
+    t = TEMPERATURE if temperature is None else temperature
+    if t == 1.0:
+        return prob
+    p = np.clip(np.asarray(prob, dtype="float64"), 1e-12, 1 - 1e-12)
+    scaled = 1.0 / (1.0 + np.exp(-np.log(p / (1 - p)) / t))
+    return float(scaled) if np.ndim(scaled) == 0 else scaled
+
+
+def classify(raw_prob):
+    """Return (label, calibrated pneumonia probability) for a raw model probability."""
+    prob = float(calibrate(raw_prob))
+    return ("Pneumonia" if prob > DECISION_THRESHOLD else "Normal"), prob
+
+
+load_calibration()
+
+
 def predict(img_path):
+    model = get_model()
     if model is None:
         raise RuntimeError(f"Model not loaded. Expected model at: {MODEL_PATH}")
     x = prepare(img_path)
-    preds = model.predict(x)             # shape [1, 2]
+    preds, _ = get_executor().run(x)     # shape [1, 2]
     pneu_prob = float(preds[0][1])       # assume index 1 = Pneumonia (as in the reference code):contentReference[oaicite:12]{index=12}
-    label = "Pneumonia" if pneu_prob > 0.5 else "Normal"
-    return label, pneu_prob
+    return classify(pneu_prob)
 
 
-def mock_predict(img_path):
-    """Deterministic mock prediction for testing: uses filename hash to alternate results.
-    This helps test the UI without a trained model."""
-    try:
-        # use file size to vary the mock result deterministically
-        size = os.path.getsize(img_path) if img_path and os.path.exists(img_path) else 0
-        if size % 3 == 0:
-            return "Pneumonia", 0.9
-        elif size % 3 == 1:
-            return "Pneumonia", 0.6
-        else:
-            return "Normal", 0.12
-    except Exception:
-        return "Normal", 0.5
+# ---------------------------
+# Mock mode (?mock=1): real decoding and preprocessing, then a simulated model with
+# the latency profile recorded from the real one (see simulator.py), on its own
+# executor with the same batching settings as the real model.
+# ---------------------------
+MOCK_EXECUTOR = None
+_mock_lock = threading.Lock()
+
+
+def get_mock_executor():
+    global MOCK_EXECUTOR
+    if MOCK_EXECUTOR is None:
+        with _mock_lock:
+            if MOCK_EXECUTOR is None:
+                sim = simulator.SimulatedModel()
+                # batch like the real executor, or the simulated latencies would not match it
+                if EXECUTOR is not None:
+                    settings = dict(workers=EXECUTOR.workers, max_batch=EXECUTOR.max_batch,
+                                    batch_wait_ms=EXECUTOR.batch_wait * 1000.0)
+                else:
+                    settings = inference.load_tuning(MODEL_PATH)
+                    settings.pop("concurrency", None)
+                print(f"Mock mode uses the simulator ({sim.mode}), profile of {sim.profile.get('model_path')}, settings {settings}")
+                MOCK_EXECUTOR = inference.InferenceExecutor(sim, name="simulator", **settings)
+    return MOCK_EXECUTOR
 
 
-def get_model_input_size():
-    """Return (height, width) expected by the loaded model.
+def get_model_input_size(m=None):
+    """Return (height, width) expected by the loaded model (or by model m).
     Falls back to (224,224) if unavailable."""
-    if model is None:
+    m = model if m is None else m
+    if m is None:
         return 224, 224
     try:
         # Prefer model.inputs[0].shape if available
-        if hasattr(model, 'inputs') and getattr(model, 'inputs'):
-            shp = model.inputs[0].shape
+        if hasattr(m, 'inputs') and getattr(m, 'inputs'):
+            shp = m.inputs[0].shape
             # shp may be a TensorShape; convert to list
             try:
                 dims = list(shp.as_list())
             except Exception:
                 dims = list(shp)
         else:
-            dims = list(model.input_shape)
+            dims = list(m.input_shape)
 
         # Expect dims like [None, H, W, C] (channels-last) or [None, C, H, W]
         if len(dims) == 4:
@@ -220,19 +710,113 @@ def get_model_input_size():
     return 224, 224
 
 
-# Health endpoint to report model load status
+# Health endpoints
+# Liveness: the process is up and serving requests (never touches the model).
+# Readiness: the process can do its job - the classifier is loaded (or the
+# server runs in chat-only mode) and the background probe (see readiness.py)
+# last saw a synthetic prediction finish within XPERT_READINESS_MAX_LATENCY_MS.
 def is_model_loaded():
     return model is not None
 
 
+def probe_inference():
+    executor = EXECUTOR
+    if executor is None:
+        raise RuntimeError(f"model {MODEL_STATE}")
+    return probe_executor(executor, get_model_input_size())
+
+
+def probe_executor(executor, size):
+    """Tiny prediction through executor. The readiness threshold is checked against
+    the returned compute_ms; queue wait behind requests is reported, not judged.
+    Only a probe that is not served at all within five thresholds is a miss."""
+    h, w = size
+    timeout = max(1.0, 5 * readiness.READINESS_MAX_LATENCY_MS / 1000.0)
+    # its own scheduling class, so the probe is not stuck behind a request backlog
+    future = executor.submit(np.zeros((1, h, w, 3), dtype="float32"), cls="readiness")
+    try:
+        _, timings = future.result(timeout=timeout)
+    except FutureTimeout:
+        raise RuntimeError(f"no prediction within {timeout:.0f}s")
+    return dict(queue_ms=timings["queue_ms"], compute_ms=timings["compute_ms"])
+
+
+def probe_llm():
+    client = get_llm_client()
+    if client is None:
+        raise RuntimeError("LLM client not initialized")
+    timeout = readiness.READINESS_LLM_MAX_LATENCY_MS / 1000.0
+    client.models.generate_content(**_llm_request("Reply with OK.", [("user", "ping")], timeout))
+
+
+READINESS = readiness.ReadinessProbe()
+if not CHAT_ONLY:
+    READINESS.add("inference", probe_inference)
+if readiness.READINESS_LLM in ("report", "require"):
+    READINESS.add("llm", probe_llm, readiness.READINESS_LLM_MAX_LATENCY_MS, required=readiness.READINESS_LLM == "require")
+
+
+def loads_on_demand():
+    """Lazy mode before the first /analyze: the model is not loaded yet, by design."""
+    return MODEL_LOAD == "lazy" and MODEL_STATE in ("not_loaded", "loading")
+
+
+def is_ready():
+    if loads_on_demand():
+        return True
+    if not (CHAT_ONLY or is_model_loaded()):
+        return False
+    return READINESS.ready()[0]
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify(
+        live=True,
+        ready=is_ready(),
+        chat_only=CHAT_ONLY,
+        model_state=MODEL_STATE,
+        model_load_seconds=MODEL_LOAD_SECONDS,
         model_loaded=is_model_loaded(),
         model_path=MODEL_PATH,
         message=("Model loaded" if is_model_loaded() else "Model not loaded")
     )
 
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    return jsonify(live=True)
+
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    if is_model_loaded() or CHAT_ONLY:
+        READINESS.start()
+    ready = is_ready()
+    body = dict(ready=ready, model_state=MODEL_STATE, probe=READINESS.status())
+    if loads_on_demand():
+        # otherwise a lazy pod never gets the traffic that would load its model
+        body["note"] = "XPERT_MODEL_LOAD=lazy: the model loads on the first request that needs it"
+    return jsonify(body), (200 if ready else 503)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(
+        admission={g.name: g.stats() for g in (ANALYZE_GATE, CHAT_GATE)},
+        rate_limits=RATE_LIMITER.stats(),
+        inference=(EXECUTOR.stats() if EXECUTOR is not None else None),
+        simulator=(MOCK_EXECUTOR.stats() if MOCK_EXECUTOR is not None else None),
+        calibration=dict(threshold=DECISION_THRESHOLD, temperature=TEMPERATURE, fitted_on=CALIBRATION_MODEL,
+                         applied_to=("ensemble" if ENSEMBLE is not None else MODEL_PATH)),
+        chat_context=CHAT_CONTEXT.stats(),
+        shadow=(SHADOW.stats() if SHADOW is not None else None),
+        ensemble=(ENSEMBLE.stats() if ENSEMBLE is not None else None),
+        dedup=(DEDUP.stats() if DEDUP is not None else None),
+        llm=dict(LLM_GUARD.stats(), gate=LLM_GATE.stats()),
+        traffic=(RECORDER.stats() if RECORDER is not None else None),
+    )
+
 # ---------------------------
 # Simple HTML form (optional) & JSON API
 # ---------------------------
@@ -246,75 +830,440 @@ def index():
       <p><button type="submit">Analyze</button></p>
       <p>Tip: add <code>?role=doctor</code> or <code>?role=student</code> to the URL to force role.</p>
     </form>
+    <pre id="progress"></pre>
+    <script>
+    // Use the progress stream when the browser can read it; the plain form post still works without JS.
+    document.querySelector("form").addEventListener("submit", async (ev) => {
+      if (!window.fetch || !window.ReadableStream) return;
+      ev.preventDefault();
+      const out = document.getElementById("progress");
+      out.textContent = "";
+      const resp = await fetch("/analyze/stream" + location.search, {method: "POST", body: new FormData(ev.target)});
+      if (!resp.ok) { out.textContent = await resp.text(); return; }
+      const reader = resp.body.getReader(), decoder = new TextDecoder();
+      let buf = "";
+      for (;;) {
+        const {value, done} = await reader.read();
+        if (done) break;
+        buf += decoder.decode(value, {stream: true});
+        let i;
+        while ((i = buf.indexOf("\n\n")) >= 0) {
+          const block = buf.slice(0, i); buf = buf.slice(i + 2);
+          const event = (block.match(/^event: (.*)$/m) || [])[1];
+          const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || "{}");
+          out.textContent += event === "stage"
+            ? `${data.t_ms.toFixed(1).padStart(8)} ms  ${data.stage}\n`
+            : `\n${JSON.stringify(data, null, 2)}\n`;
+        }
+      }
+    });
+    </script>
     """
 
+def save_upload(f):
+    """Save an upload under uploads/ with a unique name and return its path. The
+    client's file name is only used, sanitised, as the prefix and extension, so it
+    can neither escape uploads/ nor overwrite another request's file."""
+    uploads.check_image(f.stream)   # 413 before a huge bitmap is ever decoded
+    os.makedirs("uploads", exist_ok=True)
+    stem, ext = os.path.splitext(secure_filename(f.filename or ""))
+    with tempfile.NamedTemporaryFile(dir="uploads", prefix=(stem[:40] or "upload") + "-", suffix=ext.lower(),
+                                     delete=False) as out:
+        f.save(out)
+    return out.name
+
+
+def wants_mock():
+    # mock can be forced via ?mock=1 or a form field 'mock'
+    mock_q = request.args.get("mock", "0").strip()
+    mock_form = request.form.get("mock", "0").strip()
+    return mock_q == "1" or mock_form == "1"
+
+
+def wants_dedup():
+    # ?dedup=0 always runs the model, even for a near-duplicate of an earlier upload
+    return request.args.get("dedup", "1").strip() != "0"
+
+
+def model_unavailable(use_mock):
+    """Error response when a real prediction is requested but no model can serve it."""
+    if use_mock:
+        return None
+    if CHAT_ONLY:
+        return jsonify(error="Server runs in chat-only mode (XPERT_CHAT_ONLY=1). Use ?mock=1 to test without a model."), 503
+    if get_model() is None:
+        return jsonify(error="Model not loaded on server. Use ?mock=1 to test without a model."), 503
+    return None
+
+
+def run_prediction(save_path, use_mock, dedup=True, progress=None, role=None):
+    """Predict one saved upload. Returns dict(label, prob, preds, timings, duplicate_of);
+    preds and timings are None when a near-duplicate of an earlier upload was found.
+    Mock mode runs the simulated model instead of the real one (see simulator.py).
+    role is the executor's scheduling class, so doctors are served ahead of a
+    student backlog. Raises ValueError if the image can't be read.
+    progress(stage, **info), if given, is called as each stage finishes."""
+    if use_mock:
+        executor = get_mock_executor()
+        x = prepare(save_path, progress, executor.model.input_shape[1:3])
+        future = executor.submit(x, role)
+        if progress:
+            progress("queued")
+        preds, timings = future.result()
+        if progress:
+            progress("predicted", mock=True, **timings)
+        label, prob = classify(float(pneumonia_probabilities(preds)[0]))
+        return dict(label=label, prob=prob, preds=preds, timings=timings, duplicate_of=None)
+    x = hashes = None
+    if dedup and DEDUP is not None:
+        # hash the pixels prepare() decoded anyway, so the upload is decoded once
+        x = prepare(save_path, progress)
+        hashes = phash_index.array_hashes(preprocess.vgg_unpreprocess(x[0]))
+        hit = DEDUP.lookup(*hashes)
+        if hit is not None:
+            # same X-ray seen before: reuse its prediction
+            label, prob = classify(hit["raw_prob"])
+            duplicate_of = dict(image=hit["source"], distance=hit["distance"], similarity=hit["similarity"])
+            if progress:
+                progress("predicted", duplicate_of=duplicate_of)
+            return dict(label=label, prob=prob, preds=None, timings=None, duplicate_of=duplicate_of)
+    if ENSEMBLE is not None:
+        x, preds, timings = ensemble_prediction(save_path, progress, role, x)
+    else:
+        if x is None:
+            x = prepare(save_path, progress)
+        future = get_executor().submit(x, role)
+        if progress:
+            progress("queued")
+        preds, timings = future.result()
+    if progress:
+        progress("predicted", **timings)
+    try:
+        pneu_prob = float(preds[0][1])
+    except Exception:
+        pneu_prob = float(preds[0]) if preds.shape[-1] == 1 else 0.0
+    label, prob = classify(pneu_prob)
+    if SHADOW is not None and x is not None:
+        # off the response path: bounded queue, dropped under load; the upload is
+        # preprocessed again only if the candidate expects another input size
+        SHADOW.maybe_submit(lambda size: x if tuple(x.shape[1:3]) == size else prepare(save_path, target_size=size),
+                            pneu_prob, timings["compute_ms"])
+    if hashes is not None:
+        DEDUP.add(*hashes, raw_prob=pneu_prob, source=phash_index.content_id(save_path))
+    return dict(label=label, prob=prob, preds=preds, timings=timings, duplicate_of=None)
+
+
+def ensemble_prediction(save_path, progress, role, x=None):
+    """Run the ensemble on one upload, preparing the image once per input size.
+    x, if given, is the upload already prepared at the primary model's size.
+    Returns (primary-size input or None, preds, timings) shaped like the single-model path."""
+    primary_size = tuple(get_model_input_size())
+    inputs = {} if x is None else {primary_size: x}
+
+    def prepare_size(size):
+        if size in inputs:
+            return inputs[size]
+        inputs[size] = prepare(save_path, progress, size)
+        if progress and len(inputs) == 1:
+            progress("queued")
+        return inputs[size]
+
+    prob, info = ENSEMBLE.predict(prepare_size, role)
+    members = info["members"].values()
+    timings = dict(
+        queue_ms=max(m["queue_ms"] for m in members),
+        compute_ms=max(m["compute_ms"] for m in members),
+        batch_size=1,
+        ensemble=info,
+    )
+    preds = np.array([[1.0 - prob, prob]], dtype="float32")
+    return inputs.get(primary_size), preds, timings
+
+
+def role_message(role, label, prob):
+    """Role-based answer for a prediction (simple & clear)."""
+    if role == "student":
+        if label == "Pneumonia":
+            return f"As a student: this likely shows pneumonia (confidence {prob:.2f}). Pneumonia often looks like white cloudy patches on the lungs."
+        return f"As a student: this looks normal (confidence {(1-prob):.2f}). Lungs appear relatively clear without consolidation."
+    # doctor
+    if label == "Pneumonia":
+        return f"Pneumonia predicted (prob {prob*100:.1f}%). Correlate with clinical picture and consider further evaluation as indicated."
+    return f"No pneumonia predicted (prob {(1-prob)*100:.1f}%). If symptoms persist, correlate clinically."
+
+
 @app.route("/analyze", methods=["POST"])
+@admit(ANALYZE_GATE, analyze_request_role)
 def analyze():
     # --- 1) read uploaded image ---
     if "file" not in request.files:
         return jsonify(error="Upload an image in form field 'file'"), 400
-    f = request.files["file"]
-    os.makedirs("uploads", exist_ok=True)
-    save_path = os.path.join("uploads", f.filename)
-    f.save(save_path)
+    save_path = save_upload(request.files["file"])
 
     # --- 2) detect user role ---
-    forced_role = request.args.get("role", "").strip().lower()
-    message = request.form.get("message", "")
-    role = forced_role if forced_role in {"student", "doctor"} else detect_role(message)
+    role = analyze_request_role()
 
     # --- 3) choose prediction mode ---
-    # mock can be forced via ?mock=1 or a form field 'mock'
-    mock_q = request.args.get("mock", "0").strip()
-    mock_form = request.form.get("mock", "0").strip()
-    use_mock = mock_q == "1" or mock_form == "1"
-
-    if model is None and not use_mock:
-        return jsonify(error="Model not loaded on server. Use ?mock=1 to test without a model."), 503
+    use_mock = wants_mock()
+    unavailable = model_unavailable(use_mock)
+    if unavailable is not None:
+        return unavailable
 
     try:
-        if use_mock:
-            label, prob = mock_predict(save_path)
-        else:
-            # support debug to include raw preds
-            debug = request.args.get("debug", "0") == "1"
-            x = prepare(save_path)
-            preds = model.predict(x)
-            try:
-                pneu_prob = float(preds[0][1])
-            except Exception:
-                pneu_prob = float(preds[0]) if preds.shape[-1] == 1 else 0.0
-            label = "Pneumonia" if pneu_prob > 0.5 else "Normal"
-            prob = pneu_prob
+        result = run_prediction(save_path, use_mock, wants_dedup(), role=role)
     except ValueError as ve:
         # image couldn't be read
         return jsonify(error=str(ve)), 400
     except Exception as e:
         return jsonify(error=f"Prediction failed: {e}"), 500
+    return jsonify(analyze_response(role, result, request.args.get("debug", "0") == "1"))
 
-    # --- 4) craft role-based answer (simple & clear) ---
-    if role == "student":
-        if label == "Pneumonia":
-            text = f"As a student: this likely shows pneumonia (confidence {prob:.2f}). Pneumonia often looks like white cloudy patches on the lungs."
-        else:
-            text = f"As a student: this looks normal (confidence {(1-prob):.2f}). Lungs appear relatively clear without consolidation."
-    else:  # doctor
-        if label == "Pneumonia":
-            text = f"Pneumonia predicted (prob {prob*100:.1f}%). Correlate with clinical picture and consider further evaluation as indicated."
-        else:
-            text = f"No pneumonia predicted (prob {(1-prob)*100:.1f}%). If symptoms persist, correlate clinically."
 
+def analyze_response(role, result, debug=False):
+    """The /analyze JSON body for a run_prediction() result."""
+    label, prob = result["label"], result["prob"]
+
+    # --- 4) craft role-based answer (simple & clear) ---
     resp = dict(
         role=role,
         prediction=label,
         pneumonia_probability=round(prob, 3),
-        message=text
+        message=role_message(role, label, prob)
     )
-    if not use_mock and request.args.get("debug", "0") == "1":
+    if result["duplicate_of"]:
+        # near-duplicate of an earlier upload: its stored prediction was returned
+        resp["duplicate_of"] = result["duplicate_of"]
+    if debug:
         # attach raw prediction array if available
         try:
-            resp["raw_preds"] = preds.tolist()
+            resp["raw_preds"] = result["preds"].tolist()
         except Exception:
             pass
-    return jsonify(resp)
+        # queue wait (time spent behind other requests) vs model compute time
+        resp["timings"] = result["timings"]
+    return resp
+
+
+# ---------------------------
+# Analyze + explain: CNN and LLM fan-out, streamed as Server-Sent Events
+# The LLM explanation starts at the same time as image inference instead of after
+# it. Because the classifier only has two outcomes, one explanation per outcome
+# is started speculatively; as soon as the prediction is ready the matching
+# stream is forwarded and the other is cancelled, so end-to-end latency is close
+# to max(CNN, LLM). Speculation doubles LLM calls, so it is opt-in
+# (XPERT_EXPLAIN_SPECULATIVE=1); by default a single LLM call starts once the
+# prediction is known (cheaper, but latency is CNN + LLM).
+# Predictions and LLM streams run on separate pools, so streams waiting on a slow
+# LLM upstream can never keep a prediction from starting.
+# ---------------------------
+EXPLAIN_SPECULATIVE = os.environ.get("XPERT_EXPLAIN_SPECULATIVE", "0") == "1"
+FANOUT_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("XPERT_FANOUT_THREADS", "16")), thread_name_prefix="fanout")
+PREDICTION_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("XPERT_PREDICTION_THREADS", "8")), thread_name_prefix="predict")
+LABELS = ("Pneumonia", "Normal")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def explain_prompt(label, message, prob=None):
+    finding = f"The image classifier's finding for this chest X-ray is: {label}"
+    if prob is not None:
+        finding += f" (pneumonia probability {prob:.2f})"
+    question = message.strip() or "What does this finding mean?"
+    return (f"{finding}.\nThe user asks: {question}\n"
+            "Explain the finding for them. Do not quote a probability; it is shown to them separately.")
+
+
+class LLMStream:
+    """One streaming LLM call running on the fan-out pool; chunks are buffered until read."""
+
+    def __init__(self, system_text, prompt, role=None):
+        self.started = time.perf_counter()
+        self.first_chunk_ms = None
+        self.sent_chunks = 0
+        self._chunks = queue.Queue()
+        self._cancelled = threading.Event()
+        FANOUT_POOL.submit(self._run, system_text, prompt, role)
+
+    def _run(self, system_text, prompt, role):
+        chunks = llm_stream(system_text, [("user", prompt)], role)
+        try:
+            for chunk in chunks:
+                if self._cancelled.is_set():
+                    break
+                if self.first_chunk_ms is None:
+                    self.first_chunk_ms = round((time.perf_counter() - self.started) * 1000.0, 1)
+                self._chunks.put(("delta", chunk))
+            self._chunks.put(("end", None))
+        except Exception as e:
+            self._chunks.put(("error", e))
+        finally:
+            # frees the LLM slot and closes the upstream response now, not at garbage collection
+            chunks.close()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while True:
+            kind, value = self._chunks.get()
+            if kind == "delta":
+                self.sent_chunks += 1
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
 
+
+@app.route("/v1/analyze_explain", methods=["POST"])
+@admit(ANALYZE_GATE, analyze_request_role)
+def analyze_explain():
+    """Same form fields as /analyze. Streams events: "prediction" (the /analyze
+    result), "delta" (explanation text chunks), then "done" with timings, or "error"."""
+    if "file" not in request.files:
+        return jsonify(error="Upload an image in form field 'file'"), 400
+    save_path = save_upload(request.files["file"])
+    role = analyze_request_role()
+    message = request.form.get("message", "")
+    use_mock = wants_mock()
+    unavailable = model_unavailable(use_mock)
+    if unavailable is not None:
+        return unavailable
+
+    t0 = time.perf_counter()
+    prediction = PREDICTION_POOL.submit(run_prediction, save_path, use_mock, wants_dedup(), role=role)
+    # the analyze slot covers the prediction only; the explanation is bounded by LLM_GATE
+    release_analyze_slot = g.release_admission
+    system_text = role_system_prompt(role)
+    llm_ready = get_llm_client() is not None
+    streams = {}
+    if llm_ready and EXPLAIN_SPECULATIVE:
+        streams = {label: LLMStream(system_text, explain_prompt(label, message), role) for label in LABELS}
+
+    def ms_since_start():
+        return round((time.perf_counter() - t0) * 1000.0, 1)
+
+    def generate():
+        try:
+            try:
+                result = prediction.result()
+            except ValueError as ve:
+                yield sse_event("error", dict(error=str(ve)))
+                return
+            except Exception as e:
+                yield sse_event("error", dict(error=f"Prediction failed: {e}"))
+                return
+            finally:
+                release_analyze_slot()
+            cnn_ms = ms_since_start()
+            label, prob = result["label"], result["prob"]
+            event = dict(
+                role=role,
+                prediction=label,
+                pneumonia_probability=round(prob, 3),
+                message=role_message(role, label, prob),
+                cnn_ms=cnn_ms,
+            )
+            if result["duplicate_of"]:
+                event["duplicate_of"] = result["duplicate_of"]
+            yield sse_event("prediction", event)
+
+            for other, stream in streams.items():
+                if other != label:
+                    stream.cancel()
+            stream = streams.get(label)
+            if stream is None and llm_ready:
+                stream = streams[label] = LLMStream(system_text, explain_prompt(label, message, prob), role)
+            if stream is None:
+                yield sse_event("error", dict(error="LLM Client not initialized. Check API Key."))
+                return
+            fallback = None
+            try:
+                for chunk in stream:
+                    yield sse_event("delta", dict(text=chunk))
+            except Exception as e:
+                if stream.sent_chunks:
+                    yield sse_event("error", dict(error=f"LLM Integration Error: External AI failed to respond. Details: {e}"))
+                    return
+                # nothing streamed yet: answer with the templated explanation instead
+                fallback = getattr(e, "reason", "error")
+                LLM_GUARD.note_fallback()
+                yield sse_event("delta", dict(text=role_message(role, label, prob)))
+            done = dict(
+                cnn_ms=cnn_ms,
+                llm_first_token_ms=stream.first_chunk_ms,
+                total_ms=ms_since_start(),
+                speculative=bool(EXPLAIN_SPECULATIVE),
+            )
+            if fallback:
+                done["fallback"] = fallback
+            yield sse_event("done", done)
+        finally:
+            # client went away or we are done: stop any stream nobody will read
+            for stream in streams.values():
+                stream.cancel()
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------------------
+# Analyze with progress: stage events over Server-Sent Events
+# ---------------------------
+@app.route("/analyze/stream", methods=["POST"])
+@admit(ANALYZE_GATE, analyze_request_role)
+def analyze_stream():
+    """Same form fields and result as /analyze, streamed as Server-Sent Events:
+    one "stage" event per step (received, decoded, preprocessed, queued, predicted)
+    with t_ms since the request started, then "result", or "error"."""
+    t0 = time.perf_counter()
+    if "file" not in request.files:
+        return jsonify(error="Upload an image in form field 'file'"), 400
+    save_path = save_upload(request.files["file"])
+    role = analyze_request_role()
+    use_mock = wants_mock()
+    unavailable = model_unavailable(use_mock)
+    if unavailable is not None:
+        return unavailable
+    debug = request.args.get("debug", "0") == "1"
+
+    events = queue.Queue()
+
+    def progress(stage, **info):
+        events.put(("stage", dict(stage=stage, t_ms=round((time.perf_counter() - t0) * 1000.0, 1), ts=time.time(), **info)))
+
+    progress("received", bytes=os.path.getsize(save_path))
+    prediction = PREDICTION_POOL.submit(run_prediction, save_path, use_mock, wants_dedup(), progress, role)
+    prediction.add_done_callback(lambda _: events.put(("done", None)))
+
+    def generate():
+        while True:
+            kind, data = events.get()
+            if kind == "done":
+                break
+            yield sse_event(kind, data)
+        try:
+            result = prediction.result()
+        except ValueError as ve:
+            yield sse_event("error", dict(error=str(ve), status=400))
+            return
+        except Exception as e:
+            yield sse_event("error", dict(error=f"Prediction failed: {e}", status=500))
+            return
+        resp = analyze_response(role, result, debug)
+        resp["total_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        yield sse_event("result", resp)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------------------
+# Deferred initialisation (see XPERT_MODEL_LOAD above)
+# ---------------------------
+if MODEL_LOAD == "eager":
+    _background_init()
+elif MODEL_LOAD != "lazy":
+    threading.Thread(target=_background_init, name="xpert-init", daemon=True).start()
@@ -0,0 +1,141 @@
+# autotune.py
+# Pick the inference executor settings for this machine and model.
+# Benchmarks the loaded model through InferenceExecutor over a grid of worker
+# counts, micro-batch sizes and batch wait windows, each at increasing client
+# concurrency, with synthetic inputs at the model's input resolution. The best
+# setting is the one with the highest throughput whose p99 latency stays under
+# the target. It is saved to model/tuning.json, which the server reads at startup
+# (see inference.load_tuning) as long as the model and core count still match.
+#
+#   python autotune.py
+#   python autotune.py --target-p99-ms 1500 --max-batch 1,4,8 --wait-ms 0,5,20 --duration 5
+#   python autotune.py --model model/vgg_tuned.tflite --out model/tuning.json
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import inference
+
+TUNE_TARGET_P99_MS = float(os.environ.get("XPERT_TUNE_TARGET_P99_MS", "1000"))
+
+
+def measure(predictor, row_shape, workers, max_batch, wait_ms, concurrency, duration):
+    """Closed-loop load: `concurrency` clients each send one image at a time for `duration` seconds."""
+    executor = inference.InferenceExecutor(predictor, workers, max_batch, wait_ms, name="autotune")
+    x = np.random.default_rng(0).uniform(-128, 128, (1,) + tuple(row_shape)).astype("float32")
+    latencies = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client():
+        mine = []
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            executor.run(x)
+            mine.append((time.perf_counter() - t0) * 1000.0)
+        with lock:
+            latencies.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stats = executor.stats()
+    executor.close()
+    lat = np.asarray(latencies)
+    return dict(
+        workers=workers, max_batch=max_batch, batch_wait_ms=wait_ms, concurrency=concurrency,
+        throughput=round(len(lat) / elapsed, 2),
+        p50_ms=round(float(np.percentile(lat, 50)), 1),
+        p99_ms=round(float(np.percentile(lat, 99)), 1),
+        mean_batch_size=stats["mean_batch_size"],
+    )
+
+
+def tune(predictor, row_shape, workers=(1, 2), max_batches=(1, 2, 4, 8, 16), wait_ms=(0, 2, 5, 10),
+         concurrency=(1, 2, 4, 8, 16, 32), target_p99_ms=TUNE_TARGET_P99_MS, duration=3.0, log=print):
+    """Run the grid and return (best row or None, all rows)."""
+    # warm up once so the first setting doesn't pay for graph building
+    predictor.predict(np.zeros((max(max_batches),) + tuple(row_shape), dtype="float32"), verbose=0)
+    rows = []
+    for w in workers:
+        for b in max_batches:
+            # the wait window only matters when batches can hold more than one request
+            for wait in (wait_ms if b > 1 else (0,)):
+                for c in concurrency:
+                    row = measure(predictor, row_shape, w, b, wait, c, duration)
+                    row["meets_target"] = row["p99_ms"] <= target_p99_ms
+                    rows.append(row)
+                    log(f"workers={w} max_batch={b:<3} wait={wait:<4}ms clients={c:<3} "
+                        f"{row['throughput']:8.1f} img/s  p99 {row['p99_ms']:8.1f} ms  "
+                        f"batch {row['mean_batch_size']:.1f}{'' if row['meets_target'] else '  (over target)'}")
+                    if not row["meets_target"]:
+                        break   # more clients only add queueing from here
+    ok = [r for r in rows if r["meets_target"]]
+    if not ok:
+        return None, rows
+    # highest throughput; settings within 2% of it count as ties and the lowest p99 wins
+    top = max(r["throughput"] for r in ok)
+    best = min((r for r in ok if r["throughput"] >= 0.98 * top), key=lambda r: r["p99_ms"])
+    return best, rows
+
+
+def save_profile(path, model_path, best, rows, target_p99_ms, row_shape):
+    profile = dict(
+        model_path=model_path,
+        cpu_count=os.cpu_count(),
+        input_shape=list(row_shape),
+        target_p99_ms=target_p99_ms,
+        best=best,
+        grid=rows,
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as fh:
+        json.dump(profile, fh, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def _ints(text):
+    return tuple(int(v) for v in text.split(",") if v.strip())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark executor settings and save the best for the server.")
+    ap.add_argument("--model", default="", help="model path (default: app.py's MODEL_PATH)")
+    ap.add_argument("--out", default=inference.TUNE_PROFILE_PATH)
+    ap.add_argument("--target-p99-ms", type=float, default=TUNE_TARGET_P99_MS)
+    ap.add_argument("--workers", default="1,2")
+    ap.add_argument("--max-batch", default="1,2,4,8,16")
+    ap.add_argument("--wait-ms", default="0,2,5,10")
+    ap.add_argument("--concurrency", default="1,2,4,8,16,32")
+    ap.add_argument("--duration", type=float, default=3.0, help="seconds per setting")
+    args = ap.parse_args()
+
+    os.environ["XPERT_MODEL_LOAD"] = "lazy"
+    if args.model:
+        os.environ["XPERT_MODEL_PATH"] = args.model
+    import app
+    if app.get_model() is None:
+        raise SystemExit(f"Model could not be loaded from {app.MODEL_PATH}")
+    predictor = app.get_executor().model   # the XLA / TFLite wrapper when one is in use
+    h, w = app.get_model_input_size()
+    best, rows = tune(predictor, (h, w, 3), _ints(args.workers), _ints(args.max_batch), _ints(args.wait_ms),
+                      _ints(args.concurrency), args.target_p99_ms, args.duration)
+    if best is None:
+        raise SystemExit(f"No setting kept p99 under {args.target_p99_ms} ms; raise --target-p99-ms")
+    save_profile(args.out, app.MODEL_PATH, best, rows, args.target_p99_ms, (h, w, 3))
+    print(f"\nBest: workers={best['workers']} max_batch={best['max_batch']} wait={best['batch_wait_ms']}ms "
+          f"at {best['concurrency']} concurrent requests: {best['throughput']} img/s, p99 {best['p99_ms']} ms")
+    print(f"Wrote {args.out}; the server applies it at startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench_import.py
+# Import-time / cold-start benchmark for app.py.
+# Runs each startup mode in a fresh interpreter several times and reports how long
+# `import app` takes and how long until the server reports ready. Results can be
+# appended to a JSON-lines history file so startup cost can be tracked over time.
+#
+#   python bench_import.py                      # all modes, 5 runs each
+#   python bench_import.py --runs 10 --history bench_import_history.jsonl
+#   python bench_import.py --importtime         # also list the slowest imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MODES = {
+    "chat_only": {"XPERT_CHAT_ONLY": "1", "XPERT_MODEL_LOAD": "lazy"},
+    "lazy": {"XPERT_MODEL_LOAD": "lazy"},
+    "background": {"XPERT_MODEL_LOAD": "background"},
+    "eager": {"XPERT_MODEL_LOAD": "eager"},
+}
+
+# Child process: time the import, then (for background mode) wait until ready.
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+tensorflow_imported = "tensorflow" in sys.modules
+genai_imported = "google.genai" in sys.modules
+t_ready = None
+deadline = time.time() + 300
+while app.MODEL_STATE != "not_loaded" and time.time() < deadline:
+    if app.is_ready() or app.MODEL_STATE == "failed":
+        t_ready = time.perf_counter() - t0
+        break
+    time.sleep(0.01)
+print("BENCH " + json.dumps(dict(
+    import_s=t_import,
+    ready_s=t_ready,
+    model_state=app.MODEL_STATE,
+    tensorflow_imported=tensorflow_imported,
+    genai_imported=genai_imported,
+)))
+"""
+
+
+def run_once(env_overrides, cwd):
+    env = dict(os.environ)
+    env.update(env_overrides)
+    env["PYTHONPATH"] = HERE + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=cwd, env=env, capture_output=True, text=True)
+    for line in out.stdout.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[len("BENCH "):])
+    raise RuntimeError(f"benchmark child failed:\n{out.stderr[-2000:]}")
+
+
+def slowest_imports(env_overrides, cwd, top=15):
+    env = dict(os.environ)
+    env.update(env_overrides)
+    env["PYTHONPATH"] = HERE + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=cwd, env=env, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, rest = line.split(":", 1)
+            _self_us, cum_us, name = [p.strip() for p in rest.split("|")]
+            rows.append((int(cum_us), name))
+        except ValueError:
+            continue
+    # only top-level packages, otherwise parents and children repeat each other
+    rows = [r for r in rows if not r[1].startswith(" ") and "." not in r[1]]
+    return sorted(rows, reverse=True)[:top]
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure app.py import and cold-start time.")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--modes", default=",".join(MODES), help="comma separated: " + ",".join(MODES))
+    ap.add_argument("--cwd", default=HERE, help="directory containing model/ (default: repo root)")
+    ap.add_argument("--history", help="append a JSON line with the results to this file")
+    ap.add_argument("--importtime", action="store_true", help="print the slowest top-level imports per mode")
+    args = ap.parse_args()
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        runs = [run_once(MODES[mode], args.cwd) for _ in range(args.runs)]
+        imports = [r["import_s"] for r in runs]
+        readies = [r["ready_s"] for r in runs if r["ready_s"] is not None]
+        results[mode] = dict(
+            import_median_s=round(statistics.median(imports), 4),
+            import_min_s=round(min(imports), 4),
+            ready_median_s=round(statistics.median(readies), 4) if readies else None,
+            model_state=runs[-1]["model_state"],
+            tensorflow_at_import=runs[-1]["tensorflow_imported"],
+            genai_at_import=runs[-1]["genai_imported"],
+        )
+        r = results[mode]
+        ready = "-" if r["ready_median_s"] is None else f"{r['ready_median_s'] * 1000:.1f} ms"
+        print(f"{mode:>10}: import {r['import_median_s'] * 1000:8.1f} ms (min {r['import_min_s'] * 1000:.1f})  "
+              f"ready {ready}  state={r['model_state']} tensorflow_at_import={r['tensorflow_at_import']}")
+        if args.importtime:
+            for cum_us, name in slowest_imports(MODES[mode], args.cwd):
+                print(f"{'':>12}{cum_us/1000:9.1f} ms  {name}")
+
+    if args.history:
+        with open(args.history, "a") as fh:
+            fh.write(json.dumps(dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), rev=git_rev(), runs=args.runs, results=results)) + "\n")
+        print("Appended results to", args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench_xla.py
+# Compare the XLA-compiled, bucketed predictor with plain model.predict.
+# For each batch size the script times both paths (after warm-up) and checks that
+# they return the same probabilities. Sizes that are not a bucket (e.g. 3) show
+# the cost of padding up to the next bucket.
+#
+#   python bench_xla.py
+#   python bench_xla.py --sizes 1,2,3,4,8,16 --runs 20 --model model/vgg_tuned.h5
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+
+import inference
+
+
+def time_calls(fn, x, runs):
+    fn(x)  # warm-up (first call traces / builds the data adapter)
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn(x)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark XLA-compiled prediction against model.predict.")
+    ap.add_argument("--model", default=os.environ.get("XPERT_MODEL_PATH", "model/vgg_tuned.h5"))
+    ap.add_argument("--sizes", default=",".join(str(b) for b in inference.BATCH_BUCKETS))
+    ap.add_argument("--runs", type=int, default=10)
+    args = ap.parse_args()
+
+    inference.configure_runtime()
+    from keras.models import load_model
+    model = load_model(args.model)
+    compiled = inference.CompiledPredictor(model)
+    t0 = time.perf_counter()
+    compiled.warmup()
+    print(f"Compiled buckets {compiled.buckets} in {time.perf_counter() - t0:.2f}s")
+
+    row_shape = compiled.row_shape()
+    rng = np.random.RandomState(0)
+    print(f"{'batch':>6} {'bucket':>6} {'predict ms':>11} {'xla ms':>9} {'speedup':>8} {'ms/img xla':>11} {'max |diff|':>11}")
+    for n in [int(v) for v in args.sizes.split(",")]:
+        x = rng.uniform(-120, 150, size=(n,) + row_shape).astype("float32")
+        base = time_calls(lambda a: model.predict(a, verbose=0), x, args.runs)
+        fast = time_calls(compiled.predict, x, args.runs)
+        diff = float(np.max(np.abs(model.predict(x, verbose=0) - compiled.predict(x))))
+        print(f"{n:>6} {inference.bucket_for(n, compiled.buckets):>6} {base:>11.2f} {fast:>9.2f} "
+              f"{base / fast:>7.2f}x {fast / n:>11.2f} {diff:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
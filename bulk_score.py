@@ -0,0 +1,258 @@
+# bulk_score.py
+# Offline bulk scoring of archived X-rays.
+# Walks a directory tree, decodes and preprocesses images in a pool of worker
+# processes (Pillow/NumPy only, no TensorFlow in the workers) and keeps a bounded
+# number of batches prefetched, so decoding overlaps with batched inference on the
+# model executor. Results are appended to the output as each batch finishes; the
+# output doubles as the checkpoint, so an interrupted run picks up where it stopped.
+#
+#   python bulk_score.py uploads/ --out scores.csv
+#   python bulk_score.py /mnt/archive --out scores.parquet --batch-size 16 --workers 8
+#   python bulk_score.py /mnt/archive --out scores.csv --xla
+import argparse
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+import preprocess
+
+FIELDS = ["path", "prediction", "pneumonia_probability", "error"]
+
+
+def find_images(roots, extensions=preprocess.IMAGE_EXTENSIONS):
+    """Yield image paths under the given roots in a stable (sorted) order."""
+    for root in roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(dirpath, name)
+
+
+def decode_batch(paths, target_size):
+    """Worker: decode + preprocess a batch. Returns (paths, x, errors) for the readable images and the rest."""
+    ok, arrays, errors = [], [], []
+    for path in paths:
+        try:
+            arrays.append(preprocess.load_image_array(path, target_size))
+            ok.append(path)
+        except ValueError as e:
+            errors.append((path, str(e)))
+    x = preprocess.vgg_preprocess(np.stack(arrays)) if arrays else None
+    return ok, x, errors
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------------------------
+# Incremental writers (the output file is also the checkpoint)
+# ---------------------------
+class CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fh = open(path, "a", newline="")
+        self._writer = csv.DictWriter(self._fh, fieldnames=FIELDS)
+        if new:
+            self._writer.writeheader()
+
+    @staticmethod
+    def done_paths(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, newline="") as fh:
+            return {row["path"] for row in csv.DictReader(fh) if row.get("path")}
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self):
+        self._fh.close()
+
+
+class ParquetWriter:
+    """Writes one part file per flush into a directory, e.g. scores.parquet/part-00000.parquet."""
+
+    def __init__(self, path, rows_per_part=1024):
+        import pyarrow  # noqa: F401  (fail early with a clear error when pyarrow is missing)
+        self.path = path
+        self.rows_per_part = rows_per_part
+        os.makedirs(path, exist_ok=True)
+        self._pending = []
+        self._part = len([n for n in os.listdir(path) if n.endswith(".parquet")])
+
+    @staticmethod
+    def done_paths(path):
+        if not os.path.isdir(path):
+            return set()
+        import pyarrow.parquet as pq
+        done = set()
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".parquet"):
+                done.update(pq.read_table(os.path.join(path, name), columns=["path"]).column("path").to_pylist())
+        return done
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(self._pending)
+        final = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        pq.write_table(table, final + ".tmp")
+        os.replace(final + ".tmp", final)  # never leave a half-written part behind
+        self._part += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+
+
+def make_writer(path):
+    return ParquetWriter(path) if path.endswith(".parquet") else CsvWriter(path)
+
+
+def done_paths(path):
+    return ParquetWriter.done_paths(path) if path.endswith(".parquet") else CsvWriter.done_paths(path)
+
+
+# ---------------------------
+# Scoring pipeline (shared with evaluate.py)
+# ---------------------------
+def configure_app(model_path="", xla=False):
+    """Set the app.py options this tool needs. Must run before app is imported."""
+    os.environ["XPERT_MODEL_LOAD"] = "lazy"
+    if model_path:
+        os.environ["XPERT_MODEL_PATH"] = model_path
+    if xla:
+        os.environ["XPERT_XLA"] = "1"
+
+
+def score_batches(paths, batch_size=16, workers=None, prefetch=4, totals=None):
+    """Score an iterable of image paths. Yields one list per batch of
+    (path, raw pneumonia probability or None, error message) tuples, in input order.
+
+    Decoding runs in a process pool at most `prefetch` batches ahead of the
+    model, and batch k+1 is submitted to the executor before batch k is yielded.
+    """
+    totals = totals if totals is not None else {}
+    totals.setdefault("model_s", 0.0)
+    # Start the decode workers before TensorFlow is loaded; spawn keeps them free of it.
+    pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        import app
+        if app.get_model() is None:
+            raise SystemExit(f"Model could not be loaded from {app.MODEL_PATH}")
+        executor = app.get_executor()
+        target_size = app.get_model_input_size()
+
+        window = deque()   # decode futures
+        batches = batched(paths, batch_size)
+
+        def fill():
+            while len(window) < prefetch:
+                chunk = next(batches, None)
+                if chunk is None:
+                    return
+                window.append(pool.submit(decode_batch, chunk, target_size))
+
+        def finish(ok, fut, errors):
+            rows = [(p, None, e) for p, e in errors]
+            if fut is not None:
+                preds, timings = fut.result()
+                totals["model_s"] += timings["compute_ms"] / 1000.0
+                rows.extend((p, float(prob), "") for p, prob in zip(ok, app.pneumonia_probabilities(preds)))
+            return rows
+
+        fill()
+        pending = None   # batch currently on the model
+        while window:
+            ok, x, errors = window.popleft().result()
+            fill()
+            fut = executor.submit(x) if x is not None else None
+            if pending is not None:
+                yield finish(*pending)
+            pending = (ok, fut, errors)
+        if pending is not None:
+            yield finish(*pending)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# ---------------------------
+# Main
+# ---------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Score a directory tree of X-ray images with the classifier.")
+    ap.add_argument("roots", nargs="+", help="directories (or files) to score")
+    ap.add_argument("--out", required=True, help="results file: .csv, or .parquet (a directory of part files)")
+    ap.add_argument("--model", default="", help="model path (default: app.py's MODEL_PATH)")
+    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="decode processes")
+    ap.add_argument("--prefetch", type=int, default=4, help="decoded batches to keep ready ahead of the model")
+    ap.add_argument("--xla", action="store_true", help="use the XLA-compiled predictor")
+    args = ap.parse_args()
+    configure_app(args.model, args.xla)
+    import app
+
+    done = done_paths(args.out)
+    todo = (p for p in find_images(args.roots) if p not in done)
+    if done:
+        print(f"Resuming: {len(done)} images already scored in {args.out}")
+
+    writer = make_writer(args.out)
+    totals = dict(scored=0, failed=0, batches=0)
+    started = time.perf_counter()
+    try:
+        for rows in score_batches(todo, args.batch_size, args.workers, args.prefetch, totals):
+            out = []
+            for path, prob, error in rows:
+                if prob is None:
+                    out.append(dict(path=path, prediction="", pneumonia_probability="", error=error))
+                    totals["failed"] += 1
+                    continue
+                label, prob = app.classify(prob)
+                out.append(dict(path=path, prediction=label, pneumonia_probability=round(prob, 6), error=""))
+                totals["scored"] += 1
+            writer.write(out)
+            totals["batches"] += 1
+            if totals["batches"] % 20 == 0:
+                n = totals["scored"] + totals["failed"]
+                print(f"{totals['scored']} scored, {totals['failed']} failed, {n / (time.perf_counter() - started):.1f} img/s")
+    except KeyboardInterrupt:
+        print("Interrupted; results so far are saved. Run the same command again to resume.")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    n = totals["scored"] + totals["failed"]
+    print(f"Done: {totals['scored']} scored, {totals['failed']} failed in {elapsed:.1f}s "
+          f"({n / max(elapsed, 1e-9):.1f} img/s, model busy {totals['model_s']:.1f}s) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
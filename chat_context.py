@@ -0,0 +1,200 @@
+# chat_context.py
+# Token-budgeted conversation context for /v1/chat/completions.
+# Clients may send the whole chat history. The system prompt, the latest X-ray
+# prediction and the newest user message are always kept; older turns are kept
+# newest-first while they fit the budget, and the rest is replaced by a short
+# extractive summary. Summaries are cached per conversation prefix, so each
+# follow-up request only summarises the turns that newly fell out of the window.
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+CHAT_TOKEN_BUDGET = int(os.environ.get("XPERT_CHAT_TOKEN_BUDGET", "2000"))
+CHAT_SUMMARY_TOKENS = int(os.environ.get("XPERT_CHAT_SUMMARY_TOKENS", "200"))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def _first_sentence(text, limit=160):
+    text = " ".join(text.split())
+    m = re.match(r"(.+?[.!?])(\s|$)", text)
+    s = m.group(1) if m else text
+    return s if len(s) <= limit else s[:limit - 3].rstrip() + "..."
+
+
+def _text_content(content, where):
+    """A message's content as plain text. Accepts a string or an OpenAI-style list
+    of {"type": "text", "text": ...} parts; raises ValueError for anything else."""
+    if content is None or isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        texts = []
+        for part in content:
+            if not (isinstance(part, dict) and part.get("type") == "text" and isinstance(part.get("text"), str)):
+                raise ValueError(f"{where} may only contain text parts ({{\"type\": \"text\", \"text\": ...}})")
+            texts.append(part["text"])
+        return "\n".join(texts)
+    raise ValueError(f"{where} must be a string or a list of text parts")
+
+
+def validate_messages(messages):
+    """Check the shape of a chat payload's "messages" and return it with every
+    content as plain text. Raises ValueError (a 400 for the client) unless it is a
+    non-empty list of objects with string or text-part content whose last entry is
+    not an assistant turn: the last message is the prompt. A prediction carried in
+    a tool message may stay an object; it is passed on as JSON."""
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("'messages' must be a non-empty list")
+    out = []
+    for i, m in enumerate(messages):
+        if not isinstance(m, dict):
+            raise ValueError(f"messages[{i}] must be an object with 'role' and 'content'")
+        content = m.get("content")
+        if isinstance(content, dict) and (m.get("role") == "tool" or m.get("name") == "prediction"):
+            content = json.dumps(content)
+        else:
+            content = _text_content(content, f"messages[{i}].content")
+        out.append(dict(m, content=content))
+    if out[-1].get("role") == "assistant":
+        raise ValueError("the last message is from the assistant; send the user's message last")
+    return out
+
+
+def find_prediction(data):
+    """Latest prediction result in a chat payload: a top-level "prediction" object
+    (the JSON returned by /analyze), or the newest message that carries one."""
+    pred = data.get("prediction")
+    if isinstance(pred, dict):
+        return pred
+    for msg in reversed(data.get("messages") or []):
+        content = msg.get("content")
+        if msg.get("name") == "prediction" or msg.get("role") == "tool":
+            try:
+                obj = json.loads(content) if isinstance(content, str) else content
+                if isinstance(obj, dict) and "prediction" in obj:
+                    return obj
+            except ValueError:
+                pass
+    return None
+
+
+def format_prediction(pred):
+    label = pred.get("prediction", "unknown")
+    prob = pred.get("pneumonia_probability")
+    text = f"Latest X-ray analysis result: {label}"
+    if isinstance(prob, (int, float)):
+        text += f" (pneumonia probability {prob:.2f})"
+    return text + "."
+
+
+class ContextManager:
+    def __init__(self, budget=CHAT_TOKEN_BUDGET, summary_tokens=CHAT_SUMMARY_TOKENS, cache_size=1024):
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self._summaries = OrderedDict()   # prefix hash -> list of summary lines
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._totals = dict(requests=0, history_tokens=0, prompt_tokens=0, summarised_turns=0, summary_cache_hits=0)
+
+    # --- summaries ---
+    def _summarise(self, turns):
+        """Summary lines for turns, extending the longest cached prefix summary."""
+        hashes, h = [], hashlib.sha1()
+        for role, text in turns:
+            h.update(role.encode() + b"\0" + text.encode() + b"\0")
+            hashes.append(h.hexdigest())
+        with self._lock:
+            start, lines = 0, []
+            for i in range(len(hashes) - 1, -1, -1):
+                if hashes[i] in self._summaries:
+                    start, lines = i + 1, list(self._summaries[hashes[i]])
+                    self._summaries.move_to_end(hashes[i])
+                    self._totals["summary_cache_hits"] += 1
+                    break
+        for role, text in turns[start:]:
+            who = "User asked" if role == "user" else "Xpert answered"
+            lines.append(f"{who}: {_first_sentence(text)}")
+        # keep the most recent lines within the summary budget
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        with self._lock:
+            self._summaries[hashes[-1]] = lines
+            while len(self._summaries) > self._cache_size:
+                self._summaries.popitem(last=False)
+        return lines
+
+    # --- main entry point ---
+    def build(self, messages, system_prompt, prediction=None):
+        """Return (system_text, turns, report). turns is a list of (role, text) with role
+        "user" or "model", ending with the newest user message."""
+        system_parts = [system_prompt]
+        system_parts += [m["content"] for m in messages if m.get("role") == "system" and m.get("content")]
+        if prediction:
+            system_parts.append(format_prediction(prediction))
+
+        turns = []
+        for m in messages:
+            role, content = m.get("role"), m.get("content")
+            if role in ("user", "assistant") and isinstance(content, str) and content.strip():
+                turns.append(("user" if role == "user" else "model", content))
+        if messages[-1].get("role") == "assistant":
+            raise ValueError("the last message is from the assistant; send the user's message last")
+        if turns and turns[-1][0] == "user":
+            latest, history = turns[-1], turns[:-1]
+        else:
+            # keep the old contract: the last message (e.g. a bare "content" entry) is the user's prompt
+            latest = ("user", str(messages[-1].get("content") or ""))
+            history = turns
+
+        system_text = "\n".join(system_parts)
+        pinned = estimate_tokens(system_text) + estimate_tokens(latest[1])
+        remaining = self.budget - pinned - self.summary_tokens
+        kept = []
+        for role, text in reversed(history):
+            cost = estimate_tokens(text)
+            if cost > remaining:
+                break
+            kept.append((role, text))
+            remaining -= cost
+        kept.reverse()
+        older = history[:len(history) - len(kept)]
+
+        summary_text = ""
+        if older:
+            summary_text = "Summary of the earlier conversation:\n" + "\n".join(self._summarise(older))
+            system_text += "\n" + summary_text
+
+        out = kept + [latest]
+        prompt_tokens = estimate_tokens(system_text) + sum(estimate_tokens(t) for _, t in out)
+        history_tokens = estimate_tokens("\n".join(system_parts)) + sum(estimate_tokens(t) for _, t in history + [latest])
+        report = dict(
+            budget=self.budget,
+            prompt_tokens_estimate=prompt_tokens,
+            history_tokens_estimate=history_tokens,
+            pinned_tokens=pinned,
+            turns_kept=len(kept) + 1,
+            turns_summarised=len(older),
+            summary_tokens=estimate_tokens(summary_text),
+            prediction_pinned=bool(prediction),
+        )
+        with self._lock:
+            t = self._totals
+            t["requests"] += 1
+            t["history_tokens"] += history_tokens
+            t["prompt_tokens"] += prompt_tokens
+            t["summarised_turns"] += len(older)
+        return system_text, out, report
+
+    def stats(self):
+        with self._lock:
+            t = dict(self._totals)
+            t["cached_summaries"] = len(self._summaries)
+        t["budget"] = self.budget
+        t["tokens_saved"] = t["history_tokens"] - t["prompt_tokens"]
+        return t
@@ -0,0 +1,59 @@
+# convert_model.py
+# Convert the Keras classifier to a TensorFlow Lite flatbuffer.
+# The server loads a .tflite model by memory-mapping it read-only, so all worker
+# processes on a node share one copy of the weights instead of each holding a
+# private one (see inference.TFLitePredictor and rss_report.py).
+#
+#   python convert_model.py                       # model/vgg_tuned.h5 -> model/vgg_tuned.tflite
+#   python convert_model.py model/vgg_tuned.h5 --float16
+#   XPERT_MODEL_PATH=model/vgg_tuned.tflite python app.py
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+def convert(src, dst, float16=False):
+    import tensorflow as tf
+    from keras.models import load_model
+    model = load_model(src)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if float16:
+        # halves the file (and the shared pages); weights are upcast when the kernels run
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    data = converter.convert()
+    with open(dst + ".tmp", "wb") as fh:
+        fh.write(data)
+    os.replace(dst + ".tmp", dst)
+    return model
+
+
+def check(model, dst, samples=4):
+    """Largest absolute difference between the Keras and TFLite outputs on random inputs."""
+    import inference
+    tfl = inference.TFLitePredictor(dst)
+    x = np.random.default_rng(0).uniform(-128, 128, (samples,) + tfl.input_shape[1:]).astype("float32")
+    return float(np.max(np.abs(model.predict(x, verbose=0) - tfl.predict(x))))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert the Keras .h5 classifier to a memory-mappable .tflite file.")
+    ap.add_argument("model", nargs="?", default="model/vgg_tuned.h5")
+    ap.add_argument("--out", default="", help="output path (default: same name with .tflite)")
+    ap.add_argument("--float16", action="store_true", help="store weights as float16")
+    ap.add_argument("--no-check", action="store_true", help="skip comparing outputs with the Keras model")
+    args = ap.parse_args()
+    dst = args.out or os.path.splitext(args.model)[0] + ".tflite"
+
+    t0 = time.perf_counter()
+    model = convert(args.model, dst, args.float16)
+    print(f"Wrote {dst} ({os.path.getsize(dst) / 1e6:.1f} MB) in {time.perf_counter() - t0:.1f}s")
+    if not args.no_check:
+        print(f"Max |keras - tflite| on random inputs: {check(model, dst):.2e}")
+    print(f"Serve it with XPERT_MODEL_PATH={dst}")
+
+
+if __name__ == "__main__":
+    main()
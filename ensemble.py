@@ -0,0 +1,195 @@
+# ensemble.py
+# Serve several classifiers behind the same /analyze contract.
+# XPERT_ENSEMBLE_MODELS lists extra members next to the primary model as
+# "path[:weight]" entries (.h5 or .tflite), for example
+#   XPERT_ENSEMBLE_MODELS=model/vgg_fold2.h5,model/mobilenet.tflite:0.5
+# Each member runs on its own inference executor, so all members work on the
+# same request at the same time. Images are decoded and preprocessed once per
+# distinct input size. The pneumonia probabilities are averaged with the members'
+# weights. With XPERT_ENSEMBLE_EARLY_EXIT set (e.g. 0.95), the cheapest member
+# (lowest median compute time so far) runs first, and its answer is used alone
+# when its calibrated probability of the label it would serve is at least that
+# high. Per-member latency and agreement with the
+# ensemble decision (the served, calibrated one) are reported at /metrics.
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+import inference
+
+ENSEMBLE_MODELS = os.environ.get("XPERT_ENSEMBLE_MODELS", "")
+ENSEMBLE_PRIMARY_WEIGHT = float(os.environ.get("XPERT_ENSEMBLE_PRIMARY_WEIGHT", "1"))
+ENSEMBLE_EARLY_EXIT = float(os.environ.get("XPERT_ENSEMBLE_EARLY_EXIT", "0"))   # 0 = always run every member
+
+
+def parse_members(spec):
+    """Parse "a.h5,b.tflite:0.5" into [("a.h5", 1.0), ("b.tflite", 0.5)]."""
+    members = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        path, weight = part, 1.0
+        head, sep, tail = part.rpartition(":")
+        if sep:
+            try:
+                path, weight = head, float(tail)
+            except ValueError:
+                pass   # a drive letter or a colon in the path, not a weight
+        members.append((path, weight))
+    return members
+
+
+def load_predictor(path):
+    """Load one member model: a TFLite flatbuffer or a Keras .h5."""
+    if path.endswith(".tflite"):
+        return inference.TFLitePredictor(path)
+    from keras.models import load_model
+    return load_model(path)
+
+
+def _pneumonia_prob(preds):
+    # same interpretation as analyze(): index 1 = Pneumonia, or a single sigmoid output
+    preds = np.asarray(preds)
+    if preds.shape[-1] >= 2:
+        return float(preds[0][1])
+    return float(preds.reshape(-1)[0])
+
+
+class Member:
+    def __init__(self, name, executor, weight, input_size):
+        self.name = name
+        self.executor = executor
+        self.weight = weight
+        self.input_size = tuple(input_size)
+        self.latency_ms = deque(maxlen=2048)
+        self.compute_ms = deque(maxlen=2048)
+        self.runs = 0
+        self.errors = 0
+        self.compared = 0
+        self.agreements = 0
+        self.abs_delta_sum = 0.0
+
+
+class Ensemble:
+    """Weighted probability average over members, each with its own executor."""
+
+    def __init__(self, members, early_exit=ENSEMBLE_EARLY_EXIT, threshold=0.5, decide=None, calibrate=None):
+        """decide(prob) -> True for Pneumonia is the served decision; it defaults
+        to prob > threshold. calibrate(prob) is the served (calibrated) probability
+        that early exits are judged on; it defaults to prob itself."""
+        self.members = members
+        self.early_exit = early_exit
+        self.threshold = threshold
+        self.decide = decide or (lambda p: p > self.threshold)
+        self.calibrate = calibrate or (lambda p: p)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._early_exits = 0
+        self._unanimous = 0
+
+    def cheap_member(self):
+        """The member with the lowest median compute time, once every member has run."""
+        with self._lock:
+            if any(not m.compute_ms for m in self.members):
+                return None
+            return min(self.members, key=lambda m: np.median(m.compute_ms))
+
+    def predict(self, prepare, cls=None):
+        """prepare((h, w)) returns the preprocessed batch for an input size.
+        Returns (pneumonia probability, info) where info holds each member's
+        prob and timings and whether the cheap member answered alone."""
+        inputs = {}
+
+        def submit(member):
+            if member.input_size not in inputs:
+                inputs[member.input_size] = prepare(member.input_size)
+            return member, member.executor.submit(inputs[member.input_size], cls)
+
+        results = {}
+        pending = self.members
+        cheap = self.cheap_member() if self.early_exit > 0 else None
+        if cheap is not None:
+            self._collect(*submit(cheap), results)
+            p = results.get(cheap.name, {}).get("prob")
+            if p is not None and self.confidence(p) >= self.early_exit:
+                pending = []
+            else:
+                pending = [m for m in self.members if m is not cheap]
+        # submit every member before waiting on any so they run side by side
+        for job in [submit(m) for m in pending]:
+            self._collect(*job, results)
+
+        ran = [m for m in self.members if m.name in results]
+        if not ran:
+            raise RuntimeError("every ensemble member failed")
+        total = sum(m.weight for m in ran)
+        prob = sum(m.weight * results[m.name]["prob"] for m in ran) / total
+        early = cheap is not None and not pending
+        self._record(ran, results, prob, early)
+        members = {name: dict(r, prob=round(r["prob"], 4)) for name, r in results.items()}
+        return prob, dict(members=members, early_exit=early)
+
+    def confidence(self, prob):
+        """Calibrated probability of the label the served decision rule picks for prob."""
+        served = float(self.calibrate(prob))
+        return served if self.decide(prob) else 1.0 - served
+
+    def _collect(self, member, future, results):
+        try:
+            preds, timings = future.result()
+            prob = _pneumonia_prob(preds)
+        except Exception as e:
+            with self._lock:
+                member.errors += 1
+            print(f"[ensemble] {member.name} failed: {e}")
+            return
+        ms = timings["queue_ms"] + timings["compute_ms"]   # this member's own time, not time spent waiting on others
+        results[member.name] = dict(prob=prob, ms=round(ms, 2),
+                                    queue_ms=timings["queue_ms"], compute_ms=timings["compute_ms"])
+        with self._lock:
+            member.runs += 1
+            member.latency_ms.append(ms)
+            member.compute_ms.append(timings["compute_ms"])
+
+    def _record(self, ran, results, prob, early):
+        decision = bool(self.decide(prob))
+        votes = {bool(self.decide(results[m.name]["prob"])) for m in ran}
+        with self._lock:
+            self._requests += 1
+            self._early_exits += int(early)
+            if early:
+                return   # one member answered alone: nothing to compare
+            self._unanimous += int(len(votes) == 1)
+            for m in ran:
+                p = results[m.name]["prob"]
+                m.compared += 1
+                m.agreements += int(bool(self.decide(p)) == decision)
+                m.abs_delta_sum += abs(p - prob)
+
+    def stats(self):
+        with self._lock:
+            full = self._requests - self._early_exits
+            members = {}
+            for m in self.members:
+                lat = np.asarray(m.latency_ms) if m.latency_ms else np.zeros(1)
+                members[m.name] = dict(
+                    weight=m.weight,
+                    input_size=list(m.input_size),
+                    runs=m.runs,
+                    errors=m.errors,
+                    latency_ms=dict(p50=round(float(np.percentile(lat, 50)), 2),
+                                    p95=round(float(np.percentile(lat, 95)), 2),
+                                    p99=round(float(np.percentile(lat, 99)), 2)),
+                    agreement_rate=round(m.agreements / m.compared, 4) if m.compared else None,
+                    mean_abs_delta=round(m.abs_delta_sum / m.compared, 4) if m.compared else None,
+                )
+            return dict(
+                requests=self._requests,
+                early_exit_threshold=self.early_exit,
+                early_exits=self._early_exits,
+                unanimous_rate=round(self._unanimous / full, 4) if full else None,
+                members=members,
+            )
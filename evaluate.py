@@ -0,0 +1,276 @@
+# evaluate.py
+# Model evaluation and decision-threshold calibration on a labelled folder.
+# The dataset is a directory with one sub-folder per class, e.g.
+#   data/test/NORMAL/*.jpeg  data/test/PNEUMONIA/*.jpeg
+# Images are scored in batches with the bulk_score.py pipeline and the raw
+# probabilities are cached (under cache/evaluate/, never in the dataset folder),
+# so re-running with other options costs nothing.
+# All metrics for every threshold are computed in one vectorised NumPy pass.
+#
+#   python evaluate.py data/test
+#   python evaluate.py data/test --temperature --recommend sensitivity --target-sensitivity 0.95
+#   python evaluate.py data/test --write-config model/calibration.json --sweep-csv sweep.csv
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import bulk_score
+
+
+# ---------------------------
+# Dataset + cached scoring
+# ---------------------------
+def find_labelled_images(root, positive, negative):
+    """Return (paths, labels) for images under <root>/<class>/..., 1 = positive class."""
+    paths, labels = [], []
+    for name in sorted(os.listdir(root)):
+        sub = os.path.join(root, name)
+        if not os.path.isdir(sub):
+            continue
+        if name.lower() in positive:
+            label = 1
+        elif name.lower() in negative:
+            label = 0
+        else:
+            print(f"Skipping folder {sub}: not a known class")
+            continue
+        for path in bulk_score.find_images([sub]):
+            paths.append(path)
+            labels.append(label)
+    return paths, np.asarray(labels, dtype="int8")
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return f"{path}|{st.st_size}|{int(st.st_mtime)}"
+
+
+def default_cache_path(dataset):
+    """Per-dataset cache file outside the dataset, which may be read-only or shared."""
+    key = hashlib.sha256(os.path.abspath(dataset).encode()).hexdigest()[:16]
+    return os.path.join("cache", "evaluate", f"{key}.npz")
+
+
+def score_with_cache(paths, cache_path, model_path, batch_size, workers):
+    """Raw pneumonia probabilities for paths (NaN for unreadable files), reusing a .npz cache."""
+    if cache_path and not cache_path.endswith(".npz"):
+        cache_path += ".npz"   # np.savez appends it anyway; load from the file it writes
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        data = np.load(cache_path, allow_pickle=False)
+        if str(data["model"]) == model_path:
+            cached = dict(zip(data["keys"].tolist(), data["probs"].tolist()))
+        else:
+            print(f"Cache {cache_path} was built with another model; rescoring")
+    keys = [_file_key(p) for p in paths]
+    todo = [p for p, k in zip(paths, keys) if k not in cached]
+    if todo:
+        print(f"Scoring {len(todo)} images ({len(paths) - len(todo)} cached)")
+        key_of = dict(zip(paths, keys))
+        for rows in bulk_score.score_batches(todo, batch_size=batch_size, workers=workers):
+            for path, prob, error in rows:
+                cached[key_of[path]] = float("nan") if prob is None else prob
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            np.savez(cache_path, model=model_path, keys=np.asarray(list(cached)), probs=np.asarray(list(cached.values())))
+    return np.asarray([cached[k] for k in keys], dtype="float64")
+
+
+# ---------------------------
+# Metrics (vectorised over all thresholds)
+# ---------------------------
+def threshold_sweep(probs, labels, thresholds):
+    """Confusion counts and derived metrics for every threshold (predict positive when p > t)."""
+    pos = np.sort(probs[labels == 1])
+    neg = np.sort(probs[labels == 0])
+    tp = len(pos) - np.searchsorted(pos, thresholds, side="right")
+    fp = len(neg) - np.searchsorted(neg, thresholds, side="right")
+    fn = len(pos) - tp
+    tn = len(neg) - fp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall = np.where(len(pos) > 0, tp / max(len(pos), 1), 0.0)
+        specificity = np.where(len(neg) > 0, tn / max(len(neg), 1), 0.0)
+        precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 1.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-12), 0.0)
+    return dict(
+        threshold=thresholds, tp=tp, fp=fp, fn=fn, tn=tn,
+        accuracy=(tp + tn) / len(labels),
+        precision=precision, recall=recall, specificity=specificity,
+        fpr=1.0 - specificity, f1=f1, youden=recall + specificity - 1.0,
+    )
+
+
+def roc_auc(probs, labels):
+    """Exact ROC-AUC via the Mann-Whitney rank statistic (ties get average ranks)."""
+    n_pos = int(labels.sum())
+    n_neg = len(labels) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return float("nan")
+    _, inverse, counts = np.unique(probs, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    avg_rank = ends - (counts - 1) / 2.0   # 1-based average rank of each distinct value
+    ranks = avg_rank[inverse]
+    return float((ranks[labels == 1].sum() - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg))
+
+
+def average_precision(probs, labels):
+    """Area under the precision-recall step curve, sum of (R_k - R_k-1) * P_k over
+    the distinct thresholds. Tied scores form one step, as in scikit-learn, so the
+    result does not depend on the order of tied images."""
+    order = np.argsort(-probs, kind="mergesort")
+    scores = probs[order]
+    hits = labels[order].astype("float64")
+    if hits.sum() == 0:
+        return float("nan")
+    # last index of each run of equal scores = one threshold
+    ends = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tp = np.cumsum(hits)[ends]
+    precision = tp / (ends + 1)
+    recall = tp / hits.sum()
+    return float(np.sum(np.diff(np.r_[0.0, recall]) * precision))
+
+
+def expected_calibration_error(probs, labels, bins=15):
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    idx = np.clip(np.digitize(probs, edges[1:-1]), 0, bins - 1)
+    counts = np.bincount(idx, minlength=bins)
+    conf = np.bincount(idx, weights=probs, minlength=bins)
+    acc = np.bincount(idx, weights=labels.astype("float64"), minlength=bins)
+    nz = counts > 0
+    return float(np.sum(np.abs(acc[nz] - conf[nz])) / len(probs))
+
+
+def fit_temperature(probs, labels):
+    """Temperature T minimising the NLL of sigmoid(logit(p) / T), by golden-section search on log T."""
+    p = np.clip(probs, 1e-12, 1 - 1e-12)
+    z = np.log(p / (1 - p))
+    y = labels.astype("float64")
+
+    def nll(log_t):
+        s = z / np.exp(log_t)
+        # log(1 + exp(-s)) for y=1 and log(1 + exp(s)) for y=0, computed stably
+        return float(np.mean(np.logaddexp(0.0, -s) * y + np.logaddexp(0.0, s) * (1 - y)))
+
+    lo, hi = np.log(0.05), np.log(20.0)
+    g = (np.sqrt(5) - 1) / 2
+    a, b = hi - g * (hi - lo), lo + g * (hi - lo)
+    fa, fb = nll(a), nll(b)
+    for _ in range(60):
+        if fa < fb:
+            hi, b, fb = b, a, fa
+            a = hi - g * (hi - lo)
+            fa = nll(a)
+        else:
+            lo, a, fa = a, b, fb
+            b = lo + g * (hi - lo)
+            fb = nll(b)
+    return float(np.exp((lo + hi) / 2))
+
+
+def recommend(sweep, target_sensitivity):
+    """Index of the best threshold for each criterion."""
+    rec = dict(
+        youden=int(np.argmax(sweep["youden"])),
+        f1=int(np.argmax(sweep["f1"])),
+        accuracy=int(np.argmax(sweep["accuracy"])),
+    )
+    # highest threshold (best specificity) that still reaches the target sensitivity
+    ok = np.nonzero(sweep["recall"] >= target_sensitivity)[0]
+    if len(ok):
+        rec["sensitivity"] = int(ok[-1])
+    return rec
+
+
+def row_at(sweep, i):
+    return {k: (round(float(v[i]), 4) if v.dtype.kind == "f" else int(v[i])) for k, v in sweep.items()}
+
+
+# ---------------------------
+# Main
+# ---------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate the classifier on a labelled folder and calibrate its threshold.")
+    ap.add_argument("dataset", help="folder with one sub-folder per class")
+    ap.add_argument("--positive", default="pneumonia", help="comma separated positive class folder names")
+    ap.add_argument("--negative", default="normal", help="comma separated negative class folder names")
+    ap.add_argument("--model", default="", help="model path (default: app.py's MODEL_PATH)")
+    ap.add_argument("--cache", default="", help="probability cache (.npz); default cache/evaluate/<dataset hash>.npz")
+    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--steps", type=int, default=1001, help="number of thresholds in the sweep")
+    ap.add_argument("--temperature", action="store_true", help="fit temperature scaling before the sweep")
+    ap.add_argument("--recommend", default="youden", choices=["youden", "f1", "accuracy", "sensitivity"])
+    ap.add_argument("--target-sensitivity", type=float, default=0.95)
+    ap.add_argument("--sweep-csv", default="", help="write every threshold's metrics to this CSV")
+    ap.add_argument("--write-config", default="", help="write the recommended threshold/temperature, e.g. model/calibration.json")
+    args = ap.parse_args()
+
+    bulk_score.configure_app(args.model)
+    import app
+
+    positive = {c.strip().lower() for c in args.positive.split(",")}
+    negative = {c.strip().lower() for c in args.negative.split(",")}
+    paths, labels = find_labelled_images(args.dataset, positive, negative)
+    if not paths:
+        raise SystemExit(f"No labelled images found under {args.dataset}")
+
+    cache = args.cache or default_cache_path(args.dataset)
+    raw = score_with_cache(paths, cache, app.MODEL_PATH, args.batch_size, args.workers)
+    valid = ~np.isnan(raw)
+    if not valid.all():
+        print(f"Ignoring {int((~valid).sum())} unreadable images")
+    raw, labels = raw[valid], labels[valid]
+    print(f"{len(labels)} images: {int(labels.sum())} positive, {int(len(labels) - labels.sum())} negative")
+
+    temperature = fit_temperature(raw, labels) if args.temperature else 1.0
+    probs = np.asarray(app.calibrate(raw, temperature), dtype="float64")
+
+    thresholds = np.linspace(0.0, 1.0, args.steps)
+    sweep = threshold_sweep(probs, labels, thresholds)
+    at_default = row_at(threshold_sweep(probs, labels, np.asarray([0.5])), 0)
+    recs = recommend(sweep, args.target_sensitivity)
+
+    print(f"\nROC-AUC            {roc_auc(probs, labels):.4f}")
+    print(f"Average precision  {average_precision(probs, labels):.4f}")
+    print(f"ECE (raw)          {expected_calibration_error(raw, labels):.4f}")
+    if args.temperature:
+        print(f"Temperature        {temperature:.3f}  ->  ECE {expected_calibration_error(probs, labels):.4f}")
+
+    print(f"\n{'criterion':<12} {'thr':>6} {'acc':>6} {'sens':>6} {'spec':>6} {'prec':>6} {'f1':>6}    tp    fp    fn    tn")
+    for name, r in [("default 0.5", at_default)] + [(k, row_at(sweep, i)) for k, i in recs.items()]:
+        print(f"{name:<12} {r['threshold']:>6.3f} {r['accuracy']:>6.3f} {r['recall']:>6.3f} {r['specificity']:>6.3f} "
+              f"{r['precision']:>6.3f} {r['f1']:>6.3f} {r['tp']:>5} {r['fp']:>5} {r['fn']:>5} {r['tn']:>5}")
+    if "sensitivity" not in recs:
+        print(f"(no threshold reaches sensitivity {args.target_sensitivity})")
+
+    if args.sweep_csv:
+        cols = list(sweep)
+        np.savetxt(args.sweep_csv, np.column_stack([sweep[c] for c in cols]), delimiter=",",
+                   header=",".join(cols), comments="", fmt="%.6g")
+        print(f"\nWrote threshold sweep (ROC/PR points and confusion counts) to {args.sweep_csv}")
+
+    if args.write_config:
+        if args.recommend not in recs:
+            raise SystemExit(f"No threshold satisfies '{args.recommend}'; config not written")
+        chosen = row_at(sweep, recs[args.recommend])
+        cfg = dict(
+            threshold=chosen["threshold"],
+            temperature=round(temperature, 6),
+            criterion=args.recommend,
+            model_path=app.MODEL_PATH,
+            dataset=args.dataset,
+            images=int(len(labels)),
+            metrics=chosen,
+            created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        )
+        with open(args.write_config, "w") as fh:
+            json.dump(cfg, fh, indent=2)
+        print(f"\nWrote {args.write_config}: threshold={cfg['threshold']} temperature={cfg['temperature']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# fake_llm.py
+# Deterministic stand-in for the Gemini client, for load tests and traffic replay.
+# Set XPERT_FAKE_LLM=1 and app.py uses it instead of google.genai: no network,
+# no API key. Each prompt gets a fixed answer and a fixed latency derived from its
+# hash, so replaying the same traffic against two builds gives the same LLM
+# behaviour and latency differences come from the server itself.
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+
+FAKE_LLM_LATENCY_MS = float(os.environ.get("XPERT_FAKE_LLM_LATENCY_MS", "800"))
+FAKE_LLM_JITTER = float(os.environ.get("XPERT_FAKE_LLM_JITTER", "0.25"))   # +/- share of the latency
+FAKE_LLM_CHUNKS = int(os.environ.get("XPERT_FAKE_LLM_CHUNKS", "8"))
+
+
+def _prompt_text(contents):
+    parts = []
+    for content in contents:
+        for part in getattr(content, "parts", None) or []:
+            parts.append(getattr(part, "text", "") or "")
+    return "\n".join(parts)
+
+
+class _FakeModels:
+    def __init__(self, latency_ms, jitter, chunks):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.chunks = max(1, chunks)
+
+    def _plan(self, contents):
+        prompt = _prompt_text(contents)
+        digest = hashlib.sha256(prompt.encode()).digest()
+        u = int.from_bytes(digest[:4], "big") / 2 ** 32          # deterministic in [0, 1)
+        latency = self.latency_ms * (1.0 + self.jitter * (2 * u - 1)) / 1000.0
+        words = [f"Simulated answer {digest[:4].hex()}:"] + prompt.split()[-24:]
+        usage = SimpleNamespace(prompt_token_count=(len(prompt) + 3) // 4, candidates_token_count=len(words))
+        return latency, words, usage
+
+    def generate_content(self, model, contents, config=None):
+        latency, words, usage = self._plan(contents)
+        time.sleep(latency)
+        return SimpleNamespace(text=" ".join(words), usage_metadata=usage)
+
+    def generate_content_stream(self, model, contents, config=None):
+        latency, words, usage = self._plan(contents)
+        # half the latency before the first chunk, the rest spread over the chunks
+        time.sleep(latency / 2)
+        size = max(1, len(words) // self.chunks)
+        for i in range(0, len(words), size):
+            if i:
+                time.sleep(latency / 2 / self.chunks)
+            yield SimpleNamespace(text=" ".join(words[i:i + size]) + " ", usage_metadata=usage)
+
+
+class FakeLLMClient:
+    """Mimics the parts of google.genai.Client that app.py uses."""
+
+    def __init__(self, latency_ms=FAKE_LLM_LATENCY_MS, jitter=FAKE_LLM_JITTER, chunks=FAKE_LLM_CHUNKS):
+        self.models = _FakeModels(latency_ms, jitter, chunks)
@@ -0,0 +1,386 @@
+# inference.py
+# Dedicated inference executor.
+# All model.predict calls go through executor worker threads (XPERT_INFER_WORKERS,
+# default 1), so Flask's request threads never run TensorFlow themselves and the
+# number of concurrent predictions is bounded. With several workers, or with the
+# shadow and ensemble executors, predict does run concurrently; this relies on
+# Keras inference being thread-safe (TFLitePredictor locks its interpreters).
+# TensorFlow's intra-/inter-op thread counts and the CPU affinity of the process
+# are configured once, before the runtime starts.
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+import scheduler
+
+TF_INTRA_OP_THREADS = int(os.environ.get("XPERT_TF_INTRA_OP_THREADS", "0"))  # 0 = TensorFlow default
+TF_INTER_OP_THREADS = int(os.environ.get("XPERT_TF_INTER_OP_THREADS", "0"))
+CPU_AFFINITY = os.environ.get("XPERT_CPU_AFFINITY", "")  # e.g. "0-7" or "0,2,4,6"
+INFER_WORKERS = int(os.environ.get("XPERT_INFER_WORKERS", "1"))
+INFER_MAX_BATCH = int(os.environ.get("XPERT_INFER_MAX_BATCH", "1"))
+INFER_BATCH_WAIT_MS = float(os.environ.get("XPERT_INFER_BATCH_WAIT_MS", "0"))
+XLA_ENABLED = os.environ.get("XPERT_XLA", "0") == "1"
+XLA_WARMUP = os.environ.get("XPERT_XLA_WARMUP", "1") == "1"
+TFLITE_SHARE_WEIGHTS = os.environ.get("XPERT_TFLITE_SHARE_WEIGHTS", "1") == "1"
+TUNE_PROFILE_PATH = os.environ.get("XPERT_TUNE_PROFILE", "model/tuning.json")   # written by autotune.py
+BATCH_BUCKETS = tuple(sorted(int(v) for v in os.environ.get("XPERT_BATCH_BUCKETS", "1,2,4,8,16").split(",") if v.strip()))
+
+_runtime_configured = False
+
+
+def parse_cpu_list(spec):
+    """Parse "0-3,8,10-11" into a set of CPU ids."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def set_cpu_affinity(cpus):
+    """Pin every thread of this process (and threads created later) to the given CPUs. Linux only."""
+    if not hasattr(os, "sched_setaffinity"):
+        print("Warning: CPU affinity is not supported on this platform")
+        return False
+    # a thread's affinity is inherited by the threads it creates, so pin the
+    # existing ones as well as the process itself
+    try:
+        tids = [int(t) for t in os.listdir("/proc/self/task")]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass
+    return True
+
+
+def configure_runtime(intra=None, inter=None, affinity=None):
+    """Apply TensorFlow threading and CPU affinity. Must run before the first TensorFlow op."""
+    global _runtime_configured
+    if _runtime_configured:
+        return
+    _runtime_configured = True
+    intra = TF_INTRA_OP_THREADS if intra is None else intra
+    inter = TF_INTER_OP_THREADS if inter is None else inter
+    affinity = CPU_AFFINITY if affinity is None else affinity
+
+    if affinity:
+        cpus = parse_cpu_list(affinity)
+        if set_cpu_affinity(cpus):
+            print(f"Pinned process to CPUs {sorted(cpus)}")
+    if intra or inter:
+        import tensorflow as tf
+        try:
+            if intra:
+                tf.config.threading.set_intra_op_parallelism_threads(intra)
+            if inter:
+                tf.config.threading.set_inter_op_parallelism_threads(inter)
+            print(f"TensorFlow threads: intra_op={intra or 'default'} inter_op={inter or 'default'}")
+        except RuntimeError as e:
+            # TensorFlow refuses once its runtime has been initialised
+            print(f"Warning: could not set TensorFlow threading: {e}")
+
+
+def load_tuning(model_path, path=TUNE_PROFILE_PATH):
+    """Executor settings from an autotune.py profile for this model on this machine.
+
+    Returns dict(workers, max_batch, batch_wait_ms, concurrency) holding only
+    the settings that are not set explicitly through their environment variable,
+    or {} when there is no matching profile.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        import json
+        with open(path) as fh:
+            profile = json.load(fh)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read tuning profile {path}: {e}")
+        return {}
+    best = profile.get("best") or {}
+    if profile.get("model_path") != model_path or profile.get("cpu_count") != os.cpu_count() or not best:
+        print(f"Ignoring tuning profile {path}: it was made for another model or machine; run autotune.py again")
+        return {}
+    env = dict(workers="XPERT_INFER_WORKERS", max_batch="XPERT_INFER_MAX_BATCH",
+               batch_wait_ms="XPERT_INFER_BATCH_WAIT_MS", concurrency="XPERT_ANALYZE_MAX_INFLIGHT")
+    return {k: best[k] for k, var in env.items() if k in best and var not in os.environ}
+
+
+def bucket_for(n, buckets=BATCH_BUCKETS):
+    """Smallest bucket that holds n rows (the largest bucket if none does)."""
+    for b in buckets:
+        if b >= n:
+            return b
+    return buckets[-1]
+
+
+def bucket_chunks(x, buckets=BATCH_BUCKETS):
+    """Split x into chunks of at most the largest bucket, each zero-padded up to
+    its bucket. Yields (padded chunk, number of real rows)."""
+    largest = buckets[-1]
+    for start in range(0, len(x), largest):
+        chunk = x[start:start + largest]
+        n = len(chunk)
+        b = bucket_for(n, buckets)
+        if b > n:
+            chunk = np.concatenate([chunk, np.zeros((b - n,) + chunk.shape[1:], dtype=chunk.dtype)], axis=0)
+        yield chunk, n
+
+
+class CompiledPredictor:
+    """Drop-in for model.predict: an XLA-jitted forward pass over fixed batch sizes.
+
+    Batches are zero-padded up to the nearest bucket (and split when larger than
+    the biggest one), so each bucket shape is traced and compiled exactly once and
+    Keras's per-call data-adapter machinery is skipped entirely.
+    """
+
+    def __init__(self, model, buckets=BATCH_BUCKETS, jit_compile=True):
+        import tensorflow as tf
+        self.model = model
+        self.buckets = tuple(sorted(buckets))
+        self._tf = tf
+        self._fn = tf.function(lambda x: model(x, training=False), jit_compile=jit_compile)
+
+    def __getattr__(self, name):
+        # inputs / input_shape / etc. come from the wrapped model
+        return getattr(self.model, name)
+
+    def row_shape(self):
+        shape = list(self.model.inputs[0].shape)
+        return tuple(int(d) for d in shape[1:])
+
+    def warmup(self):
+        """Trace and compile every bucket now instead of on the first requests."""
+        row_shape = self.row_shape()
+        for b in self.buckets:
+            self.predict(np.zeros((b,) + row_shape, dtype="float32"))
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype="float32")
+        out = []
+        for chunk, n in bucket_chunks(x, self.buckets):
+            y = self._fn(self._tf.constant(chunk))
+            out.append(np.asarray(y)[:n])
+        return np.concatenate(out, axis=0)
+
+
+def _tflite_interpreter_class():
+    # the standalone LiteRT runtime is much smaller than TensorFlow; use it when installed
+    try:
+        from ai_edge_litert.interpreter import Interpreter, OpResolverType
+    except ImportError:
+        from tensorflow.lite.python.interpreter import Interpreter, OpResolverType
+    return Interpreter, OpResolverType
+
+
+class TFLitePredictor:
+    """Drop-in for model.predict backed by a .tflite file (see convert_model.py).
+
+    The interpreter memory-maps the file read-only and its kernels read the
+    weights in place, so every process serving the same file shares one copy of
+    them in the page cache. The XNNPACK delegate repacks weights into private
+    memory, so it is only enabled with share_weights=False (faster, not shared).
+    Batches are zero-padded to the batch buckets (XPERT_BATCH_BUCKETS), so at most
+    one interpreter, and one tensor arena, is kept per bucket; they all map the
+    same file.
+    """
+
+    def __init__(self, path, num_threads=None, share_weights=TFLITE_SHARE_WEIGHTS, buckets=BATCH_BUCKETS):
+        self.path = path
+        self.num_threads = num_threads or TF_INTRA_OP_THREADS or None
+        self.share_weights = share_weights
+        self.buckets = tuple(sorted(buckets))
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interp = self._interpreter(self.buckets[0])
+        detail = interp.get_input_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in detail["shape"][1:])
+        self.output_shape = (None,) + tuple(int(d) for d in interp.get_output_details()[0]["shape"][1:])
+
+    def _interpreter(self, batch):
+        interp = self._interpreters.get(batch)
+        if interp is None:
+            Interpreter, OpResolverType = _tflite_interpreter_class()
+            resolver = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES if self.share_weights else OpResolverType.AUTO
+            interp = Interpreter(model_path=self.path, num_threads=self.num_threads,
+                                 experimental_op_resolver_type=resolver)
+            detail = interp.get_input_details()[0]
+            if int(detail["shape"][0]) != batch:
+                interp.resize_tensor_input(detail["index"], [batch] + [int(d) for d in detail["shape"][1:]])
+            interp.allocate_tensors()
+            self._interpreters[batch] = interp
+        return interp
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype="float32")
+        out = []
+        # an interpreter is not thread-safe; the executor normally has a single worker anyway
+        with self._lock:
+            for chunk, n in bucket_chunks(x, self.buckets):
+                interp = self._interpreter(len(chunk))
+                interp.set_tensor(interp.get_input_details()[0]["index"], chunk)
+                interp.invoke()
+                out.append(interp.get_tensor(interp.get_output_details()[0]["index"])[:n].copy())
+        return np.concatenate(out, axis=0)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values), q))
+
+
+class InferenceExecutor:
+    """Runs model.predict on dedicated thread(s); request threads submit work and wait.
+
+    Jobs queued while the model is busy are coalesced into one batch of up to
+    max_batch rows, waiting at most batch_wait_ms for the batch to fill. Waiting
+    jobs are picked up in weighted fair order by class (the requester's role, see
+    scheduler.py), so a backlog of one class cannot starve another.
+    """
+
+    def __init__(self, model, workers=INFER_WORKERS, max_batch=INFER_MAX_BATCH, batch_wait_ms=INFER_BATCH_WAIT_MS, name="inference", weights=None):
+        self.model = model
+        self.workers = max(1, int(workers))
+        self.max_batch = max(1, int(max_batch))
+        self.batch_wait = max(0.0, float(batch_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = scheduler.WeightedFairQueue(weights)
+        self._lock = threading.Lock()
+        self._queue_ms = deque(maxlen=2048)
+        self._compute_ms = deque(maxlen=2048)
+        self._jobs = 0
+        self._rows = 0
+        self._batches = 0
+        self._errors = 0
+        self._busy = 0
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, x, cls=None):
+        """Queue a preprocessed batch for class cls (a role; None = "default").
+        The Future resolves to (preds, timings)."""
+        fut = Future()
+        self._queue.put((x, fut, time.perf_counter()), cls)
+        return fut
+
+    def run(self, x, timeout=None, cls=None):
+        """Blocking helper: returns (preds, timings) with queue_ms, compute_ms and batch_size."""
+        return self.submit(x, cls).result(timeout=timeout)
+
+    def configure(self, max_batch=None, batch_wait_ms=None):
+        """Change the batch size and wait window while serving; the next batch uses them."""
+        with self._lock:
+            if max_batch is not None:
+                self.max_batch = max(1, int(max_batch))
+            if batch_wait_ms is not None:
+                self.batch_wait = max(0.0, float(batch_wait_ms)) / 1000.0
+
+    def idle(self):
+        """True when no job is queued or running."""
+        with self._lock:
+            busy = self._busy
+        return busy == 0 and self._queue.qsize() == 0
+
+    def close(self):
+        """Stop the worker threads once the jobs already queued are done."""
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        jobs = [first]
+        rows = len(first[0])
+        deadline = time.perf_counter() + self.batch_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)   # leave the stop signal for the loop
+                break
+            jobs.append(job)
+            rows += len(job[0])
+        return jobs
+
+    def _loop(self):
+        while True:
+            jobs = self._next_batch()
+            if jobs is None:
+                return
+            started = time.perf_counter()
+            with self._lock:
+                self._busy += 1
+            try:
+                x = jobs[0][0] if len(jobs) == 1 else np.concatenate([j[0] for j in jobs], axis=0)
+                preds = self.model.predict(x, verbose=0)
+                finished = time.perf_counter()
+                compute_ms = (finished - started) * 1000.0
+                offset = 0
+                for xj, fut, enqueued in jobs:
+                    n = len(xj)
+                    timings = dict(
+                        queue_ms=round((started - enqueued) * 1000.0, 2),
+                        compute_ms=round(compute_ms, 2),
+                        batch_size=len(x),
+                    )
+                    with self._lock:
+                        self._queue_ms.append(timings["queue_ms"])
+                    fut.set_result((preds[offset:offset + n], timings))
+                    offset += n
+                with self._lock:
+                    self._compute_ms.append(compute_ms)
+                    self._jobs += len(jobs)
+                    self._rows += len(x)
+                    self._batches += 1
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                for _, fut, _ in jobs:
+                    if not fut.done():
+                        fut.set_exception(e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def stats(self):
+        with self._lock:
+            queue_ms = list(self._queue_ms)
+            compute_ms = list(self._compute_ms)
+            jobs, rows, batches, errors, busy = self._jobs, self._rows, self._batches, self._errors, self._busy
+        return dict(
+            workers=self.workers,
+            max_batch=self.max_batch,
+            batch_wait_ms=round(self.batch_wait * 1000.0, 2),
+            queued=self._queue.qsize(),
+            busy=busy,
+            jobs=jobs,
+            batches=batches,
+            errors=errors,
+            mean_batch_size=round(rows / batches, 2) if batches else 0.0,
+            queue_wait_ms=dict(p50=round(_percentile(queue_ms, 50), 2), p95=round(_percentile(queue_ms, 95), 2), p99=round(_percentile(queue_ms, 99), 2)),
+            compute_ms=dict(p50=round(_percentile(compute_ms, 50), 2), p95=round(_percentile(compute_ms, 95), 2), p99=round(_percentile(compute_ms, 99), 2)),
+            classes=self._queue.stats(),   # per-role wait until a worker picked the job up
+        )
@@ -0,0 +1,277 @@
+# llm_guard.py
+# Deadlines, hedged retries and a circuit breaker around the LLM client.
+# Every call gets a deadline budget instead of the client's long default timeout.
+# If the first attempt has not answered after the recent p95 latency, a second
+# (hedged) attempt is started and whichever answers first wins. Repeated failures
+# open the circuit breaker, and callers then fail fast and use a fallback answer
+# until a trial call after XPERT_LLM_BREAKER_RESET_S succeeds. Attempts that
+# timed out or lost a hedge keep running until the upstream answers, so at most
+# XPERT_LLM_MAX_OUTSTANDING attempts may be outstanding at once: beyond that no
+# hedge is sent and new calls fail fast instead of queueing for a thread.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LLM_DEADLINE_S = float(os.environ.get("XPERT_LLM_DEADLINE_S", "20"))
+LLM_HEDGE = os.environ.get("XPERT_LLM_HEDGE", "1") == "1"
+LLM_HEDGE_MIN_S = float(os.environ.get("XPERT_LLM_HEDGE_MIN_S", "1.0"))
+LLM_BREAKER_FAILURES = int(os.environ.get("XPERT_LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.environ.get("XPERT_LLM_BREAKER_RESET_S", "30"))
+LLM_CACHE_SIZE = int(os.environ.get("XPERT_LLM_CACHE_SIZE", "512"))
+LLM_MAX_OUTSTANDING = int(os.environ.get("XPERT_LLM_MAX_OUTSTANDING", "16"))
+
+
+class LLMUnavailable(Exception):
+    """The LLM gave no answer within the deadline, failed, or the breaker is open."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason   # "circuit_open" | "timeout" | "error" | "overloaded"
+
+
+class LatencyTracker:
+    """Recent successful call latencies (seconds) for the hedge delay."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures; open -> half_open
+    after `reset_timeout` seconds, where a single trial call decides whether to close."""
+
+    STATE_CODES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET_S):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._opened = 0
+        self._short_circuited = 0
+
+    def allow(self):
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = "half_open"
+            if self._state == "closed":
+                return True
+            if self._state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self._short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._opened += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """A call was given up by the caller; let another trial call through."""
+        with self._lock:
+            self._trial_running = False
+
+    def retry_in(self):
+        with self._lock:
+            if self._state != "open":
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        with self._lock:
+            state = self._state
+            return dict(
+                state=state,
+                state_code=self.STATE_CODES[state],
+                consecutive_failures=self._failures,
+                times_opened=self._opened,
+                short_circuited=self._short_circuited,
+            )
+
+
+class GuardedLLM:
+    """Runs LLM calls under a deadline with p95-based hedging behind a circuit breaker,
+    and remembers recent answers so they can be served while the upstream is down."""
+
+    def __init__(self, deadline=LLM_DEADLINE_S, hedge=LLM_HEDGE, hedge_min=LLM_HEDGE_MIN_S,
+                 breaker=None, cache_size=LLM_CACHE_SIZE, max_outstanding=LLM_MAX_OUTSTANDING):
+        self.deadline = float(deadline)
+        self.hedge = hedge
+        self.hedge_min = float(hedge_min)
+        self.breaker = breaker or CircuitBreaker("llm")
+        self.latency = LatencyTracker()
+        self.max_outstanding = max(1, int(max_outstanding))
+        # one thread per allowed attempt, so an admitted attempt never waits for a thread
+        self._pool = ThreadPoolExecutor(max_workers=self.max_outstanding, thread_name_prefix="llm")
+        self._outstanding = 0   # attempts submitted and not finished, abandoned ones included
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._counts = dict(calls=0, succeeded=0, hedged=0, hedge_wins=0, timeouts=0, errors=0,
+                            short_circuited=0, overloaded=0, hedges_skipped=0, cache_hits=0, fallbacks=0)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counts[key] += n
+
+    def hedge_delay(self):
+        p95 = self.latency.percentile(95)
+        return max(self.hedge_min, p95 if p95 is not None else self.hedge_min)
+
+    # --- answer cache (used as a fallback) ---
+    @staticmethod
+    def cache_key(*parts):
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(repr(part).encode() + b"\0")
+        return h.hexdigest()
+
+    def remember(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def cached(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                self._counts["cache_hits"] += 1
+            return value
+
+    def note_fallback(self):
+        self._count("fallbacks")
+
+    def note_timeout(self):
+        self._count("timeouts")
+
+    # --- calls ---
+    def check(self):
+        """Raise LLMUnavailable straight away if the breaker is open."""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailable("circuit_open", f"LLM circuit breaker is open; retrying in {self.breaker.retry_in():.0f}s")
+
+    def call(self, fn, deadline=None):
+        """Run fn(timeout_s) under the deadline and return its result. fn gets the
+        seconds left in the budget so it can pass them on as a request timeout.
+        Raises LLMUnavailable on timeout, error, or while the breaker is open."""
+        self.check()
+        self._count("calls")
+        budget = self.deadline if deadline is None else float(deadline)
+        start = time.monotonic()
+        end = start + budget
+
+        def attempt():
+            t0 = time.monotonic()
+            try:
+                result = fn(max(0.1, end - t0))
+            finally:
+                with self._lock:
+                    self._outstanding -= 1
+            return result, time.monotonic() - t0
+
+        first = self._submit(attempt)
+        if first is None:
+            self.breaker.abandon()   # not the upstream's fault; let a half-open trial through
+            self._count("overloaded")
+            raise LLMUnavailable("overloaded", f"{self.max_outstanding} LLM attempts are still outstanding")
+        pending = {first}
+        errors = []
+        hedged = None
+        delay = self.hedge_delay()
+        while pending:
+            now = time.monotonic()
+            if now >= end:
+                break
+            timeout = end - now
+            if self.hedge and hedged is None and now - start < delay:
+                timeout = min(timeout, start + delay - now)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    result, seconds = fut.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                self.latency.add(seconds)
+                self.breaker.record_success()
+                self._count("succeeded")
+                if fut is hedged:
+                    self._count("hedge_wins")
+                return result
+            # hedge once: the first attempt failed, or is slower than p95, and there is budget left
+            if (self.hedge and hedged is None and (errors or time.monotonic() - start >= delay)
+                    and end - time.monotonic() > self.hedge_min):
+                hedged = self._submit(attempt)
+                if hedged is None:
+                    hedged = False   # no room for a hedge; do not try again for this call
+                    self._count("hedges_skipped")
+                else:
+                    pending.add(hedged)
+                    self._count("hedged")
+
+        self.breaker.record_failure()
+        if errors and not pending:
+            self._count("errors")
+            raise LLMUnavailable("error", str(errors[-1]))
+        self._count("timeouts")
+        raise LLMUnavailable("timeout", f"LLM did not answer within {budget:.1f}s")
+
+    def _submit(self, attempt):
+        """Start an attempt if fewer than max_outstanding are running, else None."""
+        with self._lock:
+            if self._outstanding >= self.max_outstanding:
+                return None
+            self._outstanding += 1
+        return self._pool.submit(attempt)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counts)
+            out["cached_answers"] = len(self._cache)
+            out["outstanding_attempts"] = self._outstanding
+            out["max_outstanding"] = self.max_outstanding
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
+        out.update(
+            deadline_s=self.deadline,
+            hedge=self.hedge,
+            hedge_delay_s=round(self.hedge_delay(), 3),
+            latency_p50_ms=(round(p50 * 1000.0, 1) if p50 is not None else None),
+            latency_p95_ms=(round(p95 * 1000.0, 1) if p95 is not None else None),
+            breaker=self.breaker.stats(),
+        )
+        return out
@@ -0,0 +1,187 @@
+# phash_index.py
+# Near-duplicate lookup for uploaded X-rays.
+# The same image often comes back re-exported, resized or recompressed, so its
+# bytes differ but its perceptual hash barely changes. Every analysed image gets
+# a 64-bit pHash (low frequencies of a 32x32 DCT) and dHash (horizontal
+# gradients of a 9x8 thumbnail). The index finds stored images whose pHash is
+# within a Hamming distance r of a query using multi-index hashing: the hash is
+# split into m chunks, and by the pigeonhole principle any match within r agrees
+# with the query to within r // m bits on at least one chunk. So only a handful
+# of buckets per chunk table are probed, never the whole index. Candidates are
+# then checked on the full pHash and dHash distances.
+#
+# Off by default: a hit returns an earlier diagnosis without running the model.
+# When enabled, only exact perceptual matches (distance 0) skip inference unless
+# XPERT_DEDUP_MAX_DISTANCE is raised. Entries store a content hash of the
+# upload, never its filename.
+import hashlib
+import itertools
+import json
+import os
+import threading
+
+import numpy as np
+
+DEDUP_ENABLED = os.environ.get("XPERT_DEDUP", "0") == "1"
+DEDUP_MAX_DISTANCE = int(os.environ.get("XPERT_DEDUP_MAX_DISTANCE", "0"))   # of 64 bits
+DEDUP_INDEX_PATH = os.environ.get("XPERT_DEDUP_INDEX", "cache/phash_index.jsonl")
+# bumped whenever hashes are computed differently, so old index files are not reused
+HASH_VERSION = 2
+
+_DCT = None
+
+
+def _dct_matrix(n=32):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+def _bits_to_int(bits):
+    return int(np.packbits(bits.astype("uint8")).view(">u8")[0])
+
+
+def content_id(path):
+    """Short SHA-256 of a file's bytes; stored in place of the upload's name."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def array_hashes(rgb):
+    """(phash, dhash) as 64-bit ints of an RGB array (h, w, 3), such as the image
+    prepare() has already decoded, so the upload is not decoded a second time."""
+    global _DCT
+    from PIL import Image
+    gray = Image.fromarray(np.clip(rgb, 0, 255).astype("uint8"), "RGB").convert("L")
+    small = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype="float64")
+    thumb = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype="float64")
+    if _DCT is None:
+        _DCT = _dct_matrix(32)
+    low = (_DCT @ small @ _DCT.T)[:8, :8].ravel()
+    # compare with the median of the AC terms; the DC term only carries brightness
+    phash = _bits_to_int(low > np.median(low[1:]))
+    dhash = _bits_to_int(thumb[:, 1:] > thumb[:, :-1])
+    return phash, dhash
+
+
+def _popcount(a):
+    """Number of set bits of every uint64 in a."""
+    return np.unpackbits(np.ascontiguousarray(a, dtype="uint64").view("uint8").reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PHashIndex:
+    """Multi-index hash table over 64-bit pHashes, with the stored prediction per entry."""
+
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE, chunks=None, path=None, model_path=""):
+        self.max_distance = int(max_distance)
+        # enough chunks that each table is probed within at most 1 bit
+        self.chunks = chunks or (4 if self.max_distance < 8 else 8)
+        self.chunk_bits = 64 // self.chunks
+        self.radius = self.max_distance // self.chunks
+        self._masks = self._probe_masks()
+        self._tables = [dict() for _ in range(self.chunks)]
+        self._phash = np.zeros(1024, dtype="uint64")
+        self._dhash = np.zeros(1024, dtype="uint64")
+        self._entries = []   # (raw pneumonia probability, content id of the upload)
+        self._lock = threading.Lock()
+        self._counts = dict(lookups=0, hits=0, candidates=0)
+        self.path = path
+        self.model_path = model_path
+        if path:
+            self._load(path)
+
+    def _probe_masks(self):
+        masks = [0]
+        for r in range(1, self.radius + 1):
+            for bits in itertools.combinations(range(self.chunk_bits), r):
+                masks.append(sum(1 << b for b in bits))
+        return masks
+
+    def _chunk(self, h, i):
+        return (h >> (i * self.chunk_bits)) & ((1 << self.chunk_bits) - 1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- updates ---
+    def add(self, phash, dhash, raw_prob, source="", persist=True):
+        with self._lock:
+            idx = len(self._entries)
+            if idx == len(self._phash):
+                self._phash = np.concatenate([self._phash, np.zeros_like(self._phash)])
+                self._dhash = np.concatenate([self._dhash, np.zeros_like(self._dhash)])
+            self._phash[idx] = phash
+            self._dhash[idx] = dhash
+            self._entries.append((float(raw_prob), source))
+            for i, table in enumerate(self._tables):
+                table.setdefault(self._chunk(phash, i), []).append(idx)
+            if persist and self.path:
+                with open(self.path, "a") as fh:
+                    fh.write(json.dumps(dict(p=f"{phash:016x}", d=f"{dhash:016x}", prob=raw_prob, source=source)) + "\n")
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as fh:
+                fh.write(json.dumps(dict(model_path=self.model_path, hash_version=HASH_VERSION)) + "\n")
+            return
+        with open(path) as fh:
+            header = json.loads(fh.readline() or "{}")
+            if header.get("model_path") != self.model_path or header.get("hash_version") != HASH_VERSION:
+                # predictions from another model, or hashes computed another way, are not reusable
+                print(f"Near-duplicate index {path} was built with another model or hash; starting a new one")
+                fh.close()
+                os.replace(path, path + ".old")
+                self._load(path)
+                return
+            for line in fh:
+                try:
+                    row = json.loads(line)
+                    self.add(int(row["p"], 16), int(row["d"], 16), row["prob"], row.get("source", ""), persist=False)
+                except (ValueError, KeyError):
+                    continue   # a torn last line after a crash
+        print(f"Loaded {len(self)} entries into the near-duplicate index")
+
+    # --- lookups ---
+    def lookup(self, phash, dhash):
+        """Closest stored entry within max_distance on both hashes, as
+        dict(raw_prob, source, distance, similarity), or None."""
+        with self._lock:
+            self._counts["lookups"] += 1
+            ids = set()
+            for i, table in enumerate(self._tables):
+                key = self._chunk(phash, i)
+                for mask in self._masks:
+                    bucket = table.get(key ^ mask)
+                    if bucket:
+                        ids.update(bucket)
+            if not ids:
+                return None
+            ids = np.fromiter(ids, dtype="int64", count=len(ids))
+            self._counts["candidates"] += len(ids)
+            pd = _popcount(self._phash[ids] ^ np.uint64(phash))
+            dd = _popcount(self._dhash[ids] ^ np.uint64(dhash))
+            ok = (pd <= self.max_distance) & (dd <= self.max_distance)
+            if not ok.any():
+                return None
+            best = np.flatnonzero(ok)[np.argmin((pd + dd)[ok])]
+            raw_prob, source = self._entries[ids[best]]
+            self._counts["hits"] += 1
+        distance = int(pd[best])
+        return dict(raw_prob=raw_prob, source=source, distance=distance,
+                    similarity=round(1.0 - distance / 64.0, 4))
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counts)
+            out["entries"] = len(self._entries)
+        out.update(max_distance=self.max_distance, chunks=self.chunks)
+        return out
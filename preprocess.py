@@ -0,0 +1,39 @@
+# preprocess.py
+# Image decoding and VGG16 preprocessing with only Pillow and NumPy.
+# Produces exactly what keras.preprocessing.image.load_img / img_to_array and
+# keras.applications.vgg16.preprocess_input do, without importing TensorFlow, so
+# it is cheap to use from worker processes (see bulk_score.py).
+import numpy as np
+
+# ImageNet channel means in BGR order, as used by preprocess_input (caffe mode)
+VGG_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype="float32")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+
+def load_image_array(src, target_size):
+    """Decode an image (path or file object) to an RGB float32 array of shape (h, w, 3).
+
+    Like keras load_img, the image is resized with nearest-neighbour sampling.
+    Raises ValueError if the file is not a readable image.
+    """
+    from PIL import Image
+    h, w = target_size
+    try:
+        with Image.open(src) as img:
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            if img.size != (w, h):
+                img = img.resize((w, h), Image.NEAREST)
+            return np.asarray(img, dtype="float32")
+    except Exception:
+        raise ValueError("Uploaded file is not a valid image or could not be opened")
+
+
+def vgg_preprocess(x):
+    """keras.applications.vgg16.preprocess_input: RGB -> BGR, then subtract the ImageNet means."""
+    return x[..., ::-1] - VGG_MEAN_BGR
+
+
+def vgg_unpreprocess(x):
+    """Inverse of vgg_preprocess: back to the decoded RGB pixel values."""
+    return (x + VGG_MEAN_BGR)[..., ::-1]
@@ -0,0 +1,124 @@
+# readiness.py
+# Deep readiness probe: synthetic work run in the background, result cached.
+# A loaded model is no proof that the pod can serve. The TensorFlow runtime may
+# be wedged, or so slow that every request times out. A background thread runs
+# each check every XPERT_READINESS_INTERVAL_S seconds, for example a tiny
+# prediction through the inference executor and optionally an LLM ping. It
+# caches the outcome, so /health/ready answers from memory. The pod reports
+# not-ready when a required check failed or took longer than its latency
+# threshold XPERT_READINESS_FAILURES times in a row. It also reports not-ready
+# when the last result is older than XPERT_READINESS_STALE_S, which is what
+# happens when the probe itself is stuck behind a hung runtime.
+import os
+import threading
+import time
+
+READINESS_INTERVAL_S = float(os.environ.get("XPERT_READINESS_INTERVAL_S", "10"))
+READINESS_MAX_LATENCY_MS = float(os.environ.get("XPERT_READINESS_MAX_LATENCY_MS", "2000"))
+READINESS_STALE_S = float(os.environ.get("XPERT_READINESS_STALE_S", str(3 * READINESS_INTERVAL_S)))
+READINESS_FAILURES = int(os.environ.get("XPERT_READINESS_FAILURES", "2"))
+READINESS_LLM = os.environ.get("XPERT_READINESS_LLM", "off").strip().lower()   # off | report | require
+READINESS_LLM_MAX_LATENCY_MS = float(os.environ.get("XPERT_READINESS_LLM_MAX_LATENCY_MS", "5000"))
+
+
+class Check:
+    """fn() runs the synthetic work and raises if it failed; it may return a dict
+    of details. If the details hold compute_ms, that rather than the wall time is
+    held against max_latency_ms, so time queued behind requests is not a miss.
+    required=False checks are reported but never make the pod unready."""
+
+    def __init__(self, name, fn, max_latency_ms, required=True):
+        self.name = name
+        self.fn = fn
+        self.max_latency_ms = max_latency_ms
+        self.required = required
+        self.failures = 0   # in a row
+        self.runs = 0
+        self.last = None
+
+
+class ReadinessProbe:
+    def __init__(self, interval=READINESS_INTERVAL_S, stale_after=READINESS_STALE_S, failures=READINESS_FAILURES):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.failures = max(1, failures)
+        self.checks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self._checked_at = None   # time.monotonic() of the last completed round
+        self._checked_wall = None
+
+    def add(self, name, fn, max_latency_ms=READINESS_MAX_LATENCY_MS, required=True):
+        """Register a check; also fine once the probe is running (e.g. per loaded model)."""
+        with self._lock:
+            self.checks = self.checks + [Check(name, fn, max_latency_ms, required)]
+
+    def start(self):
+        """Start the background thread (once). Safe to call on every probe."""
+        if self._thread is not None or not self.checks:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._started_at = time.monotonic()
+                self._thread = threading.Thread(target=self._loop, name="readiness-probe", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        for check in self.checks:
+            t0 = time.perf_counter()
+            error, details = None, None
+            try:
+                details = check.fn()
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            latency_ms = (time.perf_counter() - t0) * 1000.0
+            measured_ms = details.get("compute_ms", latency_ms) if isinstance(details, dict) else latency_ms
+            if error is None and measured_ms > check.max_latency_ms:
+                error = f"took {measured_ms:.0f} ms, over the {check.max_latency_ms:.0f} ms threshold"
+            result = dict(ok=error is None, latency_ms=round(latency_ms, 2), checked_at=time.time())
+            if error is not None:
+                result["error"] = error
+            if details:
+                result.update(details)
+            with self._lock:
+                check.runs += 1
+                check.failures = 0 if error is None else check.failures + 1
+                check.last = result
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._checked_wall = time.time()
+
+    def ready(self):
+        """(ready, reason). Ready until the first round completes, so startup
+        readiness is decided by the caller's own checks (e.g. model loaded)."""
+        with self._lock:
+            if self._checked_at is None:
+                if self._started_at is not None and time.monotonic() - self._started_at > self.stale_after:
+                    return False, "the first probe round has not finished"
+                return True, None
+            age = time.monotonic() - self._checked_at
+            if age > self.stale_after:
+                return False, f"probe result is {age:.0f}s old"
+            for check in self.checks:
+                if check.required and check.failures >= self.failures:
+                    return False, f"{check.name}: {check.last.get('error')}"
+        return True, None
+
+    def status(self):
+        ready, reason = self.ready()
+        with self._lock:
+            return dict(
+                ready=ready,
+                reason=reason,
+                running=self._thread is not None,
+                checked_at=self._checked_wall,
+                age_s=(round(time.monotonic() - self._checked_at, 3) if self._checked_at is not None else None),
+                checks={c.name: dict(c.last or {}, required=c.required, failures_in_a_row=c.failures,
+                                     max_latency_ms=c.max_latency_ms) for c in self.checks},
+            )
@@ -0,0 +1,188 @@
+# replay.py
+# Replay captured traffic (see traffic.py) against a running server and compare builds.
+# Requests are sent open-loop on the original schedule, or faster or slower with
+# --rate. They go out at their planned time whether or not earlier ones have
+# finished, so queueing shows up in the latencies just as it did in production.
+# Run the server with XPERT_FAKE_LLM=1 so LLM latency is the same on every run.
+# Every request is sent with ?dedup=0: a replayed upload would otherwise hit the
+# near-duplicate index (if the server has it on) and skip the model entirely.
+#
+#   XPERT_FAKE_LLM=1 flask --app app run --with-threads             # build A
+#   python replay.py capture/ --url http://127.0.0.1:5000 --out a.json
+#   python replay.py capture/ --url http://127.0.0.1:5000 --out b.json --rate 2   # build B, twice as fast
+#   python replay.py --compare a.json b.json
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+import numpy as np
+
+import traffic
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def replay_query(query):
+    """The captured query string with dedup forced off."""
+    params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k != "dedup"]
+    return urlencode(params + [("dedup", "0")])
+
+
+def build_request(capture, directory):
+    """requests.request() keyword arguments for one captured request."""
+    kwargs = dict(headers={"X-Client-Id": capture["client"]})
+    if "json" in capture:
+        kwargs["json"] = capture["json"]
+    else:
+        kwargs["data"] = capture.get("form") or {}
+        files = {}
+        for field, info in (capture.get("files") or {}).items():
+            with open(os.path.join(directory, "blobs", info["blob"]), "rb") as fh:
+                files[field] = (info["name"], fh.read())
+        kwargs["files"] = files
+    return kwargs
+
+
+def replay(directory, url, rate=1.0, limit=0, concurrency=64, timeout=120.0):
+    """Send the captured requests on their (scaled) schedule. Returns one result per request."""
+    import requests
+    captures = traffic.load_captures(directory)
+    if limit:
+        captures = captures[:limit]
+    if not captures:
+        raise SystemExit(f"No captured requests in {directory}")
+    prepared = [build_request(c, directory) for c in captures]   # read blobs before the clock starts
+    local = threading.local()
+    t0 = captures[0]["ts"]
+
+    def send(i, planned, start):
+        capture = captures[i]
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        target = url.rstrip("/") + capture["path"] + "?" + replay_query(capture["query"])
+        sent = time.perf_counter()
+        row = dict(id=i, path=capture["path"], late_ms=round((sent - start - planned) * 1000.0, 2),
+                   recorded_ms=capture.get("duration_ms"))
+        try:
+            with session.request(capture["method"], target, stream=True, timeout=timeout, **prepared[i]) as resp:
+                first = None
+                for chunk in resp.iter_content(chunk_size=None):
+                    if first is None and chunk:
+                        first = time.perf_counter()
+                done = time.perf_counter()
+            row.update(status=resp.status_code, latency_ms=round((done - sent) * 1000.0, 2),
+                       ttfb_ms=round(((first or done) - sent) * 1000.0, 2))
+        except Exception as e:
+            row.update(status=None, latency_ms=None, ttfb_ms=None, error=str(e))
+        return row
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    start = time.perf_counter()
+    futures = []
+    for i, capture in enumerate(captures):
+        planned = (capture["ts"] - t0) / rate
+        delay = start + planned - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(pool.submit(send, i, planned, start))
+    results = [f.result() for f in futures]
+    pool.shutdown()
+    return results, time.perf_counter() - start
+
+
+# ---------------------------
+# Summaries and build-to-build comparison
+# ---------------------------
+def summarise(results):
+    """Latency distribution per endpoint (and "all")."""
+    groups = {}
+    for r in results:
+        for key in (r["path"], "all"):
+            groups.setdefault(key, []).append(r)
+    out = {}
+    for key, rows in sorted(groups.items()):
+        lat = np.asarray([r["latency_ms"] for r in rows if r.get("latency_ms") is not None and r["status"] and r["status"] < 400])
+        summary = dict(
+            requests=len(rows),
+            errors=sum(1 for r in rows if not r.get("status") or r["status"] >= 500),
+            rejected=sum(1 for r in rows if r.get("status") == 429),
+            mean_ms=(round(float(lat.mean()), 2) if len(lat) else None),
+        )
+        for q in PERCENTILES:
+            summary[f"p{q}_ms"] = round(float(np.percentile(lat, q)), 2) if len(lat) else None
+        out[key] = summary
+    return out
+
+
+def compare(a, b):
+    """Print per-endpoint percentile changes from run a to run b, and paired per-request deltas."""
+    sa, sb = summarise(a["results"]), summarise(b["results"])
+    cols = ["mean_ms"] + [f"p{q}_ms" for q in PERCENTILES]
+    print(f"A: {a.get('label', 'a')}  (rate x{a.get('rate')})\nB: {b.get('label', 'b')}  (rate x{b.get('rate')})\n")
+    print(f"{'endpoint':<24} {'n':>5} " + " ".join(f"{c[:-3]:>18}" for c in cols) + "   errors  429s")
+    for key in sorted(set(sa) | set(sb)):
+        ra, rb = sa.get(key, {}), sb.get(key, {})
+        cells = []
+        for c in cols:
+            va, vb = ra.get(c), rb.get(c)
+            if va is None or vb is None:
+                cells.append(f"{'-':>18}")
+            else:
+                cells.append(f"{va:.0f}->{vb:.0f} ({100.0 * (vb - va) / max(va, 1e-9):+.0f}%)".rjust(18))
+        print(f"{key:<24} {rb.get('requests', 0):>5} " + " ".join(cells)
+              + f"   {ra.get('errors', 0)}->{rb.get('errors', 0)}  {ra.get('rejected', 0)}->{rb.get('rejected', 0)}")
+
+    # the same captured request in both runs: how often and by how much did it get slower?
+    by_id = {r["id"]: r for r in a["results"] if r.get("latency_ms") is not None}
+    diffs = np.asarray([r["latency_ms"] - by_id[r["id"]]["latency_ms"]
+                        for r in b["results"] if r.get("latency_ms") is not None and r["id"] in by_id])
+    if len(diffs):
+        print(f"\npaired: {len(diffs)} requests, median change {np.median(diffs):+.1f} ms, "
+              f"{100.0 * np.mean(diffs > 0):.0f}% slower in B")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay captured traffic against a server, or compare two replays.")
+    ap.add_argument("capture", nargs="?", help="directory written by XPERT_RECORD_DIR")
+    ap.add_argument("--url", default="http://127.0.0.1:5000")
+    ap.add_argument("--rate", type=float, default=1.0, help="speed-up of the original schedule (2 = twice as fast)")
+    ap.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    ap.add_argument("--concurrency", type=int, default=64, help="most requests in flight from this client")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", default="", help="save results as JSON for --compare")
+    ap.add_argument("--label", default="", help="name for this run, e.g. a git commit")
+    ap.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two saved replays")
+    args = ap.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as fh:
+                runs.append(json.load(fh))
+        compare(*runs)
+        return
+    if not args.capture:
+        ap.error("give a capture directory, or --compare A B")
+
+    results, elapsed = replay(args.capture, args.url, args.rate, args.limit, args.concurrency, args.timeout)
+    run = dict(label=args.label or args.url, url=args.url, rate=args.rate, capture=args.capture,
+               elapsed_s=round(elapsed, 3), created=time.strftime("%Y-%m-%dT%H:%M:%S"), results=results)
+    summary = summarise(results)
+    late = max((r["late_ms"] for r in results), default=0.0)
+    print(f"Replayed {len(results)} requests in {elapsed:.1f}s (rate x{args.rate}, worst send lag {late:.0f} ms)")
+    for key, s in summary.items():
+        print(f"{key:<24} n={s['requests']:<5} errors={s['errors']:<3} 429={s['rejected']:<3} "
+              + " ".join(f"p{q}={s[f'p{q}_ms']}" for q in PERCENTILES))
+    if args.out:
+        run["summary"] = summary
+        with open(args.out, "w") as fh:
+            json.dump(run, fh, indent=1)
+        print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
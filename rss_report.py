@@ -0,0 +1,112 @@
+# rss_report.py
+# Memory used per worker process, before and after the model is loaded.
+# Starts N worker processes that import app.py the way a server worker would,
+# load the model, run one prediction, then wait until every worker has done the
+# same. RSS, PSS (shared pages split between the processes that map them) and
+# USS (pages private to one process) are read from /proc/<pid>/smaps_rollup at
+# each step, and the number of workers that fit in the node's memory is estimated
+# from the private memory per worker plus the shared memory counted once. Linux only.
+#
+#   python rss_report.py --workers 4
+#   python rss_report.py --workers 4 --model model/vgg_tuned.h5 --model model/vgg_tuned.tflite
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty")
+
+
+def memory_kb(pid="self"):
+    """RSS / PSS / USS / shared (kB) for a process, from smaps_rollup."""
+    values = dict.fromkeys(FIELDS, 0)
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        for line in fh:
+            key, _, rest = line.partition(":")
+            if key in values:
+                values[key] = int(rest.split()[0])
+    return dict(
+        rss=values["Rss"],
+        pss=values["Pss"],
+        uss=values["Private_Clean"] + values["Private_Dirty"],
+        shared=values["Shared_Clean"] + values["Shared_Dirty"],
+    )
+
+
+def node_memory_kb():
+    with open("/proc/meminfo") as fh:
+        info = {line.split(":")[0]: int(line.split()[1]) for line in fh}
+    return info["MemTotal"], info.get("MemAvailable", info["MemFree"])
+
+
+def worker(model_path, ready, release, results):
+    """One simulated server worker. Reports memory at each stage to `results`."""
+    os.environ["XPERT_MODEL_PATH"] = model_path
+    os.environ["XPERT_MODEL_LOAD"] = "lazy"
+    rows = dict(start=memory_kb())
+    import app
+    rows["imported"] = memory_kb()
+    if app.get_model() is None:
+        results.put((os.getpid(), None))
+        ready.wait()
+        return
+    h, w = app.get_model_input_size()
+    app.get_executor().run(np.zeros((1, h, w, 3), dtype="float32"))
+    rows["loaded"] = memory_kb()
+    ready.wait()     # every worker has loaded: PSS now splits the shared pages between them
+    rows["all_loaded"] = memory_kb()
+    results.put((os.getpid(), rows))
+    release.wait()
+
+
+def report(model_path, workers):
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(workers + 1)
+    release = ctx.Event()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(model_path, ready, release, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    ready.wait()
+    rows = [results.get() for _ in procs]
+    release.set()
+    for p in procs:
+        p.join()
+    if any(r is None for _, r in rows):
+        raise SystemExit(f"A worker could not load {model_path}")
+
+    def mb(kb):
+        return f"{kb / 1024:8.1f}"
+
+    print(f"\n{model_path}: {workers} workers (MB)")
+    print(f"{'stage':<12} {'rss':>8} {'pss':>8} {'uss':>8} {'shared':>8}")
+    for stage in ("start", "imported", "loaded", "all_loaded"):
+        m = {k: np.mean([r[stage][k] for _, r in rows]) for k in ("rss", "pss", "uss", "shared")}
+        print(f"{stage:<12} {mb(m['rss'])} {mb(m['pss'])} {mb(m['uss'])} {mb(m['shared'])}")
+
+    # memory that grows with the number of workers vs memory paid once per node
+    private = np.mean([r["all_loaded"]["uss"] for _, r in rows])
+    shared_once = sum(r["all_loaded"]["pss"] - r["all_loaded"]["uss"] for _, r in rows)
+    total, available = node_memory_kb()
+    fit = int(max(0, total - shared_once) // max(private, 1))
+    print(f"model load adds {mb(private - np.mean([r['imported']['uss'] for _, r in rows])).strip()} MB private per worker; "
+          f"total PSS {mb(sum(r['all_loaded']['pss'] for _, r in rows)).strip()} MB")
+    print(f"~{fit} workers fit in {total / 1024 / 1024:.1f} GB of node memory "
+          f"({private / 1024:.0f} MB private each + {shared_once / 1024:.0f} MB shared once; "
+          f"{available / 1024 / 1024:.1f} GB available now)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Report RSS/PSS per worker before and after loading the model.")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--model", action="append", default=[], help="model path; repeat to compare (default: app.py's MODEL_PATH)")
+    args = ap.parse_args()
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise SystemExit("rss_report.py needs Linux /proc/<pid>/smaps_rollup")
+    for path in args.model or [os.environ.get("XPERT_MODEL_PATH", "model/vgg_tuned.h5")]:
+        report(path, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# scheduler.py
+# Role-aware weighted fair queuing for inference jobs and LLM calls.
+# Work is tagged with a class, the role resolved by detect_role() / ?role=
+# ("doctor", "student"), or "default" for anything else. Each class gets a share
+# of the service proportional to its weight (XPERT_PRIORITY_WEIGHTS, default
+# doctor=4,student=1). Clinical requests therefore overtake a backlog of student
+# requests, but students are never starved. This is start-time fair queuing:
+# every item gets a virtual finish tag of max(virtual time, the class's last tag)
+# + 1/weight, and the smallest tag is served first. Items within a class stay in
+# FIFO order. Per-class queue waits are kept for /metrics.
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+DEFAULT_CLASS = "default"
+
+
+def parse_weights(spec):
+    """Parse "doctor=4,student=1" into {"doctor": 4.0, "student": 1.0}."""
+    weights = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            weights[name.strip().lower()] = max(1e-3, float(value))
+    return weights
+
+
+PRIORITY_WEIGHTS = parse_weights(os.environ.get("XPERT_PRIORITY_WEIGHTS", "doctor=4,student=1"))
+
+
+class _ClassStats:
+    def __init__(self):
+        self.waits = deque(maxlen=2048)
+        self.served = 0
+        self.queued = 0
+
+    def summary(self):
+        waits = np.asarray(self.waits) if self.waits else np.zeros(1)
+        return dict(
+            served=self.served,
+            queued=self.queued,
+            wait_ms=dict(p50=round(float(np.percentile(waits, 50)), 2),
+                         p95=round(float(np.percentile(waits, 95)), 2),
+                         p99=round(float(np.percentile(waits, 99)), 2)),
+        )
+
+
+class FairTags:
+    """Virtual-time bookkeeping shared by the queue, the gate and admission.py."""
+
+    def __init__(self, weights):
+        self.weights = dict(weights)
+        self._vtime = 0.0
+        self._last = {}
+        self._seq = itertools.count()
+        self.classes = {}
+
+    def cls(self, name):
+        name = (name or DEFAULT_CLASS).lower()
+        if name not in self.classes:
+            self.classes[name] = _ClassStats()
+        return name
+
+    def peek(self, cls):
+        """The finish tag the next item of cls would get, without recording it."""
+        return max(self._vtime, self._last.get(cls, 0.0)) + 1.0 / self.weights.get(cls, 1.0)
+
+    def tag(self, cls):
+        finish = self.peek(cls)
+        self._last[cls] = finish
+        return (finish, next(self._seq))
+
+    def served(self, tag, cls, enqueued):
+        self._vtime = max(self._vtime, tag[0] - 1.0 / self.weights.get(cls, 1.0))
+        stats = self.classes[cls]
+        stats.queued -= 1
+        stats.served += 1
+        stats.waits.append((time.perf_counter() - enqueued) * 1000.0)
+
+    def stats(self):
+        return {name: dict(weight=self.weights.get(name, 1.0), **s.summary()) for name, s in sorted(self.classes.items())}
+
+
+class WeightedFairQueue:
+    """A queue.Queue stand-in (put / get / get_nowait / qsize) that serves classes by weight."""
+
+    def __init__(self, weights=None):
+        self._tags = FairTags(PRIORITY_WEIGHTS if weights is None else weights)
+        self._heap = []
+        self._cond = threading.Condition()
+
+    def put(self, item, cls=None):
+        with self._cond:
+            if item is None:
+                # a stop signal sorts after everything already queued
+                heapq.heappush(self._heap, ((float("inf"), next(self._tags._seq)), None, 0.0, None))
+            else:
+                cls = self._tags.cls(cls)
+                heapq.heappush(self._heap, (self._tags.tag(cls), cls, time.perf_counter(), item))
+                self._tags.classes[cls].queued += 1
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if not block:
+                timeout = 0
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._heap:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            tag, cls, enqueued, item = heapq.heappop(self._heap)
+            if item is not None:
+                self._tags.served(tag, cls, enqueued)
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            return self._tags.stats()
+
+
+class PriorityGate:
+    """At most max_inflight holders at a time; waiters are admitted in weighted fair order."""
+
+    def __init__(self, max_inflight, weights=None):
+        self.max_inflight = max(1, int(max_inflight))
+        self._tags = FairTags(PRIORITY_WEIGHTS if weights is None else weights)
+        self._waiting = []   # heap of (tag, cls, enqueued)
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, cls=None, timeout=None):
+        """Return True once a slot is held, False on timeout."""
+        with self._cond:
+            cls = self._tags.cls(cls)
+            entry = (self._tags.tag(cls), cls, time.perf_counter())
+            heapq.heappush(self._waiting, entry)
+            self._tags.classes[cls].queued += 1
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._inflight >= self.max_inflight or self._waiting[0] is not entry:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._tags.classes[cls].queued -= 1
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._inflight += 1
+            self._tags.served(entry[0], cls, entry[2])
+            self._cond.notify_all()   # the next waiter may fit too
+            return True
+
+    def release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(max_inflight=self.max_inflight, inflight=self._inflight, classes=self._tags.stats())
@@ -0,0 +1,170 @@
+# shadow.py
+# Shadow / canary inference for a candidate model.
+# A configurable fraction of /analyze requests is also run through the candidate
+# model on its own inference executor: a single worker thread, small batches, and
+# for a .tflite candidate at most XPERT_SHADOW_THREADS interpreter threads. A
+# Keras candidate shares TensorFlow's thread pools with the primary model, so a
+# sampled run only starts once the primary executor is idle (nothing queued or
+# running); if it does not go idle within XPERT_SHADOW_IDLE_WAIT_MS the run is
+# skipped. The upload is preprocessed at the candidate's own input size on the
+# shadow thread, off the response path. At most XPERT_SHADOW_QUEUE_SIZE runs are
+# pending and work is dropped beyond that, so the shadow model can never slow
+# down or fail the primary response. Agreement is judged with the served
+# (calibrated) decision, not a fixed 0.5.
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+
+SHADOW_MODEL_PATH = os.environ.get("XPERT_SHADOW_MODEL_PATH", "")
+SHADOW_FRACTION = float(os.environ.get("XPERT_SHADOW_FRACTION", "0.1"))
+SHADOW_QUEUE_SIZE = int(os.environ.get("XPERT_SHADOW_QUEUE_SIZE", "32"))
+SHADOW_THREADS = int(os.environ.get("XPERT_SHADOW_THREADS", "1"))
+SHADOW_MAX_BATCH = int(os.environ.get("XPERT_SHADOW_MAX_BATCH", "4"))
+SHADOW_IDLE_WAIT_MS = float(os.environ.get("XPERT_SHADOW_IDLE_WAIT_MS", "200"))
+SHADOW_CLASS = "shadow"
+
+
+def load_candidate(path, num_threads=SHADOW_THREADS):
+    """Load the candidate: a .tflite file (thread-limited interpreter) or a Keras .h5."""
+    if path.endswith(".tflite"):
+        return inference.TFLitePredictor(path, num_threads=num_threads)
+    from keras.models import load_model
+    return load_model(path)
+
+
+def _pneumonia_prob(preds):
+    # same interpretation as analyze(): index 1 = Pneumonia, or a single sigmoid output
+    try:
+        return float(preds[0][1])
+    except Exception:
+        return float(preds[0]) if preds.shape[-1] == 1 else 0.0
+
+
+class ShadowRunner:
+    """Runs a candidate model next to the primary one and records how they compare."""
+
+    def __init__(self, model, model_path="", fraction=SHADOW_FRACTION, queue_size=SHADOW_QUEUE_SIZE, threshold=0.5,
+                 decide=None, max_batch=SHADOW_MAX_BATCH, input_size=(224, 224), primary=None,
+                 idle_wait_ms=SHADOW_IDLE_WAIT_MS):
+        """decide(raw_prob) -> True for Pneumonia is the served decision; it
+        defaults to raw_prob > threshold. input_size is the candidate's (h, w).
+        primary is the serving model's executor; runs wait for it to be idle."""
+        self.model = model
+        self.model_path = model_path
+        self.fraction = fraction
+        self.threshold = threshold
+        self.decide = decide or (lambda p: p > self.threshold)
+        self.queue_size = max(1, int(queue_size))
+        self.input_size = tuple(input_size)
+        self.primary = primary
+        self.idle_wait = max(0.0, float(idle_wait_ms)) / 1000.0
+        self.executor = inference.InferenceExecutor(model, workers=1, max_batch=max_batch, batch_wait_ms=0, name="shadow")
+        self._prep = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-prep")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = dict(
+            sampled=0, dropped=0, skipped_busy=0, completed=0, errors=0, agreements=0,
+            abs_delta_sum=0.0, max_abs_delta=0.0,
+            primary_ms_sum=0.0, candidate_ms_sum=0.0,
+        )
+
+    def maybe_submit(self, prepare, primary_prob, primary_ms):
+        """Queue a shadow run for a sampled request. prepare((h, w)) returns the
+        preprocessed batch for an input size; it runs on the shadow thread.
+        Never blocks and never raises."""
+        try:
+            if random.random() >= self.fraction:
+                return False
+            with self._lock:
+                self._stats["sampled"] += 1
+                if self._pending >= self.queue_size:
+                    self._stats["dropped"] += 1
+                    return False
+                self._pending += 1
+            self._prep.submit(self._run, prepare, primary_prob, primary_ms)
+            return True
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+            print(f"[shadow] submit failed: {e}")
+        return False
+
+    def _primary_idle(self):
+        """Wait up to idle_wait for the primary executor to have nothing queued or running."""
+        if self.primary is None:
+            return True
+        deadline = time.monotonic() + self.idle_wait
+        while not self.primary.idle():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def _run(self, prepare, primary_prob, primary_ms):
+        try:
+            if not self._primary_idle():
+                with self._lock:
+                    self._pending -= 1
+                    self._stats["skipped_busy"] += 1
+                return
+            future = self.executor.submit(prepare(self.input_size), SHADOW_CLASS)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+                self._stats["errors"] += 1
+            print(f"[shadow] candidate preprocessing failed: {e}")
+            return
+        future.add_done_callback(lambda f: self._done(f, primary_prob, primary_ms))
+
+    def _done(self, future, primary_prob, primary_ms):
+        with self._lock:
+            self._pending -= 1
+        try:
+            preds, timings = future.result()
+            self._record(primary_prob, _pneumonia_prob(preds), primary_ms, timings["compute_ms"])
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            print(f"[shadow] candidate prediction failed: {e}")
+
+    def _record(self, primary_prob, candidate_prob, primary_ms, candidate_ms):
+        agree = bool(self.decide(primary_prob)) == bool(self.decide(candidate_prob))
+        delta = candidate_prob - primary_prob
+        with self._lock:
+            s = self._stats
+            s["completed"] += 1
+            s["agreements"] += int(agree)
+            s["abs_delta_sum"] += abs(delta)
+            s["max_abs_delta"] = max(s["max_abs_delta"], abs(delta))
+            s["primary_ms_sum"] += primary_ms
+            s["candidate_ms_sum"] += candidate_ms
+        print(
+            f"[shadow] agree={agree} primary={primary_prob:.3f} candidate={candidate_prob:.3f} "
+            f"delta={delta:+.3f} primary_ms={primary_ms:.1f} candidate_ms={candidate_ms:.1f}"
+        )
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        done = s["completed"] or 1
+        return dict(
+            model_path=self.model_path,
+            fraction=self.fraction,
+            queue_depth=self._pending,
+            queue_capacity=self.queue_size,
+            sampled=s["sampled"],
+            dropped=s["dropped"],
+            skipped_busy=s["skipped_busy"],
+            completed=s["completed"],
+            errors=s["errors"],
+            agreement_rate=round(s["agreements"] / done, 4),
+            mean_abs_delta=round(s["abs_delta_sum"] / done, 4),
+            max_abs_delta=round(s["max_abs_delta"], 4),
+            mean_primary_ms=round(s["primary_ms_sum"] / done, 2),
+            mean_candidate_ms=round(s["candidate_ms_sum"] / done, 2),
+            executor=self.executor.stats(),
+        )
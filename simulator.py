@@ -0,0 +1,146 @@
+# simulator.py
+# Simulated classifier for ?mock=1 and capacity planning without the real weights.
+# SimulatedModel stands in for model.predict in the inference executor. Uploads
+# are still decoded and preprocessed for real. Each batch then takes as long as
+# the real model took for that batch size, drawn from a latency profile recorded
+# on the target machine, and returns a probability derived from the image content.
+# The same image always gets the same answer.
+#
+# Profiles are recorded through the server's own inference executor and predictor
+# (the XLA-compiled or TFLite path when the server would use it), so they time
+# what the server actually runs.
+#
+#   python simulator.py record                  # profile model/vgg_tuned.h5 -> model/latency_profile.json
+#   python simulator.py record --batch-sizes 1,2,4,8 --repeats 30 --out profiles/c6i.2xlarge.json
+#   XPERT_SIM_PROFILE=profiles/c6i.2xlarge.json flask --app app run     # then use ?mock=1
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SIM_PROFILE_PATH = os.environ.get("XPERT_SIM_PROFILE", "model/latency_profile.json")
+SIM_MODE = os.environ.get("XPERT_SIM_MODE", "sleep")   # sleep | busy
+SIM_SEED = int(os.environ.get("XPERT_SIM_SEED", "0"))
+
+# Used when no profile has been recorded: rough VGG16 figures on an 8-core CPU
+# (about 40 ms fixed cost plus 90 ms per image). Record a real profile for planning.
+DEFAULT_PROFILE = dict(
+    model_path="(built-in estimate)",
+    input_shape=[224, 224, 3],
+    batches={str(n): [40.0 + 90.0 * n] for n in (1, 2, 4, 8, 16)},
+)
+
+
+def load_profile(path=SIM_PROFILE_PATH):
+    if path and os.path.exists(path):
+        with open(path) as fh:
+            return json.load(fh)
+    return DEFAULT_PROFILE
+
+
+class SimulatedModel:
+    """Drop-in for model.predict with recorded per-batch-size latency.
+
+    mode="sleep" only takes wall time; mode="busy" spins a core for the same
+    time, so it also competes for CPU like the real model does.
+    """
+
+    def __init__(self, profile=None, mode=SIM_MODE, seed=SIM_SEED):
+        self.profile = profile or load_profile()
+        self.mode = mode
+        self.input_shape = (None,) + tuple(self.profile.get("input_shape", (224, 224, 3)))
+        self.output_shape = (None, 2)
+        self._sizes = np.asarray(sorted(int(n) for n in self.profile["batches"]))
+        self._samples = {int(n): np.asarray(v, dtype="float64") for n, v in self.profile["batches"].items()}
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def latency_ms(self, n):
+        """One latency draw for a batch of n rows. Between recorded sizes the draw
+        is scaled linearly; above the largest it grows by the per-row cost."""
+        sizes = self._sizes
+        lo = sizes[sizes <= n].max() if (sizes <= n).any() else sizes[0]
+        hi = sizes[sizes >= n].min() if (sizes >= n).any() else sizes[-1]
+        with self._lock:
+            u = self._rng.random()
+        lo_ms = float(np.quantile(self._samples[lo], u))
+        if lo == hi:
+            if n > hi and len(sizes) > 1:
+                prev = sizes[-2]
+                per_row = (np.median(self._samples[hi]) - np.median(self._samples[prev])) / (hi - prev)
+                return lo_ms + max(0.0, per_row) * (n - hi)
+            return lo_ms * (n / lo if n < lo else 1.0)
+        hi_ms = float(np.quantile(self._samples[hi], u))
+        return lo_ms + (hi_ms - lo_ms) * (n - lo) / (hi - lo)
+
+    @staticmethod
+    def probability(row):
+        """Deterministic pneumonia probability for one preprocessed image."""
+        digest = hashlib.sha1(np.ascontiguousarray(row, dtype="float32").tobytes()).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x)
+        seconds = self.latency_ms(len(x)) / 1000.0
+        if self.mode == "busy":
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+        else:
+            time.sleep(seconds)
+        p = np.asarray([self.probability(row) for row in x], dtype="float32")
+        return np.stack([1.0 - p, p], axis=1)
+
+
+# ---------------------------
+# Recording a profile from the real model
+# ---------------------------
+def record_profile(executor, input_shape, batch_sizes, repeats, model_path=""):
+    """Time batches through an InferenceExecutor; its compute_ms is the predictor's own time."""
+    profile = dict(model_path=model_path, input_shape=list(input_shape), batches={},
+                   predictor=type(executor.model).__name__, created=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    rng = np.random.default_rng(0)
+    for n in batch_sizes:
+        x = rng.uniform(-128, 128, (n,) + tuple(input_shape)).astype("float32")
+        executor.run(x)   # warm-up (graph tracing, allocations)
+        samples = []
+        for _ in range(repeats):
+            _, timings = executor.run(x)
+            samples.append(round(timings["compute_ms"], 3))
+        profile["batches"][str(n)] = samples
+        print(f"batch {n:>3}: median {np.median(samples):8.1f} ms  p95 {np.percentile(samples, 95):8.1f} ms")
+    return profile
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Record a latency profile of the real model for the simulator.")
+    ap.add_argument("command", choices=["record"])
+    ap.add_argument("--model", default="", help="model path (default: app.py's MODEL_PATH)")
+    ap.add_argument("--out", default=SIM_PROFILE_PATH)
+    ap.add_argument("--batch-sizes", default="1,2,4,8,16")
+    ap.add_argument("--repeats", type=int, default=20)
+    args = ap.parse_args()
+
+    os.environ["XPERT_MODEL_LOAD"] = "lazy"
+    if args.model:
+        os.environ["XPERT_MODEL_PATH"] = args.model
+    import app
+    executor = app.get_executor()
+    if executor is None:
+        raise SystemExit(f"Model could not be loaded from {app.MODEL_PATH}")
+    print(f"Recording through the server's {type(executor.model).__name__}")
+    h, w = app.get_model_input_size()
+    sizes = [int(v) for v in args.batch_sizes.split(",") if v.strip()]
+    profile = record_profile(executor, (h, w, 3), sizes, args.repeats, app.MODEL_PATH)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as fh:
+        json.dump(profile, fh, indent=1)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
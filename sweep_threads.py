@@ -0,0 +1,130 @@
+# sweep_threads.py
+# Find the best TensorFlow thread settings for this machine.
+# TensorFlow's thread pools can only be sized once per process, so every
+# (intra_op, inter_op) combination runs in a fresh child process that loads the
+# model through app.py, drives the inference executor with a fixed number of
+# concurrent clients for a few seconds, and reports throughput and latency.
+#
+#   python sweep_threads.py
+#   python sweep_threads.py --intra 1,2,4,8 --inter 1,2 --concurrency 4 --seconds 10
+#   python sweep_threads.py --affinity 0-7
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(args):
+    import threading
+    import time
+
+    import numpy as np
+
+    import app
+    if app.get_model() is None:
+        raise SystemExit(f"model could not be loaded from {app.MODEL_PATH}")
+    executor = app.get_executor()
+    h, w = app.get_model_input_size()
+    x = np.random.RandomState(0).uniform(-120, 150, size=(1, h, w, 3)).astype("float32")
+    for _ in range(3):  # warm-up
+        executor.run(x)
+
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.seconds
+
+    def client():
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            executor.run(x)
+            with lock:
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stats = executor.stats()
+    print("SWEEP " + json.dumps(dict(
+        throughput=len(latencies) / elapsed,
+        p50_ms=float(np.percentile(latencies, 50)),
+        p99_ms=float(np.percentile(latencies, 99)),
+        queue_p50_ms=stats["queue_wait_ms"]["p50"],
+        compute_p50_ms=stats["compute_ms"]["p50"],
+    )))
+
+
+def run_setting(intra, inter, args):
+    env = dict(os.environ)
+    env.update(
+        XPERT_MODEL_LOAD="lazy",
+        XPERT_TF_INTRA_OP_THREADS=str(intra),
+        XPERT_TF_INTER_OP_THREADS=str(inter),
+        PYTHONPATH=HERE + os.pathsep + env.get("PYTHONPATH", ""),
+    )
+    if args.affinity:
+        env["XPERT_CPU_AFFINITY"] = args.affinity
+    if args.model:
+        env["XPERT_MODEL_PATH"] = args.model
+    cmd = [sys.executable, os.path.abspath(__file__), "--child",
+           "--seconds", str(args.seconds), "--concurrency", str(args.concurrency)]
+    out = subprocess.run(cmd, cwd=args.cwd, env=env, capture_output=True, text=True)
+    for line in out.stdout.splitlines():
+        if line.startswith("SWEEP "):
+            return json.loads(line[len("SWEEP "):])
+    print(f"  intra={intra} inter={inter} failed:\n{out.stderr[-1500:]}")
+    return None
+
+
+def default_intra():
+    n = os.cpu_count() or 1
+    values, v = [], 1
+    while v < n:
+        values.append(v)
+        v *= 2
+    return values + [n]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sweep TensorFlow intra/inter-op thread counts.")
+    ap.add_argument("--intra", default=",".join(str(v) for v in default_intra()))
+    ap.add_argument("--inter", default="1,2")
+    ap.add_argument("--concurrency", type=int, default=4, help="concurrent clients driving the executor")
+    ap.add_argument("--seconds", type=float, default=5.0, help="measurement time per setting")
+    ap.add_argument("--affinity", default="", help="CPU list to pin to, e.g. 0-7")
+    ap.add_argument("--model", default="", help="model path (default: app.py's MODEL_PATH)")
+    ap.add_argument("--cwd", default=HERE, help="directory containing model/ (default: repo root)")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    results = []
+    print(f"{'intra':>6} {'inter':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'queue':>8} {'compute':>8}")
+    for intra in [int(v) for v in args.intra.split(",")]:
+        for inter in [int(v) for v in args.inter.split(",")]:
+            r = run_setting(intra, inter, args)
+            if r is None:
+                continue
+            results.append((intra, inter, r))
+            print(f"{intra:>6} {inter:>6} {r['throughput']:>8.2f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                  f"{r['queue_p50_ms']:>8.1f} {r['compute_p50_ms']:>8.1f}")
+
+    if not results:
+        raise SystemExit("no setting completed")
+    intra, inter, best = max(results, key=lambda r: r[2]["throughput"])
+    print(f"\nBest: {best['throughput']:.2f} req/s at p99 {best['p99_ms']:.1f} ms")
+    print(f"export XPERT_TF_INTRA_OP_THREADS={intra}")
+    print(f"export XPERT_TF_INTER_OP_THREADS={inter}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# Shared fixtures. The app is imported with the model left unloaded (mock mode
+# and the fake LLM need neither TensorFlow nor an API key), and each test runs
+# in its own working directory so saved uploads and indexes stay out of the repo.
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("XPERT_MODEL_LOAD", "lazy")
+os.environ.setdefault("XPERT_FAKE_LLM", "1")
+os.environ.setdefault("XPERT_DEDUP", "0")
+os.environ.setdefault("XPERT_FAKE_LLM_LATENCY_MS", "5")
+os.environ.setdefault("XPERT_SIM_PROFILE", "")
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def sample_xray():
+    """A real chest X-ray from the repo (870 KB JPEG, 2090x1858)."""
+    with open(os.path.join(ROOT, "uploads", "nyes.jpeg"), "rb") as fh:
+        return fh.read()
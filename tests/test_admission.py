@@ -0,0 +1,84 @@
+import threading
+import time
+
+import admission
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = admission.TokenBucket(rate=2, burst=2)
+    now = bucket.updated
+    assert bucket.take(now) == 0 and bucket.take(now) == 0
+    assert bucket.take(now) == 0.5
+    assert bucket.take(now + 0.5) == 0
+
+
+def test_client_over_burst_gets_429(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "RATE_LIMITER", admission.RateLimiter(client_rate=0.01, client_burst=2))
+    headers = {"X-Client-Id": "ward-7"}
+    codes = [client.post("/analyze?mock=1", headers=headers).status_code for _ in range(3)]
+    assert codes[:2] == [400, 400] and codes[2] == 429   # no file: 400 until the bucket is empty
+    resp = client.post("/analyze?mock=1", headers=headers)
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
+    # other clients have their own bucket
+    assert client.post("/analyze?mock=1", headers={"X-Client-Id": "ward-8"}).status_code != 429
+
+
+def test_rejected_client_never_resolves_role(app_module, monkeypatch):
+    limiter = admission.RateLimiter(client_rate=0.01, client_burst=1, role_limits={"doctor": (0.01, 1)})
+    monkeypatch.setattr(app_module, "RATE_LIMITER", limiter)
+    roles = []
+
+    def role_fn():
+        roles.append(1)   # stands in for parsing the body
+        return "doctor"
+
+    view = app_module.admit(app_module.ANALYZE_GATE, role_fn)(lambda: "ok")
+    with app_module.app.test_request_context(headers={"X-Client-Id": "a"}):
+        assert view().status_code == 200
+        assert view().status_code == 429
+    assert len(roles) == 1
+    # the role bucket still applies once the client bucket passes
+    with app_module.app.test_request_context(headers={"X-Client-Id": "b"}):
+        resp = view()
+    assert resp.status_code == 429 and "role" in resp.get_json()["error"]
+    assert limiter.stats()["limited_by_client"] == 1 and limiter.stats()["limited_by_role"] == 1
+
+
+def waiter(gate, cls, order):
+    def run():
+        ok = gate.acquire(cls)
+        order.append((cls, ok))
+        if ok:
+            gate.release()
+    t = threading.Thread(target=run)
+    t.start()
+    time.sleep(0.05)   # queue in a known order
+    return t
+
+
+def test_waiters_are_admitted_by_role_weight():
+    gate = admission.AdmissionController("analyze", 1, 8, 5, weights={"doctor": 4, "student": 1})
+    assert gate.acquire("student")
+    order = []
+    threads = [waiter(gate, "student", order), waiter(gate, "student", order), waiter(gate, "doctor", order)]
+    gate.release()
+    for t in threads:
+        t.join(5)
+    assert order[0] == ("doctor", True)
+    assert gate.stats()["classes"]["doctor"]["served"] == 1
+
+
+def test_full_queue_sheds_a_student_for_a_doctor():
+    gate = admission.AdmissionController("analyze", 1, 2, 5, weights={"doctor": 4, "student": 1})
+    assert gate.acquire("student")
+    order = []
+    threads = [waiter(gate, "student", order), waiter(gate, "student", order)]
+    assert not gate.acquire("student")   # full, and a student cannot overtake a student
+    threads.append(waiter(gate, "doctor", order))
+    assert order == [("student", False)]   # the last student in line made room
+    gate.release()
+    for t in threads:
+        t.join(5)
+    assert order[1:] == [("doctor", True), ("student", True)]
+    stats = gate.stats()
+    assert stats["shed"] == 1 and stats["rejected"] == 1
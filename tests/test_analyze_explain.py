@@ -0,0 +1,37 @@
+import io
+import time
+
+
+def events(resp):
+    body = resp.get_data(as_text=True)
+    resp.close()   # releases the analyze gate, like a client finishing the stream
+    return [block.split("\n", 1)[0].removeprefix("event: ") for block in body.split("\n\n") if block]
+
+
+def test_single_stream_by_default(client, app_module, sample_xray):
+    assert app_module.EXPLAIN_SPECULATIVE is False
+    resp = client.post("/v1/analyze_explain?mock=1", data={"file": (io.BytesIO(sample_xray), "x.jpeg")})
+    names = events(resp)
+    assert names[0] == "prediction" and names[-1] == "done" and "delta" in names
+
+
+def test_cancelled_speculative_stream_frees_its_llm_slot(client, app_module, monkeypatch, sample_xray):
+    monkeypatch.setattr(app_module, "EXPLAIN_SPECULATIVE", True)
+    resp = client.post("/v1/analyze_explain?mock=1", data={"file": (io.BytesIO(sample_xray), "x.jpeg")})
+    assert events(resp)[-1] == "done"
+    deadline = time.monotonic() + 5
+    while app_module.LLM_GATE.stats()["inflight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert app_module.LLM_GATE.stats()["inflight"] == 0
+
+
+def test_analyze_slot_is_released_once_the_prediction_is_sent(client, app_module, sample_xray):
+    resp = client.post("/v1/analyze_explain?mock=1", data={"file": (io.BytesIO(sample_xray), "x.jpeg")},
+                       buffered=False)
+    chunks = iter(resp.response)
+    first = next(chunks)
+    assert (first.decode() if isinstance(first, bytes) else first).startswith("event: prediction")
+    # the explanation is still streaming, but the slot is back for the next upload
+    assert app_module.ANALYZE_GATE.stats()["inflight"] == 0
+    list(chunks)
+    resp.close()
@@ -0,0 +1,43 @@
+import io
+import json
+
+from PIL import Image
+
+
+def png_bytes():
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), (90, 90, 90)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def read_events(resp):
+    events = []
+    for block in resp.get_data(as_text=True).split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_reports_stages_then_the_result(client):
+    resp = client.post("/analyze/stream?mock=1&role=student",
+                       data={"file": (io.BytesIO(png_bytes()), "scan.png")})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    events = read_events(resp)
+    resp.close()
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == "result" and "error" not in kinds
+    stages = [data["stage"] for kind, data in events if kind == "stage"]
+    assert stages[0] == "received" and stages[-1] == "predicted"
+    times = [data["t_ms"] for kind, data in events if kind == "stage"]
+    assert times == sorted(times)
+    result = events[-1][1]
+    assert result["role"] == "student"
+    assert result["prediction"] in ("Pneumonia", "Normal")
+    assert "total_ms" in result
+
+
+def test_stream_without_a_file_is_rejected(client):
+    resp = client.post("/analyze/stream?mock=1", data={})
+    assert resp.status_code == 400
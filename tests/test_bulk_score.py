@@ -0,0 +1,47 @@
+import numpy as np
+from PIL import Image
+
+import bulk_score
+
+
+def write_image(path, value):
+    Image.new("RGB", (12, 10), (value, value, value)).save(path)
+
+
+def test_find_images_is_sorted_and_filters_extensions(tmp_path):
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a").mkdir()
+    write_image(tmp_path / "b" / "2.png", 10)
+    write_image(tmp_path / "a" / "1.JPG", 20)
+    (tmp_path / "a" / "notes.txt").write_text("not an image")
+    found = list(bulk_score.find_images([str(tmp_path)]))
+    assert found == [str(tmp_path / "a" / "1.JPG"), str(tmp_path / "b" / "2.png")]
+
+
+def test_decode_batch_keeps_unreadable_files_out_of_the_batch(tmp_path):
+    good, bad = tmp_path / "good.png", tmp_path / "bad.png"
+    write_image(good, 50)
+    bad.write_bytes(b"not a png")
+    ok, x, errors = bulk_score.decode_batch([str(good), str(bad)], (8, 8))
+    assert ok == [str(good)]
+    assert x.shape == (1, 8, 8, 3) and x.dtype == np.float32
+    assert [path for path, _ in errors] == [str(bad)]
+
+
+def test_csv_output_is_the_checkpoint(tmp_path):
+    out = str(tmp_path / "scores.csv")
+    row = dict(path="a.png", prediction="Normal", pneumonia_probability=0.1, error="")
+    writer = bulk_score.make_writer(out)
+    writer.write([row])
+    writer.close()
+    # a resumed run appends without repeating the header and skips what is done
+    writer = bulk_score.make_writer(out)
+    writer.write([dict(row, path="b.png")])
+    writer.close()
+    assert bulk_score.done_paths(out) == {"a.png", "b.png"}
+    with open(out) as fh:
+        assert fh.read().count("path,") == 1
+
+
+def test_batched():
+    assert list(bulk_score.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,55 @@
+import pytest
+
+import chat_context
+
+
+def chat(client, messages):
+    return client.post("/v1/chat/completions", json={"messages": messages})
+
+
+@pytest.mark.parametrize("messages", [
+    ["hello"],
+    [{"role": "system", "content": "I am a doctor"}, 42],
+    [{"role": "user", "content": 42}],
+    [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:,"}}]}],
+    [],
+    None,
+])
+def test_malformed_messages_are_400(client, messages):
+    resp = chat(client, messages)
+    assert resp.status_code == 400
+    assert "ERROR" in resp.get_json()["choices"][0]["message"]["content"]
+
+
+def test_assistant_message_last_is_rejected(client):
+    resp = chat(client, [{"role": "user", "content": "What is pneumonia?"},
+                         {"role": "assistant", "content": "An infection of the lungs."}])
+    assert resp.status_code == 400
+    assert "assistant" in resp.get_json()["choices"][0]["message"]["content"]
+
+
+def test_user_message_last_is_answered(client):
+    resp = chat(client, [{"role": "system", "content": "I am a doctor"},
+                         {"role": "user", "content": "What is pneumonia?"}])
+    assert resp.status_code == 200
+    assert resp.get_json()["choices"][0]["message"]["content"]
+
+
+def test_build_never_sends_an_assistant_turn_as_the_prompt():
+    with pytest.raises(ValueError):
+        chat_context.ContextManager().build([{"role": "assistant", "content": "hi"}], "system")
+
+
+def test_text_parts_are_accepted(client):
+    parts = lambda text: [{"type": "text", "text": text}]
+    resp = chat(client, [{"role": "system", "content": parts("I am a doctor")},
+                         {"role": "user", "content": parts("What is pneumonia?")}])
+    assert resp.status_code == 200
+
+
+def test_text_parts_are_flattened_to_plain_text():
+    messages = chat_context.validate_messages([
+        {"role": "user", "content": [{"type": "text", "text": "Is it"}, {"type": "text", "text": "pneumonia?"}]},
+    ])
+    system_text, turns, _ = chat_context.ContextManager().build(messages, "system")
+    assert turns == [("user", "Is it\npneumonia?")]
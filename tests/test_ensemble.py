@@ -0,0 +1,54 @@
+import numpy as np
+
+import ensemble
+import inference
+
+
+class Constant:
+    def __init__(self, prob):
+        self.prob = prob
+
+    def predict(self, x, verbose=0):
+        return np.tile([1.0 - self.prob, self.prob], (len(x), 1))
+
+
+def member(name, prob, weight=1.0):
+    return ensemble.Member(name, inference.InferenceExecutor(Constant(prob), name=name), weight, (4, 4))
+
+
+def test_weighted_average_and_served_decision():
+    members = [member("a", 0.3), member("b", 0.6, weight=2.0)]
+    ens = ensemble.Ensemble(members, early_exit=0, decide=lambda p: p > 0.55)
+    prob, info = ens.predict(lambda size: np.zeros((1,) + size + (3,), dtype="float32"))
+    assert abs(prob - 0.5) < 1e-6
+    # at the served threshold of 0.55 the ensemble says Normal: "a" agrees, "b" does not
+    stats = ens.stats()["members"]
+    assert stats["a"]["agreement_rate"] == 1.0 and stats["b"]["agreement_rate"] == 0.0
+    assert set(info["members"]) == {"a", "b"}
+    for m in members:
+        m.executor.close()
+
+
+def test_average_uses_unrounded_member_probabilities():
+    members = [member("a", 0.12344), member("b", 0.12344)]
+    ens = ensemble.Ensemble(members, early_exit=0)
+    prob, info = ens.predict(lambda size: np.zeros((1,) + size + (3,), dtype="float32"))
+    assert abs(prob - 0.12344) < 1e-9
+    assert info["members"]["a"]["prob"] == 0.1234   # rounded for output only
+    for m in members:
+        m.executor.close()
+
+
+def test_early_exit_follows_the_served_decision():
+    members = [member("cheap", 0.9), member("full", 0.9)]
+    # calibration squashes 0.9 to 0.6: not confident enough to skip the other member
+    ens = ensemble.Ensemble(members, early_exit=0.8, calibrate=lambda p: 0.6)
+    prepare = lambda size: np.zeros((1,) + size + (3,), dtype="float32")
+    for _ in range(3):
+        prob, info = ens.predict(prepare)
+        assert not info["early_exit"]
+    ens.calibrate = lambda p: 0.95
+    prob, info = ens.predict(prepare)
+    assert info["early_exit"] and len(info["members"]) == 1
+    for m in members:
+        m.executor.close()
@@ -0,0 +1,50 @@
+import numpy as np
+
+import evaluate
+
+
+def test_average_precision_groups_tied_scores():
+    # thresholds 0.9 (P=1, R=.5) and 0.5 (P=2/3, R=1), whatever the order of the tie
+    probs = np.array([0.9, 0.5, 0.5])
+    assert np.isclose(evaluate.average_precision(probs, np.array([1, 0, 1])), 0.5 + 0.5 * 2 / 3)
+    assert np.isclose(evaluate.average_precision(probs, np.array([1, 1, 0])), 0.5 + 0.5 * 2 / 3)
+
+
+def test_average_precision_without_ties_is_mean_precision_at_positives():
+    probs = np.array([0.9, 0.8, 0.7, 0.6])
+    labels = np.array([1, 0, 1, 0])
+    assert np.isclose(evaluate.average_precision(probs, labels), (1 + 2 / 3) / 2)
+
+
+def test_cache_lives_outside_the_dataset(tmp_path):
+    path = evaluate.default_cache_path(str(tmp_path / "data"))
+    assert path.startswith("cache") and str(tmp_path) not in path
+
+
+def test_cache_without_extension_is_reused(tmp_path, monkeypatch):
+    image = tmp_path / "a.png"
+    image.write_bytes(b"x")
+    calls = []
+
+    def score_batches(paths, **kwargs):
+        calls.append(list(paths))
+        yield [(p, 0.25, None) for p in paths]
+
+    monkeypatch.setattr(evaluate.bulk_score, "score_batches", score_batches)
+    cache = str(tmp_path / "probs")   # np.savez writes probs.npz
+    for _ in range(2):
+        probs = evaluate.score_with_cache([str(image)], cache, "model.h5", 8, 1)
+        assert probs.tolist() == [0.25]
+    assert len(calls) == 1 and (tmp_path / "probs.npz").exists()
+
+
+def test_calibration_for_another_model_is_ignored(app_module, tmp_path, monkeypatch):
+    cfg = tmp_path / "calibration.json"
+    cfg.write_text('{"threshold": 0.3, "temperature": 2.0, "model_path": "model/other.h5"}')
+    monkeypatch.setattr(app_module, "DECISION_THRESHOLD", 0.5)
+    monkeypatch.setattr(app_module, "TEMPERATURE", 1.0)
+    monkeypatch.setattr(app_module, "CALIBRATION_MODEL", None)
+    app_module.load_calibration(str(cfg), model_path="model/vgg_tuned.h5")
+    assert (app_module.DECISION_THRESHOLD, app_module.TEMPERATURE) == (0.5, 1.0)
+    app_module.load_calibration(str(cfg), model_path="model/other.h5")
+    assert (app_module.DECISION_THRESHOLD, app_module.TEMPERATURE) == (0.3, 2.0)
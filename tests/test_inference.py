@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+import pytest
+
+import inference
+
+
+class Recorder:
+    """Stands in for a model: returns each row's first value and records batch
+    sizes. The first call blocks until released, so later jobs pile up."""
+
+    def __init__(self):
+        self.batches = []
+        self.busy = threading.Event()
+        self.release = threading.Event()
+
+    def predict(self, x, verbose=0):
+        if not self.batches:
+            self.busy.set()
+            self.release.wait(5)
+        self.batches.append(len(x))
+        return x[:, :1] * 1.0
+
+
+def test_executor_coalesces_queued_jobs_into_batches():
+    model = Recorder()
+    executor = inference.InferenceExecutor(model, workers=1, max_batch=4, batch_wait_ms=0)
+    futures = [executor.submit(np.full((1, 3), 0, dtype="float32"))]
+    assert model.busy.wait(5)
+    futures += [executor.submit(np.full((1, 3), i, dtype="float32")) for i in range(1, 9)]
+    model.release.set()
+    results = [f.result(timeout=5) for f in futures]
+    # the first job runs alone; the 8 that queued behind it run as two full batches
+    assert model.batches == [1, 4, 4]
+    assert [float(preds[0, 0]) for preds, _ in results] == list(range(9))
+    assert [timings["batch_size"] for _, timings in results] == [1] + [4] * 8
+    stats = executor.stats()
+    assert stats["jobs"] == 9 and stats["batches"] == 3
+
+
+def test_executor_reports_errors_to_every_job_in_the_batch():
+    class Broken:
+        def predict(self, x, verbose=0):
+            raise RuntimeError("boom")
+
+    executor = inference.InferenceExecutor(Broken(), workers=1)
+    future = executor.submit(np.zeros((1, 3), dtype="float32"))
+    try:
+        future.result(timeout=5)
+    except RuntimeError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("expected the model's error")
+    assert executor.stats()["errors"] == 1
+
+
+def test_parse_cpu_list():
+    assert inference.parse_cpu_list("0-3, 8,10-11,") == {0, 1, 2, 3, 8, 10, 11}
+
+
+def test_bucket_for():
+    assert [inference.bucket_for(n, (1, 2, 4, 8)) for n in (1, 2, 3, 5, 8, 20)] == [1, 2, 4, 8, 8, 8]
+
+
+def test_compiled_predictor_matches_the_model():
+    keras = pytest.importorskip("keras")
+    model = keras.Sequential([keras.Input((3,)), keras.layers.Dense(2, activation="softmax")])
+    predictor = inference.CompiledPredictor(model, buckets=(1, 2, 4))
+    # 3 rows are padded to the 4-row bucket, 9 rows are split into 4 + 4 + 1
+    for n in (3, 9):
+        x = np.random.default_rng(n).normal(size=(n, 3)).astype("float32")
+        np.testing.assert_allclose(predictor.predict(x), model.predict(x, verbose=0), rtol=1e-5, atol=1e-6)
+
+
+def test_bucket_chunks_pad_and_split():
+    x = np.arange(11, dtype="float32").reshape(11, 1)
+    chunks = list(inference.bucket_chunks(x, (1, 2, 4)))
+    assert [(len(c), n) for c, n in chunks] == [(4, 4), (4, 4), (4, 3)]
+    assert chunks[-1][0][3, 0] == 0.0   # zero padding after the real rows
+    assert [len(c) for c, _ in inference.bucket_chunks(x[:3], (1, 2, 4))] == [4]
+
+
+def test_tuned_concurrency_is_clamped(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.ANALYZE_GATE, "max_inflight", 2)
+    monkeypatch.setattr(app_module, "ANALYZE_MAX_TUNED_INFLIGHT", 6)
+    assert app_module.apply_tuned_concurrency(32) == 6
+    assert app_module.apply_tuned_concurrency(4) == 4
+
+
+def test_configure_changes_the_batch_size_while_serving():
+    model = Recorder()
+    model.release.set()
+    executor = inference.InferenceExecutor(model, workers=1, max_batch=1)
+    executor.configure(max_batch=8, batch_wait_ms=5)
+    assert (executor.max_batch, executor.batch_wait) == (8, 0.005)
+    executor.close()
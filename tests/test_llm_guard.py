@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+import llm_guard
+
+
+def test_slow_attempt_is_hedged_and_the_hedge_wins():
+    guard = llm_guard.GuardedLLM(deadline=2, hedge=True, hedge_min=0.05)
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+
+    assert guard.call(fn) == "fast"
+    assert guard.stats()["hedge_wins"] == 1
+
+
+def test_outstanding_attempts_are_bounded():
+    guard = llm_guard.GuardedLLM(deadline=0.1, hedge=True, hedge_min=0.01, max_outstanding=2)
+    release = threading.Event()
+
+    def stuck(timeout):
+        release.wait(5)
+        return "late"
+
+    # the first call times out; its attempt and its hedge keep both slots busy
+    with pytest.raises(llm_guard.LLMUnavailable) as first:
+        guard.call(stuck)
+    assert first.value.reason == "timeout"
+    with pytest.raises(llm_guard.LLMUnavailable) as second:
+        guard.call(stuck)
+    assert second.value.reason == "overloaded"
+    assert guard.stats()["outstanding_attempts"] == 2
+    release.set()
+    deadline = time.monotonic() + 5
+    while guard.stats()["outstanding_attempts"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert guard.call(lambda timeout: "ok") == "ok"
+
+
+def test_breaker_opens_after_repeated_failures():
+    guard = llm_guard.GuardedLLM(deadline=1, hedge=False, breaker=llm_guard.CircuitBreaker("t", failure_threshold=2, reset_timeout=60))
+
+    def broken(timeout):
+        raise RuntimeError("upstream 500")
+
+    for _ in range(2):
+        with pytest.raises(llm_guard.LLMUnavailable):
+            guard.call(broken)
+    with pytest.raises(llm_guard.LLMUnavailable) as exc:
+        guard.call(lambda timeout: "ok")
+    assert exc.value.reason == "circuit_open"
+
+
+def test_stream_is_cut_off_at_the_deadline(app_module, monkeypatch):
+    class SlowStream:
+        def generate_content_stream(self, **kwargs):
+            for i in range(100):
+                time.sleep(0.02)
+                yield type("Chunk", (), {"text": f"{i} "})()
+
+    monkeypatch.setattr(app_module, "get_llm_client", lambda: type("Client", (), {"models": SlowStream()})())
+    monkeypatch.setattr(app_module, "_llm_request", lambda *a, **k: {})
+    chunks = []
+    with pytest.raises(llm_guard.LLMUnavailable) as exc:
+        for chunk in app_module._llm_stream("system", [("user", "hi")], budget=0.2):
+            chunks.append(chunk)
+    assert exc.value.reason == "timeout"
+    assert 0 < len(chunks) < 100
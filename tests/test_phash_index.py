@@ -0,0 +1,42 @@
+import numpy as np
+from PIL import Image
+
+import phash_index
+import preprocess
+
+
+def xray_array(path, size=(224, 224)):
+    return preprocess.load_image_array(path, size)
+
+
+def test_exact_match_only_by_default(tmp_path, sample_xray):
+    src = tmp_path / "a.jpeg"
+    src.write_bytes(sample_xray)
+    hashes = phash_index.array_hashes(xray_array(str(src)))
+    index = phash_index.PHashIndex(path=str(tmp_path / "index.jsonl"), model_path="m.h5")
+    assert index.max_distance == 0
+    index.add(*hashes, raw_prob=0.9, source=phash_index.content_id(str(src)))
+
+    hit = index.lookup(*hashes)
+    assert hit["distance"] == 0 and hit["raw_prob"] == 0.9
+    assert hit["source"] == phash_index.content_id(str(src))
+    assert "a.jpeg" not in (tmp_path / "index.jsonl").read_text()
+
+    # a different image is not a hit
+    other = np.asarray(Image.open(src).convert("RGB").transpose(Image.FLIP_LEFT_RIGHT).resize((224, 224)))
+    assert index.lookup(*phash_index.array_hashes(other)) is None
+
+
+def test_hashes_survive_vgg_preprocessing(tmp_path, sample_xray):
+    src = tmp_path / "a.jpeg"
+    src.write_bytes(sample_xray)
+    rgb = xray_array(str(src))
+    x = preprocess.vgg_preprocess(np.expand_dims(rgb, 0))
+    assert phash_index.array_hashes(preprocess.vgg_unpreprocess(x[0])) == phash_index.array_hashes(rgb)
+
+
+def test_index_restarts_on_other_model(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    phash_index.PHashIndex(path=path, model_path="a.h5").add(1, 1, raw_prob=0.2, source="x")
+    assert len(phash_index.PHashIndex(path=path, model_path="a.h5")) == 1
+    assert len(phash_index.PHashIndex(path=path, model_path="b.h5")) == 0
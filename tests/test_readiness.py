@@ -0,0 +1,48 @@
+import time
+
+import readiness
+
+
+def test_lazy_pod_is_ready_before_the_model_loads(client, app_module):
+    assert app_module.MODEL_LOAD == "lazy" and app_module.MODEL_STATE == "not_loaded"
+    resp = client.get("/health/ready")
+    assert resp.status_code == 200
+    assert "lazy" in resp.get_json()["note"]
+
+
+def test_failing_check_makes_the_pod_unready_after_repeated_misses():
+    probe = readiness.ReadinessProbe(interval=60, stale_after=60, failures=2)
+    outcomes = iter([None, RuntimeError("wedged"), RuntimeError("wedged")])
+
+    def check():
+        error = next(outcomes)
+        if error:
+            raise error
+
+    probe.add("inference", check)
+    probe.run_once()
+    assert probe.ready() == (True, None)
+    probe.run_once()
+    assert probe.ready()[0]   # one miss is tolerated
+    probe.run_once()
+    assert probe.ready() == (False, "inference: wedged")
+
+
+def test_slow_check_counts_as_a_miss():
+    probe = readiness.ReadinessProbe(interval=60, stale_after=60, failures=1)
+    probe.add("inference", lambda: time.sleep(0.02), max_latency_ms=1)
+    probe.run_once()
+    ready, reason = probe.ready()
+    assert not ready and "threshold" in reason
+
+
+def test_queue_wait_is_not_held_against_the_threshold():
+    probe = readiness.ReadinessProbe(interval=60, stale_after=60, failures=1)
+
+    def queued_check():
+        time.sleep(0.02)   # waited behind other work
+        return dict(queue_ms=20.0, compute_ms=0.5)
+
+    probe.add("inference", queued_check, max_latency_ms=5)
+    probe.run_once()
+    assert probe.ready() == (True, None)
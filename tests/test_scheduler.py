@@ -0,0 +1,73 @@
+import queue
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+
+def test_parse_weights():
+    assert scheduler.parse_weights("Doctor=4, student=1,bad") == {"doctor": 4.0, "student": 1.0}
+
+
+def test_classes_are_served_in_proportion_to_their_weights():
+    q = scheduler.WeightedFairQueue({"doctor": 4, "student": 1})
+    for i in range(20):
+        q.put(("student", i), "student")
+    for i in range(8):
+        q.put(("doctor", i), "doctor")
+    first = [q.get_nowait()[0] for _ in range(10)]
+    # doctors queued behind a student backlog still get 4 of every 5 turns
+    assert first.count("doctor") == 8 and first.count("student") == 2
+
+
+def test_fifo_within_a_class_and_no_starvation():
+    q = scheduler.WeightedFairQueue({"doctor": 4, "student": 1})
+    for i in range(3):
+        q.put(i, "student")
+    for i in range(40):
+        q.put(100 + i, "doctor")
+    served = [q.get_nowait() for _ in range(15)]
+    students = [x for x in served if x < 100]
+    assert students == [0, 1, 2]
+    assert [x for x in served if x >= 100] == sorted(x for x in served if x >= 100)
+
+
+def test_stop_signal_comes_after_queued_items_and_empty_raises():
+    q = scheduler.WeightedFairQueue()
+    q.put("job")
+    q.put(None)
+    assert q.get_nowait() == "job"
+    assert q.get_nowait() is None
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+
+def test_gate_admits_waiters_by_weight():
+    gate = scheduler.PriorityGate(1, {"doctor": 4, "student": 1})
+    assert gate.acquire("student")
+    order = []
+
+    def waiter(cls):
+        assert gate.acquire(cls, timeout=5)
+        order.append(cls)
+        gate.release()
+
+    threads = [threading.Thread(target=waiter, args=("student",))]
+    threads[0].start()
+    time.sleep(0.05)   # the student waits first
+    threads.append(threading.Thread(target=waiter, args=("doctor",)))
+    threads[1].start()
+    time.sleep(0.05)
+    gate.release()
+    for t in threads:
+        t.join(5)
+    assert order == ["doctor", "student"]
+
+
+def test_gate_times_out():
+    gate = scheduler.PriorityGate(1)
+    assert gate.acquire()
+    assert gate.acquire(timeout=0.01) is False
+    assert gate.stats()["inflight"] == 1
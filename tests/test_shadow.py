@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+
+import shadow
+
+
+class Constant:
+    """Stands in for a model: every row gets the same pneumonia probability."""
+
+    def __init__(self, prob):
+        self.prob = prob
+
+    def predict(self, x, verbose=0):
+        return np.tile([1.0 - self.prob, self.prob], (len(x), 1))
+
+
+def wait_for(runner, completed):
+    deadline = time.monotonic() + 5
+    while runner.stats()["completed"] < completed and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_agreement_uses_the_served_decision():
+    # primary 0.35, candidate 0.45: both Normal at 0.5, but they disagree at a served threshold of 0.4
+    runner = shadow.ShadowRunner(Constant(0.45), fraction=1.0, decide=lambda p: p > 0.4)
+    assert runner.maybe_submit(lambda size: np.zeros((1, 4)), 0.35, 10.0)
+    wait_for(runner, 1)
+    stats = runner.stats()
+    assert stats["completed"] == 1 and stats["agreement_rate"] == 0.0
+    assert stats["executor"]["classes"][shadow.SHADOW_CLASS]["served"] == 1
+
+
+def test_pending_runs_are_bounded():
+    runner = shadow.ShadowRunner(Constant(0.5), fraction=1.0, queue_size=2)
+    runner._pending = 2   # as if two runs were still in flight
+    assert not runner.maybe_submit(lambda size: np.zeros((1, 4)), 0.5, 10.0)
+    assert runner.stats()["dropped"] == 1
+
+
+class Busy:
+    def __init__(self):
+        self.busy = True
+
+    def idle(self):
+        return not self.busy
+
+
+def test_runs_wait_for_an_idle_primary_and_use_their_own_input_size():
+    primary = Busy()
+    runner = shadow.ShadowRunner(Constant(0.5), fraction=1.0, input_size=(8, 6), primary=primary, idle_wait_ms=20)
+    sizes = []
+
+    def prepare(size):
+        sizes.append(size)
+        return np.zeros((1,) + size + (3,))
+
+    assert runner.maybe_submit(prepare, 0.5, 10.0)
+    deadline = time.monotonic() + 5
+    while runner.stats()["skipped_busy"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runner.stats()["skipped_busy"] == 1 and sizes == []
+    primary.busy = False
+    assert runner.maybe_submit(prepare, 0.5, 10.0)
+    wait_for(runner, 1)
+    assert runner.stats()["completed"] == 1 and sizes == [(8, 6)]
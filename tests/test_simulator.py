@@ -0,0 +1,27 @@
+import types
+
+import numpy as np
+
+import simulator
+
+
+def test_mock_executor_batches_like_the_real_one(app_module, monkeypatch):
+    real = types.SimpleNamespace(workers=2, max_batch=8, batch_wait=0.005)
+    monkeypatch.setattr(app_module, "EXECUTOR", real)
+    monkeypatch.setattr(app_module, "MOCK_EXECUTOR", None)
+    mock = app_module.get_mock_executor()
+    assert (mock.workers, mock.max_batch, mock.batch_wait) == (2, 8, 0.005)
+    mock.close()
+
+
+def test_record_profile_times_the_executor():
+    class Executor:
+        model = simulator.SimulatedModel(profile=simulator.DEFAULT_PROFILE)
+
+        def run(self, x):
+            return None, dict(compute_ms=12.5)
+
+    profile = simulator.record_profile(Executor(), (4, 4, 3), [1, 2], repeats=3)
+    assert profile["predictor"] == "SimulatedModel"
+    assert profile["batches"] == {"1": [12.5] * 3, "2": [12.5] * 3}
+    assert np.isfinite(simulator.SimulatedModel(profile=profile).latency_ms(1))
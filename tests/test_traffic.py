@@ -0,0 +1,45 @@
+import io
+
+import replay
+import traffic
+
+
+def recording_app(tmp_path, queue_bytes):
+    from flask import Flask, request
+    app = Flask(__name__)
+    recorder = traffic.TrafficRecorder(directory=str(tmp_path), paths=("/analyze",), fraction=1.0,
+                                       queue_size=100, queue_bytes=queue_bytes)
+    recorder._queue.put_nowait = lambda item: None   # keep the writer idle: nothing is consumed
+    recorder.install(app, lambda: "client")
+
+    @app.route("/analyze", methods=["POST"])
+    def analyze():
+        return ("busy", 429) if "busy" in request.args else "ok"
+
+    return app, recorder
+
+
+def upload(client, size, query=""):
+    return client.post("/analyze" + query, data={"file": (io.BytesIO(b"\0" * size), "scan.png")})
+
+
+def test_capture_queue_is_bounded_by_bytes(tmp_path):
+    app, recorder = recording_app(tmp_path, queue_bytes=1000)
+    client = app.test_client()
+    upload(client, 600)
+    upload(client, 600)   # would hold 1200 bytes: dropped before the upload is read
+    upload(client, 300)
+    stats = recorder.stats()
+    assert stats["dropped"] == 1 and stats["pending_bytes"] == 900
+
+
+def test_rejected_requests_are_not_captured(tmp_path):
+    app, recorder = recording_app(tmp_path, queue_bytes=1000)
+    assert upload(app.test_client(), 600, "?busy=1").status_code == 429
+    stats = recorder.stats()
+    assert stats["dropped"] == 0 and stats["pending_bytes"] == 0
+
+
+def test_replay_forces_dedup_off():
+    assert replay.replay_query("") == "dedup=0"
+    assert replay.replay_query("mock=1&dedup=1") == "mock=1&dedup=0"
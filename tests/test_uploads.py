@@ -0,0 +1,59 @@
+import io
+
+import pytest
+from PIL import Image
+
+import uploads
+
+
+def post_image(client, data, name="xray.jpeg"):
+    return client.post("/analyze?mock=1", data={"file": (io.BytesIO(data), name)})
+
+
+def png(width, height):
+    out = io.BytesIO()
+    Image.new("L", (width, height)).save(out, "PNG")
+    return out.getvalue()
+
+
+def test_realistic_xray_is_accepted(client, sample_xray):
+    assert len(sample_xray) > 500_000   # larger than Werkzeug's in-memory form limit
+    resp = post_image(client, sample_xray)
+    assert resp.status_code == 200, resp.get_json()
+    assert resp.get_json()["prediction"] in ("Pneumonia", "Normal")
+
+
+def test_body_over_limit_is_413(client, app_module, monkeypatch, sample_xray):
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 100_000)
+    resp = post_image(client, sample_xray)
+    assert resp.status_code == 413
+    assert "error" in resp.get_json()
+
+
+@pytest.mark.parametrize("size", [(3000, 2000), (12000, 12000)])
+def test_pixel_budget_refuses_before_decoding(client, monkeypatch, size):
+    # (3000, 2000) is refused by our check, (12000, 12000) by Pillow's bomb guard
+    monkeypatch.setattr(uploads, "MAX_IMAGE_PIXELS", 4_000_000)
+    resp = post_image(client, png(*size), "bomb.png")
+    assert resp.status_code == 413
+    assert "pixels" in resp.get_json()["error"]
+
+
+def test_non_image_is_400(client):
+    resp = post_image(client, b"not an image" * 1000, "x.jpeg")
+    assert resp.status_code == 400
+
+
+def test_upload_spool_threshold_is_configurable(app_module):
+    stream = app_module.app.request_class._get_file_stream(None, 0, "image/jpeg")
+    assert stream._max_size == uploads.UPLOAD_SPOOL_BYTES
+    stream.write(b"x" * (uploads.UPLOAD_SPOOL_BYTES + 1))
+    assert stream._rolled   # moved to a temporary file past the threshold
+
+
+def test_uploads_get_unique_names_inside_uploads(client, tmp_path):
+    for name in ("../../escape.png", "same.png", "same.png"):
+        assert post_image(client, png(32, 32), name).status_code == 200
+    saved = sorted(p.name for p in (tmp_path / "uploads").iterdir())
+    assert len(saved) == 3 and all(n.endswith(".png") for n in saved)
+    assert not (tmp_path.parent / "escape.png").exists()
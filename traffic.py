@@ -0,0 +1,182 @@
+# traffic.py
+# Opt-in capture of real requests for replay.py.
+# Set XPERT_RECORD_DIR to record a sampled share (XPERT_RECORD_FRACTION) of
+# /analyze, /analyze/stream, /v1/analyze_explain and /v1/chat/completions
+# requests. Each captured request becomes one line of <dir>/requests.jsonl with
+# its arrival time, duration, status and form / JSON payload. Uploaded images are
+# stored once under <dir>/blobs/<sha256>, and client ids and upload file names
+# are replaced by salted hashes. Writing happens on a background thread with a
+# queue bounded by entries (XPERT_RECORD_QUEUE_SIZE) and by the upload bytes it
+# holds (XPERT_RECORD_QUEUE_MB); captures are dropped, never delayed, when it is full.
+# Requests answered with a 4xx (rate limited, too large, bad input) are not captured.
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+RECORD_DIR = os.environ.get("XPERT_RECORD_DIR", "")
+RECORD_FRACTION = float(os.environ.get("XPERT_RECORD_FRACTION", "1.0"))
+RECORD_SALT = os.environ.get("XPERT_RECORD_SALT", "xpert")
+RECORD_QUEUE_SIZE = int(os.environ.get("XPERT_RECORD_QUEUE_SIZE", "256"))
+RECORD_QUEUE_BYTES = int(float(os.environ.get("XPERT_RECORD_QUEUE_MB", "64")) * 1024 * 1024)
+RECORDED_PATHS = ("/analyze", "/analyze/stream", "/v1/analyze_explain", "/v1/chat/completions")
+
+
+def hashed(value, salt=RECORD_SALT):
+    return hashlib.sha256((salt + "\0" + str(value)).encode()).hexdigest()[:16]
+
+
+class TrafficRecorder:
+    """Flask before/after_request hooks that sample and store requests."""
+
+    def __init__(self, directory=RECORD_DIR, fraction=RECORD_FRACTION, paths=RECORDED_PATHS, queue_size=RECORD_QUEUE_SIZE,
+                 queue_bytes=RECORD_QUEUE_BYTES):
+        self.directory = directory
+        self.fraction = fraction
+        self.paths = set(paths)
+        self._blobs = os.path.join(directory, "blobs")
+        os.makedirs(self._blobs, exist_ok=True)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.queue_bytes = queue_bytes
+        self._pending_bytes = 0   # upload bytes held by queued captures
+        self._lock = threading.Lock()
+        self._stats = dict(recorded=0, dropped=0, errors=0)
+        self._thread = threading.Thread(target=self._writer, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def install(self, app, client_id):
+        """Register the hooks on a Flask app. client_id() returns the caller's identity."""
+        from flask import g, request
+
+        @app.before_request
+        def _record_start():
+            if request.path in self.paths and random.random() < self.fraction:
+                g.traffic_start = (time.time(), time.perf_counter())
+
+        @app.after_request
+        def _record_end(resp):
+            start = g.pop("traffic_start", None)
+            if start is None or 400 <= resp.status_code < 500:
+                # 4xx (429, 413, bad input) were rejected before any work: not worth replaying
+                return resp
+            size = self._upload_bytes(request)
+            if not self._reserve(size):
+                return resp   # over the byte budget: drop before reading the uploads
+            try:
+                capture = self._capture(request, client_id(), start[0])
+            except Exception as e:
+                self._unreserve(size)
+                print(f"[traffic] capture failed: {e}")
+                return resp
+
+            def finish():
+                capture.update(duration_ms=round((time.perf_counter() - start[1]) * 1000.0, 2), status=resp.status_code)
+                self._submit(capture)
+
+            if resp.is_streamed:
+                resp.call_on_close(finish)   # time the whole stream, not just the headers
+            else:
+                finish()
+            return resp
+
+    @staticmethod
+    def _upload_bytes(request):
+        """Total size of the uploaded files, without reading them."""
+        if request.is_json:
+            return 0
+        total = 0
+        for f in request.files.values():
+            f.stream.seek(0, os.SEEK_END)
+            total += f.stream.tell()
+            f.stream.seek(0)
+        return total
+
+    def _reserve(self, size):
+        with self._lock:
+            if self._pending_bytes + size > self.queue_bytes:
+                self._stats["dropped"] += 1
+                return False
+            self._pending_bytes += size
+            return True
+
+    def _unreserve(self, size):
+        with self._lock:
+            self._pending_bytes -= size
+
+    def _capture(self, request, client, arrived):
+        capture = dict(
+            ts=round(arrived, 6),
+            method=request.method,
+            path=request.path,
+            query=request.query_string.decode("latin-1"),
+            client=hashed(client),
+            headers={k: v for k, v in request.headers.items() if k.lower() in ("content-type",)},
+        )
+        if request.is_json:
+            capture["json"] = request.get_json(silent=True)
+        else:
+            capture["form"] = request.form.to_dict(flat=True)
+            files = {}
+            for field, f in request.files.items():
+                f.stream.seek(0)
+                data = f.stream.read()
+                ext = os.path.splitext(f.filename or "")[1].lower()
+                files[field] = dict(blob=hashlib.sha256(data).hexdigest(), name=hashed(f.filename) + ext, bytes=len(data), data=data)
+            capture["files"] = files
+        return capture
+
+    def _submit(self, capture):
+        """Queue a capture whose upload bytes were reserved by _reserve()."""
+        size = sum(info["bytes"] for info in capture.get("files", {}).values())
+        try:
+            self._queue.put_nowait(capture)
+        except queue.Full:
+            with self._lock:
+                self._pending_bytes -= size
+                self._stats["dropped"] += 1
+
+    def _writer(self):
+        log_path = os.path.join(self.directory, "requests.jsonl")
+        while True:
+            capture = self._queue.get()
+            try:
+                for info in capture.get("files", {}).values():
+                    data = info.pop("data")
+                    with self._lock:
+                        self._pending_bytes -= info["bytes"]
+                    path = os.path.join(self._blobs, info["blob"])
+                    if not os.path.exists(path):   # content-addressed: each image is stored once
+                        with open(path + ".tmp", "wb") as fh:
+                            fh.write(data)
+                        os.replace(path + ".tmp", path)
+                with open(log_path, "a") as fh:
+                    fh.write(json.dumps(capture) + "\n")
+                with self._lock:
+                    self._stats["recorded"] += 1
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                print(f"[traffic] write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update(pending_bytes=self._pending_bytes)
+        out.update(directory=self.directory, fraction=self.fraction, pending=self._queue.qsize())
+        return out
+
+
+def load_captures(directory):
+    """Captured requests in arrival order (used by replay.py)."""
+    rows = []
+    with open(os.path.join(directory, "requests.jsonl")) as fh:
+        for line in fh:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue   # a torn last line
+    rows.sort(key=lambda r: r["ts"])
+    return rows
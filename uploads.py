@@ -0,0 +1,69 @@
+# uploads.py
+# Bounded request bodies and image sizes.
+# A request body larger than XPERT_MAX_UPLOAD_MB is refused with 413. The limit is
+# enforced as the body streams in, including chunked uploads that send no
+# Content-Length. Uploaded files are spooled in memory up to
+# XPERT_UPLOAD_SPOOL_KB and to a temporary file beyond that, so one request never
+# holds more than that in RAM. Before an image is decoded, its header is checked
+# against a pixel budget (XPERT_MAX_IMAGE_PIXELS). A small file that decodes to a
+# huge bitmap (a "decompression bomb") is therefore refused before any pixels are
+# allocated.
+import os
+import tempfile
+import warnings
+
+from flask import Request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("XPERT_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(float(os.environ.get("XPERT_UPLOAD_SPOOL_KB", "1024")) * 1024)
+MAX_IMAGE_PIXELS = int(float(os.environ.get("XPERT_MAX_IMAGE_PIXELS", "50000000")))   # ~50 MP, 150 MB as RGB
+
+
+class SpooledRequest(Request):
+    """Werkzeug already spools uploaded files, but at a fixed 500 KB. This makes
+    the in-memory share of each file XPERT_UPLOAD_SPOOL_KB, so the memory a
+    request can hold is set per deployment."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
+
+
+def check_image(stream):
+    """Read only the image header and raise RequestEntityTooLarge if decoding it
+    would exceed the pixel budget. The stream is rewound; files that are not
+    images are left for the decoder to reject."""
+    from PIL import Image
+    pos = stream.tell()
+    try:
+        with Image.open(stream) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise RequestEntityTooLarge(f"Image is larger than the limit of {MAX_IMAGE_PIXELS} pixels (XPERT_MAX_IMAGE_PIXELS)")
+    except Exception:
+        return
+    finally:
+        stream.seek(pos)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise RequestEntityTooLarge(
+            f"Image is {width}x{height} pixels, over the limit of {MAX_IMAGE_PIXELS} pixels (XPERT_MAX_IMAGE_PIXELS)")
+
+
+def too_large(e):
+    return jsonify(
+        error=e.description or "Request body too large",
+        max_upload_bytes=MAX_UPLOAD_BYTES,
+        max_image_pixels=MAX_IMAGE_PIXELS,
+    ), 413
+
+
+def install(app):
+    """Apply the limits to a Flask app."""
+    app.request_class = SpooledRequest
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+    app.register_error_handler(RequestEntityTooLarge, too_large)
+    from PIL import Image
+    # also guards decodes that skip check_image (Pillow refuses twice this many
+    # pixels); images in between are refused by check_image, so the warning is noise
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
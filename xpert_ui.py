@@ -1,7 +1,11 @@
 import streamlit as st
+import hashlib
+import io
+import os
 import random
 import time
 import requests
+from PIL import Image, ImageOps
 
 # ---------------------
 # Page config & styling
@@ -97,6 +101,87 @@ def get_ai_response(user_text: str, image=None, role="student"):
         # This handles errors if the JSON structure from the backend is unexpected
         return "ERROR: Invalid JSON format returned by the backend. Check FastAPI logs."
 
+# ---------------------
+# Helper: cached image previews
+# Streamlit reruns this script after every chat message. Sending the full-size
+# upload each time means re-encoding a multi-megapixel X-ray, so a downscaled
+# preview is made once per file (keyed by its content hash) and cached across
+# reruns. Full detail is available as cached 512px tiles at full resolution.
+# ---------------------
+PREVIEW_MAX_SIDE = int(os.environ.get("XPERT_UI_PREVIEW_PX", "1024"))
+TILE_SIZE = 512
+
+
+def file_digest(uploaded):
+    """Content hash of an upload, computed once per uploaded file."""
+    digests = st.session_state.setdefault("file_digests", {})
+    key = getattr(uploaded, "file_id", None) or uploaded.name
+    if key not in digests:
+        digests[key] = hashlib.sha1(uploaded.getvalue()).hexdigest()
+    return digests[key]
+
+
+def display_image(img):
+    """8-bit L or RGB copy of img for display. 16- and 32-bit greyscale (e.g. 16-bit
+    PNG X-rays) is stretched over its own min..max first; a plain convert("L")
+    would clip nearly every pixel to white."""
+    if img.mode.startswith("I") or img.mode == "F":
+        if img.mode != "F":
+            img = img.convert("I")
+        lo, hi = img.getextrema()
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        return img.point(lambda v: (v - lo) * scale).convert("L")
+    return img.convert("L" if img.mode == "L" else "RGB")
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def decoded_image(digest, _data):
+    """Full-resolution decode, shared by the tiles of one image."""
+    return display_image(ImageOps.exif_transpose(Image.open(io.BytesIO(_data))))
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def make_preview(digest, _data, max_side=PREVIEW_MAX_SIDE):
+    """JPEG bytes of the image scaled to fit max_side, plus its full-resolution
+    (width, height) as displayed, i.e. after EXIF rotation."""
+    img = Image.open(io.BytesIO(_data))
+    size = img.size   # before draft() shrinks it
+    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):   # EXIF Orientation: exif_transpose turns it by 90 degrees
+        size = size[::-1]
+    img.draft("RGB", (max_side, max_side))   # JPEG: decode straight at a reduced scale
+    img = ImageOps.exif_transpose(img)
+    img = display_image(img)
+    img.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue(), size
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def make_tile(digest, _data, row, col, tile=TILE_SIZE):
+    """JPEG bytes of one full-resolution tile."""
+    img = decoded_image(digest, _data)
+    box = (col * tile, row * tile, min(img.width, (col + 1) * tile), min(img.height, (row + 1) * tile))
+    out = io.BytesIO()
+    img.crop(box).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def show_upload(uploaded):
+    """Show the cached preview; optionally one full-resolution tile of it."""
+    digest = file_digest(uploaded)
+    data = uploaded.getvalue()
+    preview, (width, height) = make_preview(digest, data)
+    st.image(preview, use_container_width=True, caption=f"{uploaded.name} ({width}x{height})")
+    rows, cols = -(-height // TILE_SIZE), -(-width // TILE_SIZE)
+    if rows * cols > 1 and st.checkbox("Inspect at full resolution", key=f"tiles_{digest}"):
+        c1, c2 = st.columns(2)
+        with c1:
+            row = st.slider("Row", 1, rows, (rows + 1) // 2, key=f"tile_row_{digest}") - 1
+        with c2:
+            col = st.slider("Column", 1, cols, (cols + 1) // 2, key=f"tile_col_{digest}") - 1
+        st.image(make_tile(digest, data, row, col), caption=f"Tile {row + 1},{col + 1} of {rows}x{cols}")
+
 # ---------------------
 # Session state init
 # ---------------------
@@ -225,7 +310,7 @@ if st.session_state.role in ("doctor", "student"):
     st.markdown("<div class='container'>", unsafe_allow_html=True)
     uploaded = st.file_uploader("Drag and drop an X-ray image here (optional)", type=["png", "jpg", "jpeg"])
     if uploaded:
-        st.image(uploaded, use_container_width=True)
+        show_upload(uploaded)
         st.markdown('<div class="uploader">Image uploaded. You can now ask questions about this image.</div>', unsafe_allow_html=True)
     else:
         st.markdown('<div class="uploader">No image uploaded. You can still ask text questions.</div>', unsafe_allow_html=True)